@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from benchmarks.fake_icmp import HGFakeICMP
+from benchmarks.generate_targets import generate_targets, write_targets
+from benchmarks.stand_in import HGStandInServer
+from src.hg_service_monitor import HGServiceMonitor
+from src.util.instrumentation import run_event_loop, PROFILERS
+from src.notifications.pushover.notifications import PushOver
+from src.util.result_handler import RESULT_SUCCESS
+from src.util.target_model import load_targets
+
+ROOT = Path(__file__).resolve().parent.parent
+ADDRESS = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+
+# (result key, True when a higher value is better) compared by --compare
+COMPARED = (("checks_per_second", True),
+            ("drift_avg_ms", False),
+            ("drift_max_ms", False),
+            ("cpu_per_check_us", False),
+            ("rss_per_target_bytes", False),
+            ("startup_seconds", False),
+            ("cached_config_seconds", False),
+            ("first_result_seconds", False),
+            ("loop_lag_p99_ms", False),
+            ("loop_lag_max_ms", False),
+            ("alert_latency_p50_ms", False),
+            ("alert_latency_p95_ms", False))
+
+
+def rss_bytes():
+    """
+    Current resident memory of the process, the peak is reported where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # <-- kB on Linux, bytes on macOS
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class HGBenchRecorder:
+
+    def __init__(self, alerting, failure_count):
+        """
+        Result listener counting checks and remembering the failures that should raise an alert
+
+        :param alerting: targets with ALERT = TRUE
+        :param failure_count: FAILURE_COUNT of the alerting targets
+        """
+        self.alerting = alerting
+        self.failure_count = failure_count
+
+        self.checks = 0
+        self.failures = 0
+        self.seen = set()
+        self.first_result = None
+        self._target_failures = defaultdict(int)
+        self.triggers = defaultdict(deque)  # <-- target: times of the failures that crossed FAILURE_COUNT
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        self.checks += 1
+        if self.first_result is None:
+            self.seen.add(target)
+
+        if status == RESULT_SUCCESS:
+            return
+
+        self.failures += 1
+        if target in self.alerting:
+            self._target_failures[target] += 1
+            if self._target_failures[target] % self.failure_count == 0:
+                self.triggers[target].append(time.time())
+
+    def alert_latencies(self, alerts):
+        """
+        Seconds between the failure raising an alert and the Pushover stub receiving it, coalesced digests
+        match every target they list
+
+        :param alerts: (receive time, message) recorded by the stub
+        """
+        latencies = []
+        for received, message in sorted(alerts):
+            for target in set(ADDRESS.findall(message)):
+                pending = self.triggers.get(target)
+                while pending and pending[0] <= received:
+                    latencies.append(received - pending.popleft())
+
+        return latencies
+
+
+async def wait_for(condition, timeout, poll=0.01):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(poll)
+    return True
+
+
+# metrics printed next to each other for every event loop measured
+SIDE_BY_SIDE = ("checks_per_second", "drift_avg_ms", "drift_max_ms", "cpu_per_check_us", "loop_lag_p50_ms",
+                "loop_lag_p99_ms", "loop_lag_max_ms", "rss_per_target_bytes", "startup_seconds",
+                "alert_latency_p50_ms")
+
+
+async def run_case(count, options):
+    """
+    Monitor a synthetic targets.ini of count targets against the stand-ins and measure it
+
+    :param count: number of targets
+    :param options: parsed command line options
+    """
+    baseline_rss = rss_bytes()
+    workdir = Path(tempfile.mkdtemp(prefix="hg_bench_"))
+
+    sections = generate_targets(count,
+                                http_ratio=options.http_ratio,
+                                interval=options.interval,
+                                port=options.port,
+                                alert_port=options.port + 1,
+                                alert_targets=min(options.alert_targets, count),
+                                failure_count=options.failure_count,
+                                body_mode=options.body_mode,
+                                adaptive=options.adaptive)
+    targets_file = write_targets(workdir / "targets.ini", sections)
+    alerting = {target for target, section in sections.items() if section["ALERT"] == "TRUE"}
+
+    pushover_stub = HGStandInServer(host="127.0.0.1", port=options.pushover_port)
+    await pushover_stub.start()
+
+    fake_icmp = HGFakeICMP(latency=options.icmp_latency,
+                           latency_jitter=options.icmp_latency / 2,
+                           loss_rate=options.icmp_loss,
+                           flapping=alerting,
+                           flapping_rate=options.flapping_rate,
+                           seed=options.seed)
+
+    started = time.perf_counter()
+    monitor = HGServiceMonitor(targets_config=str(targets_file),
+                               output_log=str(workdir / "hg_bench.log"),
+                               web_tail_logs=False,
+                               notify_status=False,
+                               pool_limit=options.pool_limit,
+                               max_concurrent_probes=options.max_concurrent_probes,
+                               log_sampling=options.log_sampling,
+                               alert_coalesce_window=options.alert_coalesce_window,
+                               alert_rate=1000,
+                               alert_burst=1000,
+                               config_poll_interval=0,
+                               profile_dir=str(ROOT / "benchmarks" / "results" / "profiles"),
+                               icmp_prober=fake_icmp)
+
+    # every alert goes to the local stub instead of api.pushover.net
+    monitor.notifiers.register("PUSHOVER", PushOver(connection_pool=monitor.connection_pool,
+                                                    pushover_url=pushover_stub.pushover_url,
+                                                    configuration={"pushover_token_api_key": "benchmark",
+                                                                   "pushover_user_api_key": "benchmark"}))
+
+    recorder = HGBenchRecorder(alerting, options.failure_count)
+    monitor._ssm_result.add_listener(recorder.on_result)
+
+    monitor_task = asyncio.ensure_future(monitor.async_monitor_startup())
+    try:
+        await wait_for(lambda: len(monitor.monitors) == count or monitor_task.done(), timeout=600)
+        startup_seconds = time.perf_counter() - started
+
+        # every target has been probed once after one interval plus the schedule jitter
+        first_result = await wait_for(lambda: len(recorder.seen) == count, timeout=options.interval * 2 + 30)
+        first_result_seconds = time.perf_counter() - started if first_result else None
+        recorder.first_result = first_result_seconds
+
+        await asyncio.sleep(options.warmup)
+        if monitor_task.done():
+            monitor_task.result()  # <-- surface the startup failure
+
+        monitor.scheduler.reset_statistics()
+        monitor.instrumentation.reset_statistics()
+        if options.profile:
+            monitor.instrumentation.start_profiler(options.profile)
+        skipped = monitor.scheduler.statistics["skipped"]
+        checks = recorder.checks
+        cpu = time.process_time()
+        measured = time.perf_counter()
+
+        await asyncio.sleep(options.duration)
+
+        elapsed = time.perf_counter() - measured
+        cpu = time.process_time() - cpu
+        checks = recorder.checks - checks
+        scheduler = monitor.scheduler.statistics
+        instrumentation = monitor.instrumentation.statistics
+        profile = monitor.instrumentation.stop_profiler()
+        rss = rss_bytes()
+
+        # let the last alerts of the window reach the stub
+        await asyncio.sleep(options.alert_coalesce_window + 0.5)
+    finally:
+        monitor_task.cancel()
+        await asyncio.gather(monitor_task, return_exceptions=True)
+        await monitor.connection_pool.close()
+        await pushover_stub.stop()
+
+    # startup_seconds compiled the fresh targets.ini, a restart only reads the cached compiled targets
+    cached = time.perf_counter()
+    load_targets(targets_file)
+    cached_config_seconds = time.perf_counter() - cached
+
+    latencies = recorder.alert_latencies(pushover_stub.alerts)
+    return {"targets": count,
+            "loop": instrumentation["event_loop"],
+            "http_targets": sum(1 for section in sections.values() if section["SERVICE"] == "HTTP"),
+            "icmp_targets": sum(1 for section in sections.values() if section["SERVICE"] == "ICMP"),
+            "startup_seconds": round(startup_seconds, 4),
+            "cached_config_seconds": round(cached_config_seconds, 4),
+            "first_result_seconds": first_result_seconds and round(first_result_seconds, 4),
+            "duration_seconds": round(elapsed, 3),
+            "checks": checks,
+            "checks_per_second": round(checks / elapsed, 2),
+            "expected_checks_per_second": round(count / options.interval, 2),
+            "failures": recorder.failures,
+            "drift_avg_ms": round(scheduler["drift_avg_ms"], 3),
+            "drift_max_ms": round(scheduler["drift_max_ms"], 3),
+            "skipped": scheduler["skipped"] - skipped,
+            "cpu_seconds": round(cpu, 3),
+            "cpu_per_check_us": round(cpu / checks * 1e6, 2) if checks else None,
+            "loop_lag_p50_ms": round(instrumentation["loop_lag_p50_ms"], 3),
+            "loop_lag_p99_ms": round(instrumentation["loop_lag_p99_ms"], 3),
+            "loop_lag_max_ms": round(instrumentation["loop_lag_max_ms"], 3),
+            "probe_cpu_us": {service: round(probe["per_run_us"], 2)
+                             for service, probe in instrumentation["probe_time"].items()},
+            "profile": profile and str(profile),
+            "rss_bytes": rss,
+            "rss_per_target_bytes": round((rss - baseline_rss) / count),
+            "alerts_received": len(pushover_stub.alerts),
+            "alert_latency_samples": len(latencies),
+            "alert_latency_p50_ms": milliseconds(percentile(latencies, 50)),
+            "alert_latency_p95_ms": milliseconds(percentile(latencies, 95)),
+            "alert_latency_max_ms": milliseconds(max(latencies, default=None)),
+            }
+
+
+def _run_case(count, loop, options):
+    # entry point of the case process, the console log handler writes to a file instead of the terminal
+    with open(Path(tempfile.gettempdir()) / f"hg_bench_{count}_{loop}_console.log", 'w') as console, \
+            contextlib.redirect_stderr(console):
+        return run_event_loop(run_case(count, options), use_uvloop=loop == "uvloop")
+
+
+class HGStandInProcess:
+
+    def __init__(self, options):
+        """
+        HTTP stand-in in its own process, its CPU time is never counted as monitor overhead
+        """
+        self.command = [sys.executable, "-m", "benchmarks.stand_in",
+                        "--port", str(options.port),
+                        "--latency", str(options.http_latency),
+                        "--latency-jitter", str(options.http_latency / 2),
+                        "--error-rate", str(options.http_error_rate),
+                        "--body-size", str(options.body_size),
+                        "--flapping-port", str(options.port + 1),
+                        "--flapping-rate", str(options.flapping_rate)]
+        if options.seed is not None:
+            self.command += ["--seed", str(options.seed)]
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        if not self.process.stdout.readline():  # <-- printed once the port is bound
+            raise RuntimeError(f"HTTP stand-in failed to start: {' '.join(self.command)}")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+
+def compare(old, new):
+    """
+    Print the change of every compared result between two benchmark files, matched by target count and event loop
+    """
+    old_cases = {(case["targets"], case.get("loop", "asyncio")): case for case in old["cases"]}
+
+    print(f"{'targets':>8} {'metric':<24} {old['commit']:>14} {new['commit']:>14} {'change':>9}")
+    for case in new["cases"]:
+        loop = case.get("loop", "asyncio")
+        previous = old_cases.get((case["targets"], loop))
+        if previous is None:
+            continue
+
+        for key, higher_is_better in COMPARED:
+            before, after = previous.get(key), case.get(key)
+            if before is None or after is None:
+                continue
+
+            change = (after - before) / before * 100 if before else 0.0
+            regressed = change < -5 if higher_is_better else change > 5
+            metric = key if loop == "asyncio" else f"{key} ({loop})"
+            print(f"{case['targets']:>8} {metric:<24} {before:>14} {after:>14} {change:>+8.1f}%"
+                  f"{'  <-- regression' if regressed else ''}")
+
+
+def side_by_side(cases):
+    """
+    Print the results of every event loop next to each other, one block per target count
+    """
+    loops = list(dict.fromkeys(case["loop"] for case in cases))
+    by_count = defaultdict(dict)
+    for case in cases:
+        by_count[case["targets"]][case["loop"]] = case
+
+    print(f"{'targets':>8} {'metric':<24}" + "".join(f" {loop:>14}" for loop in loops))
+    for count, measured in by_count.items():
+        for key in SIDE_BY_SIDE:
+            values = [measured.get(loop, {}).get(key) for loop in loops]
+            print(f"{count:>8} {key:<24}" + "".join(f" {str(value):>14}" for value in values))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test HGServiceMonitor against local stand-in targets")
+    parser.add_argument("--targets", type=int, nargs="+", default=[10, 1000, 10000],
+                        help="target counts, each one is measured in a fresh process")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured per target count")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--interval", type=float, default=5, help="INTERVAL of every target")
+    parser.add_argument("--http-ratio", type=float, default=0.5, help="fraction of HTTP targets, the rest are ICMP")
+    parser.add_argument("--http-latency", type=float, default=5, help="ms the HTTP stand-in waits before answering")
+    parser.add_argument("--http-error-rate", type=float, default=0.01, help="fraction of dropped HTTP requests")
+    parser.add_argument("--body-size", type=int, default=1024, help="bytes of the HTTP stand-in body")
+    parser.add_argument("--body-mode", default="auto", help="BODY_MODE of the HTTP targets")
+    parser.add_argument("--icmp-latency", type=float, default=5, help="ms round trip of the fake ICMP backend")
+    parser.add_argument("--icmp-loss", type=float, default=0.01, help="fraction of lost fake echoes")
+    parser.add_argument("--alert-targets", type=int, default=10, help="targets alerting to the Pushover stub")
+    parser.add_argument("--flapping-rate", type=float, default=0.5,
+                        help="fraction of failed probes of the alerting targets")
+    parser.add_argument("--failure-count", type=int, default=1, help="FAILURE_COUNT of the alerting targets")
+    parser.add_argument("--alert-coalesce-window", type=float, default=0.5)
+    parser.add_argument("--adaptive", action="store_true",
+                        help="ADAPTIVE intervals, compares probe volume and alert latency with fixed intervals")
+    parser.add_argument("--loops", nargs="+", default=["asyncio"], choices=("asyncio", "uvloop"),
+                        help="event loops measured for every target count, reported side by side")
+    parser.add_argument("--profile", default=None, choices=PROFILERS,
+                        help="profile the measured window, sample writes collapsed stacks for flame graphs")
+    parser.add_argument("--pool-limit", type=int, default=100)
+    parser.add_argument("--max-concurrent-probes", type=int, default=500)
+    parser.add_argument("--log-sampling", default="failures", choices=("all", "failures"))
+    parser.add_argument("--port", type=int, default=18080,
+                        help="port of the HTTP stand-in, alerting targets use the flapping port + 1")
+    parser.add_argument("--pushover-port", type=int, default=18090, help="port of the Pushover stub")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None,
+                        help="result file, defaults to benchmarks/results/<time>-<commit>.json")
+    parser.add_argument("--compare", nargs="+", metavar="RESULT",
+                        help="OLD to compare with this run, or OLD NEW to compare two files without running")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    if options.compare and len(options.compare) == 2:
+        old, new = (json.loads(Path(path).read_text()) for path in options.compare)
+        compare(old, new)
+        return
+
+    commit = git_commit()
+    results = {"commit": commit,
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpu_count": os.cpu_count(),
+               "options": {key: value for key, value in vars(options).items() if key not in ("output", "compare")},
+               "cases": []}
+
+    with HGStandInProcess(options):
+        for count in options.targets:
+            for loop in options.loops:
+                # a fresh process per case, memory and caches of the previous run never leak into the next one
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    case = executor.submit(_run_case, count, loop, options).result()
+
+                results["cases"].append(case)
+                print(f"{count:>6} targets  {case['loop']:<7}  {case['checks_per_second']:>9} checks/s "
+                      f"(expected {case['expected_checks_per_second']})  "
+                      f"drift avg {case['drift_avg_ms']}ms max {case['drift_max_ms']}ms  "
+                      f"cpu {case['cpu_per_check_us']}us/check  loop lag p99 {case['loop_lag_p99_ms']}ms  "
+                      f"rss {case['rss_per_target_bytes']}B/target  startup {case['startup_seconds']}s  "
+                      f"alert p50 {case['alert_latency_p50_ms']}ms"
+                      f"{'  profile ' + case['profile'] if case['profile'] else ''}", flush=True)
+
+    if len(options.loops) > 1:
+        side_by_side(results["cases"])
+
+    output = Path(options.output) if options.output else \
+        ROOT / "benchmarks" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    if options.compare:
+        compare(json.loads(Path(options.compare[0]).read_text()), results)
+
+
+if __name__ == '__main__':
+    main()
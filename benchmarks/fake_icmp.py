@@ -0,0 +1,59 @@
+import asyncio
+import random
+from icmplib import Host
+
+
+class HGFakeICMP:
+
+    def __init__(self,
+                 latency: float = 1.0,
+                 latency_jitter: float = 0.0,
+                 loss_rate: float = 0.0,
+                 flapping=(),
+                 flapping_rate: float = 0.5,
+                 seed: int = None):
+        """
+        Stand-in for the ICMP sockets of icmplib, answers like async_ping without privileges or network traffic
+
+        :param latency: ms round trip reported for every echo
+        :param latency_jitter: ms added or removed at random from the round trip
+        :param loss_rate: fraction of targets reported as lost
+        :param flapping: addresses lost at flapping_rate instead, used by the targets that raise alerts
+        :param flapping_rate: fraction of flapping addresses reported as lost
+        :param seed: seed of the random losses and jitter
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.loss_rate = loss_rate
+        self.flapping = frozenset(flapping)
+        self.flapping_rate = flapping_rate
+        self._random = random.Random(seed)
+
+        self.probes = 0
+        self.lost = 0
+
+    def _host(self, address):
+        self.probes += 1
+        loss_rate = self.flapping_rate if address in self.flapping else self.loss_rate
+        if self._random.random() < loss_rate:
+            self.lost += 1
+            return Host(address, 1, [])
+
+        rtt = max(0.0, self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter))
+        return Host(address, 1, [rtt])
+
+    async def async_ping(self, address, count=1, interval=1, timeout=2, **kwargs):
+        """
+        Drop-in for icmplib.async_ping, one echo is reported whatever count is requested
+        """
+        host = self._host(address)
+        await asyncio.sleep((host.max_rtt or timeout * 1000) / 1000)
+        return host
+
+    async def __call__(self, addresses):
+        """
+        Prober of HGPingSweep, the whole batch waits for the slowest echo like one pass over the shared socket
+        """
+        hosts = [self._host(address) for address in addresses]
+        await asyncio.sleep(max((host.max_rtt for host in hosts), default=0) / 1000)
+        return hosts
@@ -0,0 +1,110 @@
+import argparse
+import configparser
+
+
+def address(network, index):
+    """
+    Unique address of the index-th synthetic target, the 0 and 255 octets are skipped
+
+    :param network: first octet, 127 targets reach a stand-in bound to 0.0.0.0, 10 is only answered by the fake ICMP
+    :param index: position of the target
+    """
+    return f"{network}.{index // 64516 % 254 + 1}.{index // 254 % 254 + 1}.{index % 254 + 1}"
+
+
+def generate_targets(count: int,
+                     http_ratio: float = 0.5,
+                     interval: float = 5,
+                     port: int = 18080,
+                     alert_port: int = None,
+                     alert_targets: int = 0,
+                     failure_count: int = 3,
+                     body_mode: str = "auto",
+                     ms_value: int = 1000,
+                     adaptive: bool = False):
+    """
+    Sections of a synthetic targets.ini, HTTP targets on 127.x.y.z loopback addresses and ICMP targets on 10.x.y.z
+
+    :param count: number of sections
+    :param http_ratio: fraction of HTTP targets, the rest are ICMP
+    :param interval: seconds between two probes of a target
+    :param port: port of the HTTP stand-in
+    :param alert_port: port of the alerting HTTP targets, e.g. the flapping port of the stand-in
+    :param alert_targets: number of targets alerting through Pushover, spread across both services
+    :param failure_count: failures before an alerting target sends an alert
+    :param body_mode: BODY_MODE of the HTTP targets
+    :param ms_value: MS_VALUE latency limit of the HTTP targets
+    :param adaptive: ADAPTIVE intervals for every target
+    """
+    http_count = round(count * http_ratio)
+    alert_every = count // alert_targets if alert_targets else 0
+
+    sections = {}
+    for index in range(count):
+        alert = "TRUE" if alert_every and index % alert_every == 0 and index // alert_every < alert_targets \
+            else "FALSE"
+
+        if index < http_count:
+            sections[address(127, index)] = {"SERVICE": "HTTP",
+                                             "PORT": str(alert_port if alert == "TRUE" and alert_port else port),
+                                             "MS_CHECK": "FALSE",
+                                             "MS_VALUE": str(ms_value),
+                                             "MS_CALC": "GT",
+                                             "BODY_MODE": body_mode.upper(),
+                                             "INTERVAL": str(interval),
+                                             "ALERT": alert,
+                                             "ALERT_SERVICE": "PUSHOVER",
+                                             "FAILURE_COUNT": str(failure_count)}
+        else:
+            sections[address(10, index - http_count)] = {"SERVICE": "ICMP",
+                                                         "INTERVAL": str(interval),
+                                                         "ALERT": alert,
+                                                         "ALERT_SERVICE": "PUSHOVER",
+                                                         "FAILURE_COUNT": str(failure_count)}
+
+        if adaptive:
+            sections[next(reversed(sections))]["ADAPTIVE"] = "TRUE"
+
+    return sections
+
+
+def write_targets(path, sections):
+    configuration_parser = configparser.ConfigParser()
+    configuration_parser.optionxform = str  # <-- keep the upper case keys of the shipped targets.ini
+    configuration_parser.read_dict(sections)
+
+    with open(path, 'w') as targets_file:
+        configuration_parser.write(targets_file)
+
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic targets.ini for HGServiceMonitor benchmarks")
+    parser.add_argument("count", type=int, help="number of targets, e.g. 10 to 50000")
+    parser.add_argument("--output", default="targets.ini")
+    parser.add_argument("--http-ratio", type=float, default=0.5)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--alert-port", type=int, default=None)
+    parser.add_argument("--alert-targets", type=int, default=0)
+    parser.add_argument("--failure-count", type=int, default=3)
+    parser.add_argument("--body-mode", default="auto")
+    parser.add_argument("--adaptive", action="store_true", help="ADAPTIVE intervals for every target")
+    options = parser.parse_args(argv)
+
+    sections = generate_targets(options.count,
+                                http_ratio=options.http_ratio,
+                                interval=options.interval,
+                                port=options.port,
+                                alert_port=options.alert_port,
+                                alert_targets=options.alert_targets,
+                                failure_count=options.failure_count,
+                                body_mode=options.body_mode,
+                                adaptive=options.adaptive)
+    write_targets(options.output, sections)
+    print(f"Wrote {len(sections)} targets to {options.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import random
+import time
+from aiohttp import web
+
+
+class HGStandInServer:
+
+    def __init__(self,
+                 host: str = "0.0.0.0",
+                 port: int = 18080,
+                 latency: float = 0.0,
+                 latency_jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 body_size: int = 0,
+                 flapping_port: int = None,
+                 flapping_rate: float = 0.5,
+                 seed: int = None):
+        """
+        Local HTTP target for load tests, answers every path with the configured latency, failures and body
+
+        :param host: address the server listens on, 0.0.0.0 also answers every 127.x.y.z loopback target
+        :param port: port the server listens on
+        :param latency: ms waited before answering
+        :param latency_jitter: ms added or removed at random from the latency
+        :param error_rate: fraction of requests answered by dropping the connection, the monitor counts 5xx as up
+        :param body_size: bytes of the response body
+        :param flapping_port: second port failing at flapping_rate, used by the targets that raise alerts
+        :param flapping_rate: fraction of dropped connections on flapping_port
+        :param seed: seed of the random failures and jitter, runs with the same seed fail the same requests
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.body = b'x' * body_size
+        self.flapping_port = flapping_port
+        self.flapping_rate = flapping_rate
+        self._random = random.Random(seed)
+        self._runner = None
+
+        self.requests = 0
+        self.errors = 0
+        self.alerts = []  # <-- (receive time, message) posted to the Pushover stub
+
+    async def handle(self, request):
+        self.requests += 1
+
+        delay = self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        error_rate = self.error_rate
+        if self.flapping_port and request.transport.get_extra_info('sockname')[1] == self.flapping_port:
+            error_rate = self.flapping_rate
+
+        if self._random.random() < error_rate:
+            self.errors += 1
+            request.transport.close()  # <-- seen by the monitor as a failed connection
+            return web.Response()
+
+        return web.Response(body=self.body, content_type="text/plain")
+
+    async def handle_pushover(self, request):
+        # same answer as api.pushover.net, the receive time is compared with the failure that raised the alert
+        self.alerts.append((time.time(), request.query.get("message") or ""))
+        return web.json_response({"status": 1, "request": str(len(self.alerts))})
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post("/1/messages.json", self.handle_pushover)
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        return app
+
+    @property
+    def pushover_url(self):
+        return f"http://127.0.0.1:{self.port}/1/messages.json"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port, backlog=4096).start()
+        if self.flapping_port:
+            await web.TCPSite(self._runner, self.host, self.flapping_port, backlog=4096).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _serve(options):
+    server = HGStandInServer(host=options.host,
+                             port=options.port,
+                             latency=options.latency,
+                             latency_jitter=options.latency_jitter,
+                             error_rate=options.error_rate,
+                             body_size=options.body_size,
+                             flapping_port=options.flapping_port,
+                             flapping_rate=options.flapping_rate,
+                             seed=options.seed)
+    await server.start()
+    print(f"Stand-in listening on http://{options.host}:{options.port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP target and Pushover stub for HGServiceMonitor benchmarks")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms waited before answering")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="ms of random latency variation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of dropped connections")
+    parser.add_argument("--body-size", type=int, default=0, help="bytes of the response body")
+    parser.add_argument("--flapping-port", type=int, default=None, help="second port failing at --flapping-rate")
+    parser.add_argument("--flapping-rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=None)
+    options = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_serve(options))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
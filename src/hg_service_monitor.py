@@ -1,11 +1,21 @@
 import logging
-import configparser
 import asyncio
+import os
+import signal
+from functools import partial
 from pathlib import Path
-from src.services.hg_ping import HGPingServiceMonitor
-from src.services.hg_http import HGHttpServiceMonitor
 from src.util.result_handler import HGResultHandler
-from src.notifications.pushover.notifications import PushOver as push_notify
+from src.util.connection_pool import HGConnectionPool
+from src.util.scheduler import HGScheduler, supervise
+from src.util.sharding import HGShardSupervisor
+from src.util.log_pipeline import HGLogPipeline
+from src.util.metrics import HGMetrics
+from src.util.instrumentation import HGInstrumentation, event_loop_name, run_event_loop
+from src.util.result_store import HGResultStore, DAY
+from src.util.topology import HGTopology
+from src.util.target_model import HGService, HGConfigError, compile_sections, load_targets
+from src.notifications.notifier_registry import HGNotifierRegistry
+from src.notifications.alert_dispatcher import HGAlertDispatcher
 
 
 class HGServiceMonitor:
@@ -14,61 +24,241 @@ class HGServiceMonitor:
                  targets_config: str = "config/targets/targets.ini",
                  output_log: str = "/logs/hg_logmonitor.log",
                  web_tail_logs=True,
-                 notify_status: bool = True):
+                 notify_status: bool = True,
+                 pool_limit: int = 100,
+                 pool_limit_per_host: int = 10,
+                 pool_dns_cache_ttl: int = 300,
+                 pool_keepalive_timeout: float = 30,
+                 result_window: int = 100,
+                 max_concurrent_probes: int = 500,
+                 schedule_jitter: float = 1.0,
+                 targets_sections: dict = None,
+                 log_level: int = logging.DEBUG,
+                 log_max_bytes: int = 10 * 1024 * 1024,
+                 log_backup_count: int = 5,
+                 log_rotate_seconds: float = None,
+                 log_sampling: str = "all",
+                 log_success_sample: int = 0,
+                 alert_coalesce_window: float = 5.0,
+                 alert_rate: float = 0.5,
+                 alert_burst: int = 5,
+                 alert_retries: int = 3,
+                 alert_queue_size: int = 1000,
+                 config_poll_interval: float = 5,
+                 web_host: str = "127.0.0.1",
+                 web_port: int = 8080,
+                 storage_path: str = None,
+                 storage_raw_retention_days: float = 7,
+                 storage_minute_retention_days: float = 30,
+                 storage_hour_retention_days: float = 365,
+                 dependency_canary_interval: float = 60,
+                 config_cache: bool = True,
+                 restart_backoff: float = 1.0,
+                 max_restart_backoff: float = 300,
+                 loop_lag_interval: float = 0.1,
+                 probe_time_sample: int = 10,
+                 profile_dir: str = None,
+                 profile_sample_interval: float = 0.005,
+                 use_uvloop: bool = False,
+                 icmp_privileged: bool = False,
+                 icmp_resolve_ttl: float = 300,
+                 icmp_prober=None):
         """
 
         :param targets_config Specify the full path to the configuration file
         :param output_log Specify the full path to the output log file
+        :param web_tail_logs:bool  Serve the status API with target status, log tail and live results
         :param notify_status:bool  Should the service monitor send notifications during startup
+        :param pool_limit:int  Maximum open HTTP connections shared by every monitor and notifier
+        :param pool_limit_per_host:int  Maximum open HTTP connections to a single host
+        :param pool_dns_cache_ttl:int  Seconds resolved addresses are cached by the connection pool
+        :param pool_keepalive_timeout:float  Seconds idle connections are kept alive for reuse
+        :param result_window:int  Default number of results kept in memory per target
+        :param max_concurrent_probes:int  Maximum number of probes in flight at once
+        :param schedule_jitter:float  Fraction of the interval used to spread targets sharing an interval
+        :param targets_sections:dict  Already parsed target sections used instead of reading targets_config
+        :param log_level:int  Minimum level of the records created by the monitor
+        :param log_max_bytes:int  Rotate the output log once it reaches this size, 0 disables size rotation
+        :param log_backup_count:int  Number of rotated output logs kept
+        :param log_rotate_seconds:float  Rotate the output log once it is this old, None disables time rotation
+        :param log_sampling:str  all logs every probe, failures only logs failures and state changes
+        :param log_success_sample:int  With failures sampling still log one success out of this many, 0 logs none
+        :param alert_coalesce_window:float  Seconds alerts are collected and sent as one digest
+        :param alert_rate:float  Messages per second sent to each notifier
+        :param alert_burst:int  Messages a notifier may send at once before alert_rate applies
+        :param alert_retries:int  Delivery attempts after a failed send, with exponential backoff
+        :param alert_queue_size:int  Maximum queued alerts, newer alerts are dropped when full
+        :param config_poll_interval:float  Seconds between checks of targets_config for changes, 0 disables hot reload
+        :param web_host:str  Address the status API listens on
+        :param web_port:int  Port the status API listens on
+        :param storage_path:str  SQLite file storing every result with 1 minute and 1 hour rollups, None disables it
+        :param storage_raw_retention_days:float  Days every single result is kept in storage
+        :param storage_minute_retention_days:float  Days the 1 minute rollups are kept in storage
+        :param storage_hour_retention_days:float  Days the 1 hour rollups are kept in storage
+        :param dependency_canary_interval:float  Seconds between the canary probes of a target whose DEPENDS_ON
+                                                 parent is down, 0 pauses it
+        :param config_cache:bool  Keep the compiled targets next to targets_config and reuse them while the file
+                                  content is unchanged
+        :param restart_backoff:float  Seconds before a crashed probe or service runs again, doubled on every further
+                                      crash
+        :param max_restart_backoff:float  Longest delay before a crashed probe or service runs again
+        :param loop_lag_interval:float  Seconds between two event loop lag samples
+        :param probe_time_sample:int  Time the event loop steps of one probe run out of this many per service
+        :param profile_dir:str  Directory profiles are written to, defaults to profiles next to output_log
+        :param profile_sample_interval:float  Seconds between two stack samples of the sampling profiler
+        :param use_uvloop:bool  Run on the uvloop event loop when it is installed
+        :param icmp_privileged:bool  Ping through raw sockets (root or CAP_NET_RAW) instead of unprivileged datagram
+                                     sockets, which need the process group in net.ipv4.ping_group_range on Linux
+        :param icmp_resolve_ttl:float  Seconds the resolved address of a hostname ICMP target is reused
+        :param icmp_prober:  Async callable(addresses) returning icmplib Hosts, replaces the ICMP sockets (benchmarks)
         """
-        self.pushover_notifier = push_notify()
-        self._ssm_result = HGResultHandler()
+        self.connection_pool = HGConnectionPool(limit=pool_limit,
+                                                limit_per_host=pool_limit_per_host,
+                                                dns_cache_ttl=pool_dns_cache_ttl,
+                                                keepalive_timeout=pool_keepalive_timeout)
+        self.notifiers = HGNotifierRegistry(connection_pool=self.connection_pool,
+                                            internal_logger=logging.getLogger('HGServiceMonitor'))
+        self.alert_dispatcher = HGAlertDispatcher(self.notifiers,
+                                                  queue_size=alert_queue_size,
+                                                  coalesce_window=alert_coalesce_window,
+                                                  notifier_rate=alert_rate,
+                                                  notifier_burst=alert_burst,
+                                                  retries=alert_retries,
+                                                  internal_logger=logging.getLogger('HGServiceMonitor'))
+        self._ssm_result = HGResultHandler(capacity=result_window)
+        
+        # loop lag and probe time are always collected, profilers only run while switched on
+        profile_dir = profile_dir or str(Path(output_log).parent / "profiles")
+        self.instrumentation = HGInstrumentation(loop_lag_interval=loop_lag_interval,
+                                                 probe_time_sample=probe_time_sample,
+                                                 sample_interval=profile_sample_interval,
+                                                 profile_dir=profile_dir,
+                                                 internal_logger=logging.getLogger('HGServiceMonitor'))
+        
+        # dependents of a down parent are slowed to a canary and their alerts folded into the parent's
+        self.topology = HGTopology(canary_interval=dependency_canary_interval,
+                                   on_canary=self.set_target_canary,
+                                   internal_logger=logging.getLogger('HGServiceMonitor'))
+        self._ssm_result.add_listener(self.topology.on_result)
+        self.alert_dispatcher.add_filter(self.topology.fold_alert)
         
         self.notify_status = notify_status
         self.targets_configuration = None
         
         self.enabled_targets = []
-        self.targets = None
+        self.monitors = {}  # <-- target: running HGPingServiceMonitor or HGHttpServiceMonitor
+        self.targets = None  # <-- compiled HGTargets of targets_config, validated before any monitor starts
         self.disabled_targets = None
         self.targets_config_file = targets_config  # <-- make cross platform ready
-        self.configuration_parser = configparser.ConfigParser(strict=False)
+        self.config_cache = config_cache
         self.logger = None
         self.output_log = output_log
+        self.ping_sweep = None
+        self.scheduler = None
+        self.max_concurrent_probes = max_concurrent_probes
+        self.schedule_jitter = schedule_jitter
+        self.targets_sections = targets_sections
+        self.log_pipeline = None
+        self.log_level = log_level
+        self.log_max_bytes = log_max_bytes
+        self.log_backup_count = log_backup_count
+        self.log_rotate_seconds = log_rotate_seconds
+        self.log_sampling = log_sampling
+        self.log_success_sample = log_success_sample
+        self.config_poll_interval = config_poll_interval
+        self.web_tail_logs = web_tail_logs
+        self.web_host = web_host
+        self.web_port = web_port
+        self.web_status = None
+        self.metrics = None
+        self.storage_path = storage_path
+        self.storage_retention = (storage_raw_retention_days,
+                                  storage_minute_retention_days,
+                                  storage_hour_retention_days)
+        self.result_store = None
+        self.icmp_prober = icmp_prober
+        self.icmp_privileged = icmp_privileged
+        self.icmp_resolve_ttl = icmp_resolve_ttl
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.use_uvloop = use_uvloop
+        self._config_stat = None
+        self._reload_lock = None  # <-- created on the running loop
+        
+        # forwarded to every worker process in sharded mode
+        self.monitor_options = {"output_log": output_log,
+                                "pool_limit": pool_limit,
+                                "pool_limit_per_host": pool_limit_per_host,
+                                "pool_dns_cache_ttl": pool_dns_cache_ttl,
+                                "pool_keepalive_timeout": pool_keepalive_timeout,
+                                "result_window": result_window,
+                                "max_concurrent_probes": max_concurrent_probes,
+                                "schedule_jitter": schedule_jitter,
+                                "log_level": log_level,
+                                "log_max_bytes": log_max_bytes,
+                                "log_backup_count": log_backup_count,
+                                "log_rotate_seconds": log_rotate_seconds,
+                                "log_sampling": log_sampling,
+                                "log_success_sample": log_success_sample,
+                                "alert_coalesce_window": alert_coalesce_window,
+                                "alert_rate": alert_rate,
+                                "alert_burst": alert_burst,
+                                "alert_retries": alert_retries,
+                                "alert_queue_size": alert_queue_size,
+                                "dependency_canary_interval": dependency_canary_interval,
+                                "restart_backoff": restart_backoff,
+                                "max_restart_backoff": max_restart_backoff,
+                                "loop_lag_interval": loop_lag_interval,
+                                "probe_time_sample": probe_time_sample,
+                                "profile_dir": profile_dir,
+                                "profile_sample_interval": profile_sample_interval,
+                                "use_uvloop": use_uvloop,
+                                "icmp_privileged": icmp_privileged,
+                                "icmp_resolve_ttl": icmp_resolve_ttl,
+                                }
+    
+    @property
+    def pool_statistics(self):
+        return self.connection_pool.statistics
     
     def enable_service_monitor(self):
         # start async main loop
-        asyncio.run(self.async_monitor_startup())
+        run_event_loop(self.async_monitor_startup(), use_uvloop=self.use_uvloop)
+    
+    def enable_sharded_service_monitor(self, workers: int = None):
+        """
+        Split the targets across worker processes, each running its own event loop
+
+        :param workers:int  Number of worker processes, defaults to the CPU count
+        """
+        run_event_loop(self.async_sharded_startup(workers=workers), use_uvloop=self.use_uvloop)
     
     async def logging_startup(self):
         self.logger = logging.getLogger('HGServiceMonitor')
-        self.logger.setLevel(logging.DEBUG)
-        
-        # create console handler and set level to debug
-        console_h = logging.StreamHandler()
+        self.logger.setLevel(self.log_level)
         
         requested_log_file = Path(self.output_log)
         
         if not requested_log_file.is_file():
             Path(requested_log_file.parent).mkdir(parents=True, exist_ok=True)
         
-        file_h = logging.FileHandler(filename=self.output_log, mode="a+", encoding="utf8")
-        
-        console_h.setLevel(logging.INFO)
-        file_h.setLevel(logging.DEBUG)
-        
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(module)s - %(message)s  ')
-        
-        # add formatter to ch
-        console_h.setFormatter(formatter)
-        file_h.setFormatter(formatter)
-        
-        # add ch to logger
-        self.logger.addHandler(console_h)
-        self.logger.addHandler(file_h)
+        # records are queued here and formatted/written by a background listener thread
+        self.log_pipeline = HGLogPipeline(self.output_log,
+                                          max_bytes=self.log_max_bytes,
+                                          backup_count=self.log_backup_count,
+                                          rotate_seconds=self.log_rotate_seconds,
+                                          sampling=self.log_sampling,
+                                          success_sample=self.log_success_sample)
+        self.log_pipeline.start(self.logger)
         
         # log message
         self.logger.info("HGServiceMonitor is online and looking for targets.")
+        
+        loop_name = event_loop_name()
+        if self.use_uvloop and loop_name != "uvloop":
+            self.logger.warning("uvloop is not installed, HGServiceMonitor runs on the asyncio event loop")
+        else:
+            self.logger.info("HGServiceMonitor runs on the %s event loop", loop_name)
     
     async def async_monitor_startup(self):
         #start logging
@@ -83,12 +273,81 @@ class HGServiceMonitor:
         if not res == [None]:  # <-- script failed to startup
             await self.failed_startup(fail_reason=res)
         
-        await self.add_monitor_targets()
-        await self._monitor_target()
+        try:
+            self.storage_startup()
+            await self.add_monitor_targets()
+            await self._monitor_target()
+        finally:
+            self.instrumentation.close()
+            await self.alert_dispatcher.close()  # <-- notifiers send the last alerts through the pool
+            self.logger.info("HGServiceMonitor connection pool statistics: %s", self.pool_statistics)
+            await self.connection_pool.close()
+            self.storage_shutdown()
+            self.log_pipeline.stop()
+    
+    async def async_sharded_startup(self, workers: int = None):
+        await self.logging_startup()
+        
+        try:
+            await self.read_config()
+        except HGConfigError as e:
+            await self.failed_startup(fail_reason=e)
+        
+        # workers get the compiled targets, nothing is parsed again in the worker processes
+        sections = {target.name: target for target in self.targets}
+        
+        # the workers slow down the dependents of their own targets, alerts are folded here across every shard
+        self.topology.load(self.targets)
+        supervisor = HGShardSupervisor(sections=sections,
+                                       workers=workers,
+                                       monitor_options=self.monitor_options,
+                                       alert_dispatcher=self.alert_dispatcher,
+                                       internal_logger=self.logger)
+        
+        self._ssm_result = supervisor.results
+        self._ssm_result.add_listener(self.topology.on_result)
+        self.storage_startup()
+        self.load_notifiers(self.targets)
+        self.logger.info(f"HGServiceMonitor is starting {supervisor.workers} shard(s) "
+                         f"attempting to monitor {len(sections)} target(s).")
+        
+        if self.notify_status:
+            self.alert_dispatcher.submit(f"HGServiceMonitor is starting {supervisor.workers} shard(s) "
+                                         f"attempting to monitor {len(sections)} target(s).")
+        
+        services = [("HGShardSupervisor", supervisor.run), ("Loop lag probe", self.instrumentation.measure_loop_lag)]
+        self.instrumentation.enable_signals()
+        if self.web_tail_logs:
+            services += self.web_status_startup()
+        
+        try:
+            await self._supervise(services)
+        finally:
+            self.instrumentation.close()
+            await self.alert_dispatcher.close()
+            await self.connection_pool.close()
+            self.storage_shutdown()
+            self.log_pipeline.stop()
+    
+    def load_notifiers(self, targets):
+        """
+        Create the notifiers referenced by alerting targets once, backends nobody references are never imported
+        
+        :param targets: iterable of compiled HGTargets
+        """
+        services = {target.alert_service for target in targets if target.alert}
+        if self.notify_status:
+            services.add(self.alert_dispatcher.default_service)
+        
+        for service in services:
+            if self.notifiers.get(service) is None:
+                self.logger.error(f"ALERT_SERVICE {service} is not available, alerts fall back to "
+                                  f"{self.alert_dispatcher.default_service}")
     
     async def failed_startup(self, fail_reason=None):
         self.logger.debug("An error occurred during startup the program will now exit")
-        print(fail_reason)
+        for reason in fail_reason if isinstance(fail_reason, list) else [fail_reason]:
+            print(reason)
         exit()
     
     async def read_config(self, configuration="config/targets/targets.ini"):
@@ -96,36 +355,37 @@ class HGServiceMonitor:
         self.logger.info("HGServiceMonitor configuration file import started")
         
         try:
-            self.targets_configuration = self.configuration_parser.read(self.targets_config_file)
-        except Exception as e:
+            if self.targets_sections is not None:
+                self.targets = compile_sections(self.targets_sections, internal_logger=self.logger)
+            else:
+                self._config_stat = self._targets_config_stat()
+                self.targets = load_targets(self.targets_config_file, use_cache=self.config_cache,
+                                            internal_logger=self.logger)
+                self.targets_configuration = [self.targets_config_file]
+        except HGConfigError as e:
+            # every invalid section is reported at once and no probe is started
+            self.logger.error(e)
+            raise
+        except OSError as e:
+            self.targets = []
             self.logger.info(e)
         
         self.logger.info("HGServiceMonitor configuration file import finished")
     
     async def add_monitor_targets(self, targets_config=None):
         
-        self.logger.debug([item for item in self.configuration_parser.items()])
+        self.enabled_targets.extend(self.targets or ())
         
-        for host in self.configuration_parser.sections():
-            
-            building_targets = {"target": host}
-            for key, value in self.configuration_parser[host].items():
-                if key in ["alert", "ms_check"]:
-                    
-                    if value.lower() == "true":
-                        value = True
-                    else:
-                        value = False
-                
-                building_targets[key] = value
-            
-            self.enabled_targets.append(building_targets)
+        # DEPENDS_ON was validated by compile_sections, unknown sections and cycles never get here
+        self.topology.load(self.enabled_targets)
         
-        self.logger.info(f"Enabled Targets: {self.enabled_targets}")
+        enabled = ", ".join(target.name for target in self.enabled_targets)
+        self.logger.info("Enabled Targets: %s", enabled)
+        self.load_notifiers(self.enabled_targets)
         
         # Alert on startup
         if self.notify_status:
-            await self.pushover_notifier.send_alert(f"Enabled Targets: {self.enabled_targets}")
+            self.alert_dispatcher.submit(f"Enabled Targets: {enabled}")
         
         return self.enabled_targets
     
@@ -133,43 +393,312 @@ class HGServiceMonitor:
         self.logger.info(f"HGServiceMonitor is starting attempting to monitor {len(self.enabled_targets)} target(s).")
         
         if self.notify_status:
-            await self.pushover_notifier.send_alert(
-                message=f"HGServiceMonitor is starting attempting to monitor {len(self.enabled_targets)} target(s).")
+            self.alert_dispatcher.submit(
+                f"HGServiceMonitor is starting attempting to monitor {len(self.enabled_targets)} target(s).")
+        
+        self.scheduler = HGScheduler(max_concurrency=self.max_concurrent_probes,
+                                     jitter=self.schedule_jitter,
+                                     restart_backoff=self.restart_backoff,
+                                     max_restart_backoff=self.max_restart_backoff,
+                                     instrumentation=self.instrumentation,
+                                     internal_logger=self.logger)
         
-        service_dispatcher = []
+        await self.warm_results(self.enabled_targets)
         for target in self.enabled_targets:
+            self.start_monitor_target(target)
+        
+        # every probe is fired by the central scheduler on fixed-rate deadlines
+        services = [("HGScheduler", self.scheduler.run), ("Loop lag probe", self.instrumentation.measure_loop_lag)]
+        self.instrumentation.enable_signals()
+        
+        # targets.ini is watched for changes, sharded workers get their sections passed in and skip this
+        if self.targets_sections is None:
+            self._enable_reload_signal()
+            if self.config_poll_interval:
+                services.append(("Config watcher", self._watch_config))
+        
+        if self.web_tail_logs:
+            services += self.web_status_startup()
+        
+        if self.enabled_targets:
+            await self._supervise(services)
+    
+    async def _supervise(self, services):
+        """
+        Run every (name, coroutine function) service until it returns, a crashed service is restarted with backoff
+        """
+        await asyncio.gather(*(supervise(name, service, self.logger,
+                                         backoff=self.restart_backoff,
+                                         max_backoff=self.max_restart_backoff) for name, service in services))
+    
+    def storage_startup(self):
+        if not self.storage_path:
+            return None
+        
+        raw_days, minute_days, hour_days = self.storage_retention
+        self.result_store = HGResultStore(self.storage_path,
+                                          raw_retention=raw_days * DAY,
+                                          minute_retention=minute_days * DAY,
+                                          hour_retention=hour_days * DAY,
+                                          internal_logger=self.logger)
+        self._ssm_result.add_listener(self.result_store.on_result)
+        self.result_store.start()
+        
+        self.logger.info(f"HGServiceMonitor is storing results in {self.storage_path}")
+        return self.result_store
+    
+    def storage_shutdown(self):
+        # the writer thread flushes the queued results and rolls up the closed minutes before exiting
+        if self.result_store is not None:
+            self.result_store.close()
+            self.logger.info("HGServiceMonitor result store statistics: %s", self.result_store.statistics)
+    
+    async def warm_results(self, targets):
+        """
+        Fill the in memory windows of new targets with their last stored results, alerts and statistics resume
+        from them. Every target is read by one query in an executor, the event loop keeps running meanwhile
+        
+        :param targets: compiled HGTargets about to be started
+        """
+        if self.result_store is None:
+            return None
+        
+        buffers = {target.name: self._ssm_result.register(target.name, capacity=target.result_window)
+                   for target in targets if target.name not in self._ssm_result.results}
+        if not buffers:
+            return None
+        
+        recent = await asyncio.get_running_loop().run_in_executor(
+            None, self.result_store.recent_many, {name: buffer.capacity for name, buffer in buffers.items()})
+        
+        for name, results in recent.items():
+            for timestamp, status, latency, error_code in results:
+                buffers[name].post(status, latency=latency, error_code=error_code, timestamp=timestamp, notify=False)
+        
+        return buffers
+    
+    def web_status_startup(self):
+        """
+        Create the status API and its Prometheus metrics, returns the (name, coroutine function) services to run next
+        to the monitors
+        """
+        # fastapi and uvicorn are only imported when the status API is enabled
+        from src.util.web_status import HGWebStatus
+        
+        self.metrics = HGMetrics(instrumentation=self.instrumentation)
+        self._ssm_result.add_listener(self.metrics.on_result)
+        
+        # process internals are only read when /metrics is scraped
+        self.metrics.add_gauge("hg_monitors_active", "Targets being monitored", lambda: len(self._ssm_result.results))
+        self.metrics.add_gauge("hg_probes_in_flight", "Probes currently running",
+                               lambda: self.scheduler.in_flight if self.scheduler else 0)
+        self.metrics.add_gauge("hg_probes_skipped_total", "Deadlines skipped because the previous probe was running",
+                               lambda: sum(job.skipped for job in self.scheduler.jobs.values()) if self.scheduler
+                               else 0, metric_type="counter")
+        for name, help_text in (("timeouts", "Probes cancelled at their deadline"),
+                                ("errors", "Probes that crashed and were restarted with backoff")):
+            self.metrics.add_gauge(f"hg_probe_{name}_total", help_text,
+                                   lambda key=name: self.scheduler.statistics[key] if self.scheduler else 0,
+                                   metric_type="counter")
+        self.metrics.add_gauge("hg_event_loop_tasks", "Tasks pending on the event loop",
+                               lambda: len(asyncio.all_tasks()))
+        self.metrics.add_gauge("hg_targets_paused", "Targets only probed by a canary because a parent is down",
+                               lambda: len(self.topology.paused))
+        self.metrics.add_gauge("hg_alert_queue_depth", "Alerts waiting to be sent",
+                               lambda: self.alert_dispatcher.queue_depth)
+        for name in ("sent", "failed", "dropped", "throttled", "suppressed"):
+            self.metrics.add_gauge(f"hg_alerts_{name}_total", f"Alerts {name}",
+                                   lambda key=name: self.alert_dispatcher.statistics[key], metric_type="counter")
+        self.metrics.add_gauge("hg_log_records_dropped_total", "Log records dropped because the log queue was full",
+                               lambda: self.log_pipeline.queue_handler.dropped, metric_type="counter")
+        
+        self.web_status = HGWebStatus(self._ssm_result,
+                                      log_file=self.output_log,
+                                      metrics=self.metrics,
+                                      instrumentation=self.instrumentation,
+                                      host=self.web_host,
+                                      port=self.web_port,
+                                      internal_logger=self.logger)
+        return [("HGWebStatus", self.web_status.serve)]
+    
+    def start_monitor_target(self, target):
+        """
+        Create the monitor of a target and register it with the ping sweep or the scheduler, callers warm its
+        result window with warm_results first
+        
+        :param target: compiled HGTarget
+        """
+        # services are imported with their first target, an ICMP only setup never loads aiohttp
+        if target.service is HGService.ICMP:
+            from src.services.hg_ping import HGPingServiceMonitor
+            
+            monitor = HGPingServiceMonitor(target=target.name,
+                                           interval=target.interval,
+                                           _target_options=target,
+                                           _results_tracker=self._ssm_result,
+                                           _connection_pool=self.connection_pool,
+                                           _alert_dispatcher=self.alert_dispatcher,
+                                           privileged=self.icmp_privileged,
+                                           internal_logger=self.logger)
+            
+            self._add_to_sweep(monitor)
+        
+        else:  # <-- HTTP, HTTPS and WAN
+            from src.services.hg_http import HGHttpServiceMonitor
+            
+            monitor = HGHttpServiceMonitor(target=target.name,
+                                           interval=target.interval,
+                                           _target_options=target,
+                                           _results_tracker=self._ssm_result,
+                                           _connection_pool=self.connection_pool,
+                                           _alert_dispatcher=self.alert_dispatcher,
+                                           internal_logger=self.logger)
+            
+            self.scheduler.add_job(target.name, monitor.interval, monitor.check_target, cadence=monitor.cadence,
+                                   timeout=monitor.timeout, service=target.service.value)
+        
+        self.monitors[target.name] = monitor
+        return monitor
+    
+    async def close_monitor_target(self, target, keep_results: bool = False):
+        """
+        Stop probing a target, an in flight HTTP probe is cancelled
+        
+        :param target: section name of the target
+        :param keep_results: keep the result buffer so a restarted monitor continues the same history
+        """
+        monitor = self.monitors.pop(target, None)
+        if monitor is None:
+            return None
+        
+        if monitor.config.service is HGService.ICMP:
+            self._remove_from_sweep(monitor)
+        else:
+            self.scheduler.remove_job(target)
+        
+        if not keep_results:
+            self._ssm_result.remove_result(target)
+            if self.metrics is not None:
+                self.metrics.remove_target(target)
+        
+        return monitor
+    
+    def _add_to_sweep(self, monitor):
+        # every ICMP target is probed by one shared sweep engine grouped by interval
+        if self.ping_sweep is None:
+            from src.services.hg_ping_sweep import HGPingSweep
+            self.ping_sweep = HGPingSweep(privileged=self.icmp_privileged, resolve_ttl=self.icmp_resolve_ttl,
+                                          prober=self.icmp_prober, internal_logger=self.logger)
+        
+        interval = float(monitor.sweep_interval)
+        if interval not in self.ping_sweep.buckets:
+            self.scheduler.add_job(f"ICMP:{interval}", interval, partial(self.ping_sweep.sweep, interval),
+                                   service=HGService.ICMP.value)
+        self.ping_sweep.add_monitor(monitor)
+    
+    def _remove_from_sweep(self, monitor):
+        # the sweep job of an interval goes away with its last target
+        if self.ping_sweep.remove_monitor(monitor):
+            self.scheduler.remove_job(f"ICMP:{float(monitor.sweep_interval)}")
+    
+    def set_target_canary(self, target, interval=None):
+        """
+        Probe a target at a slow canary interval while a target it depends on is down
+        
+        :param target: section name of the target
+        :param interval: seconds between two canary probes, 0 pauses the target, None resumes its own interval
+        """
+        monitor = self.monitors.get(target)
+        if monitor is None:
+            return None
+        
+        if monitor.config.service is HGService.ICMP:
+            # canaries are swept in the bucket of their canary interval
+            self._remove_from_sweep(monitor)
+            monitor.canary_interval = interval
+            if interval != 0:
+                self._add_to_sweep(monitor)
+        else:
+            self.scheduler.set_canary(target, interval)
+        
+        return monitor
+    
+    def _targets_config_stat(self):
+        try:
+            stat = os.stat(self.targets_config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _enable_reload_signal(self):
+        # SIGHUP is not available on Windows and signal handlers can only be set from the main thread
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP,
+                                                          lambda: asyncio.ensure_future(self.reload_config()))
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            self.logger.debug("SIGHUP reload is not available on this platform")
+    
+    async def _watch_config(self):
+        while True:
+            await asyncio.sleep(self.config_poll_interval)
+            
+            if self._targets_config_stat() != self._config_stat:
+                await self.reload_config()
+    
+    async def reload_config(self):
+        """
+        Re-read targets_config and only start, stop or restart the targets whose section changed,
+        untouched targets keep running and changed targets keep their result history
+        """
+        self._reload_lock = self._reload_lock or asyncio.Lock()
+        
+        async with self._reload_lock:
+            self._config_stat = self._targets_config_stat()
+            
+            # invalid values, unknown DEPENDS_ON sections and DEPENDS_ON cycles are all HGConfigErrors
+            try:
+                updated = {target.name: target for target in load_targets(self.targets_config_file,
+                                                                            use_cache=self.config_cache,
+                                                                            internal_logger=self.logger)}
+            except Exception as e:
+                self.logger.error(f"Reload of {self.targets_config_file} failed, keeping the running targets: {e}")
+                return None
+            
+            current = {target.name: target for target in self.enabled_targets}
+            removed = [host for host in current if host not in updated]
+            added = [host for host in updated if host not in current]
+            changed = [host for host in updated if host in current and updated[host] != current[host]]
+            
+            for host in removed:
+                await self.close_monitor_target(host)
+            
+            for host in changed:
+                # the ring buffer is only kept when its capacity did not change
+                same_window = updated[host].result_window == current[host].result_window
+                await self.close_monitor_target(host, keep_results=same_window)
+            
+            self.load_notifiers([updated[host] for host in added + changed])
+            await self.warm_results([updated[host] for host in added + changed])
+            for host in added + changed:
+                try:
+                    self.start_monitor_target(updated[host])
+                except Exception as e:
+                    self.logger.error(f"Unable to start target {host}: {e}")
+                    updated.pop(host)
+            
+            self.targets = list(updated.values())
+            self.enabled_targets = list(updated.values())
+            
+            # new and restarted dependents of a parent that is still down start as canaries
+            try:
+                self.topology.load(self.enabled_targets, restarted=changed)
+            except ValueError as e:
+                self.logger.error(f"DEPENDS_ON ignored after the reload of {self.targets_config_file}: {e}")
             
-            if target['service'] == "ICMP":
-                
-                # only pass _target_options and parse the values within the service monitor
-                service_dispatcher.append(HGPingServiceMonitor(target=target['target'],
-                                                               interval=float(target['interval']),
-                                                               _target_options=target,
-                                                               _results_tracker=self._ssm_result,
-                                                               internal_logger=self.logger).ping_target())
+            self.logger.info(f"HGServiceMonitor reloaded {self.targets_config_file}: {len(added)} added, "
+                             f"{len(removed)} removed, {len(changed)} changed, {len(self.enabled_targets)} target(s)")
             
-            elif target['service'] == "HTTP" or "HTTPS":
-                
-                service_dispatcher.append(HGHttpServiceMonitor(target=target['target'],
-                                                               interval=float(target['interval']),
-                                                               port=target.get('port'),
-                                                               service=target['service'],
-                                                               _target_options=target,
-                                                               _results_tracker=self._ssm_result,
-                                                               internal_logger=self.logger).get_target())
-        
-        # task added to list above, this list will not be sent to gather to perform monitoring asynchronously
-        while self.enabled_targets:
-            res = await asyncio.gather(*service_dispatcher, return_exceptions=True)
-            # add a check to remove monitor items... hardlinks on async task may help remove them
-            # exceptions should be returned and remove the target from the list
-            if res:
-                # need to sort through errors
-                print(res)
-                break
-    
-    async def close_monitor_target(self):
-        pass
+            return added, removed, changed
 
 
 if __name__ == 'main':
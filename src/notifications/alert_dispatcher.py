@@ -0,0 +1,261 @@
+import asyncio
+import time
+
+
+class HGTokenBucket:
+
+    def __init__(self, rate: float, burst: float = 1):
+        """
+        Token bucket used to rate limit alerts
+
+        :param rate: tokens added per second
+        :param burst: maximum tokens stored
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    @property
+    def delay(self):
+        # seconds until the next token is available
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class HGAlertDispatcher:
+
+    def __init__(self,
+                 notifiers: dict,
+                 default_service: str = "PUSHOVER",
+                 queue_size: int = 1000,
+                 coalesce_window: float = 5.0,
+                 digest_limit: int = 20,
+                 notifier_rate: float = 0.5,
+                 notifier_burst: int = 5,
+                 retries: int = 3,
+                 retry_backoff: float = 1.0,
+                 message_limit: int = 1024,
+                 internal_logger=None):
+        """
+        Bounded alert queue drained by a background sender, probes only enqueue and never wait on notification I/O
+
+        :param notifiers: HGNotifierRegistry or mapping of ALERT_SERVICE name to notifier with async send_alert(message)
+        :param default_service: notifier used when an alert names an unknown service
+        :param queue_size: maximum queued alerts, newer alerts are dropped when full
+        :param coalesce_window: seconds alerts are collected and sent as one digest per notifier
+        :param digest_limit: maximum alerts listed in one digest, the rest are counted
+        :param notifier_rate: messages per second sent to each notifier
+        :param notifier_burst: messages a notifier may send at once before the rate applies
+        :param retries: attempts after the first failed send
+        :param retry_backoff: first retry delay, doubled on every attempt
+        :param message_limit: maximum characters of a message, Pushover accepts 1024
+        :param internal_logger: Class access to store log files
+        """
+        self.notifiers = notifiers
+        self.default_service = default_service
+        self.coalesce_window = coalesce_window
+        self.digest_limit = digest_limit
+        self.notifier_rate = notifier_rate
+        self.notifier_burst = notifier_burst
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.message_limit = message_limit
+        self._internal_logger = internal_logger
+
+        self._queue_size = queue_size
+        self._queue = None
+        self._task = None
+        self._batch = []  # <-- alerts taken off the queue during the coalesce window
+        self._sending = None  # <-- task delivering the last batch, close waits for it
+        self._notifier_buckets = {}
+        self._target_buckets = {}
+        self._filters = []
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.retried = 0
+        self.suppressed = 0
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def statistics(self):
+        return {"queued": self.queue_depth,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "suppressed": self.suppressed,
+                }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=self._queue_size)
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def add_filter(self, alert_filter):
+        """
+        Register a callable(message, target) run on every submitted alert, it returns the message to queue,
+        possibly rewritten, or None to suppress the alert
+        """
+        self._filters.append(alert_filter)
+
+    def submit(self, message, target=None, service=None, throttle=None):
+        """
+        Queue an alert without waiting, returns False when the alert was throttled or dropped
+
+        :param message: alert text
+        :param target: target the alert belongs to, used for the ALERT_THROTTLE rate limit
+        :param service: ALERT_SERVICE name of the notifier
+        :param throttle: minimum seconds between two alerts of the same target
+        """
+        self.start()
+
+        for alert_filter in self._filters:
+            message = alert_filter(message, target)
+            if message is None:
+                self.suppressed += 1
+                return False
+
+        if target is not None and throttle:
+            bucket = self._target_buckets.get(target)
+            if bucket is None or bucket.rate != 1 / float(throttle):
+                bucket = self._target_buckets[target] = HGTokenBucket(rate=1 / float(throttle), burst=1)
+
+            if not bucket.consume():
+                self.throttled += 1
+                self._internal_logger.debug('Throttled alert for %s', target)
+                return False
+
+        try:
+            self._queue.put_nowait((str(service or self.default_service).upper(), message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._internal_logger.warning('Alert queue is full, dropped alert %s', message)
+            return False
+
+        return True
+
+    def _digest(self, messages):
+        if len(messages) == 1:
+            return messages[0][:self.message_limit]
+
+        listed = messages[:self.digest_limit]
+        digest = f'{len(messages)} alerts:\n' + '\n'.join(listed)
+        if len(messages) > len(listed):
+            digest += f'\n(+{len(messages) - len(listed)} more)'
+
+        return digest[:self.message_limit]
+
+    async def _send(self, service, message):
+        notifier = self.notifiers.get(service)
+        if notifier is None and service != self.default_service:
+            self._internal_logger.warning('No notifier for ALERT_SERVICE %s, using %s', service, self.default_service)
+            service, notifier = self.default_service, self.notifiers.get(self.default_service)
+
+        if notifier is None:
+            self.failed += 1
+            self._internal_logger.error('No notifier available, dropped alert %s', message)
+            return False
+
+        bucket = self._notifier_buckets.setdefault(service, HGTokenBucket(rate=self.notifier_rate,
+                                                                          burst=self.notifier_burst))
+
+        for attempt in range(self.retries + 1):
+            while not bucket.consume():
+                await asyncio.sleep(bucket.delay)
+
+            try:
+                status = await notifier.send_alert(message=message)
+            except Exception as e:
+                status = None
+                self._internal_logger.info('Sending alert with %s raised %r', service, e)
+            else:
+                # notifiers that do not report a status are treated as delivered
+                if status is None or status < 400:
+                    self.sent += 1
+                    return True
+
+                # a rejected request will be rejected again, only retry rate limits and server errors
+                if status != 429 and status < 500:
+                    break
+
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+        self.failed += 1
+        self._internal_logger.warning('Unable to deliver alert with %s: %s', service, message)
+        return False
+
+    async def _drain(self, batch):
+        by_service = {}
+        for service, message in batch:
+            by_service.setdefault(service, []).append(message)
+
+        await asyncio.gather(*[self._send(service, self._digest(messages))
+                               for service, messages in by_service.items()])
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._batch = [await self._queue.get()]
+
+            # collect every alert raised inside the coalesce window into one digest
+            deadline = loop.time() + self.coalesce_window
+            while (remaining := deadline - loop.time()) > 0:
+                # asyncio.wait, unlike wait_for on Python 3.11, never swallows the cancellation of close
+                getter = loop.create_task(self._queue.get())
+                try:
+                    await asyncio.wait((getter,), timeout=remaining)
+                finally:
+                    # an alert the getter already took stays in the batch, also when run is cancelled
+                    collected = getter.done()
+                    if collected:
+                        self._batch.append(getter.result())
+                    else:
+                        getter.cancel()
+
+                if not collected:
+                    break
+
+            # sent by its own task, cancelling run during a send neither loses nor repeats the batch
+            batch, self._batch = self._batch, []
+            self._sending = loop.create_task(self._drain(batch))
+            await asyncio.shield(self._sending)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        # the batch being sent is finished, the one being collected and everything still queued is delivered
+        if self._sending is not None:
+            await asyncio.gather(self._sending, return_exceptions=True)
+            self._sending = None
+
+        batch, self._batch = self._batch, []
+        while self._queue is not None and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._drain(batch)
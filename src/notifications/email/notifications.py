@@ -0,0 +1,43 @@
+import asyncio
+import smtplib
+from email.message import EmailMessage
+from src.notifications.notifier_registry import read_notifier_config
+
+
+class EmailNotifier:
+
+    def __init__(self, configuration: dict = None, connection_pool=None):
+        """
+        :param configuration: Parsed NOTIFY section, read from config/notifications/email/config.ini when not provided
+        :param connection_pool: Unused, accepted so every notifier is created the same way
+        """
+        configuration = configuration if configuration is not None else read_notifier_config("email")
+
+        self.smtp_host = configuration["smtp_host"]
+        self.smtp_port = int(configuration.get("smtp_port") or 587)
+        self.smtp_user = configuration.get("smtp_user")
+        self.smtp_password = configuration.get("smtp_password")
+        self.use_tls = str(configuration.get("use_tls", "TRUE")).upper() == "TRUE"
+        self.sender = configuration.get("sender") or self.smtp_user
+        self.recipients = [recipient.strip() for recipient in configuration["recipients"].split(",")
+                           if recipient.strip()]
+        self.subject = configuration.get("subject") or "HGServiceMonitor Alert"
+        self.timeout = float(configuration.get("timeout") or 10)
+
+    def _send(self, message):
+        email = EmailMessage()
+        email["Subject"] = self.subject
+        email["From"] = self.sender
+        email["To"] = ", ".join(self.recipients)
+        email.set_content(message)
+
+        with smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.smtp_user:
+                smtp.login(self.smtp_user, self.smtp_password)
+            smtp.send_message(email)
+
+    async def send_alert(self, message=None):
+        # smtplib blocks, the send runs in the default executor to keep the event loop free
+        await asyncio.get_running_loop().run_in_executor(None, self._send, message or "")
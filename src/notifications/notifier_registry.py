@@ -0,0 +1,105 @@
+import configparser
+import functools
+import importlib
+from pathlib import Path, PurePath
+
+# ALERT_SERVICE name to (module, class, config directory), backends are only imported once a target uses them
+NOTIFIER_BACKENDS = {
+    "PUSHOVER": ("src.notifications.pushover.notifications", "PushOver", "pushover"),
+    "EMAIL": ("src.notifications.email.notifications", "EmailNotifier", "email"),
+    "WINDOWS": ("src.notifications.windows_notifier.notifications", "WindowsNotifier", "windows_notifier"),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def read_notifier_config(name: str, section: str = "NOTIFY"):
+    """
+    Parse config/notifications/<name>/config.ini once per process, every later call returns the cached section
+
+    :param name: directory of the notifier below config/notifications
+    :param section: section of the config.ini holding the notifier settings
+    """
+    root = Path(__file__).parents[2]
+    config_path = PurePath(root, Path(f"config/notifications/{name}/config.ini"))
+
+    configuration_parser = configparser.ConfigParser(strict=False)
+    if not configuration_parser.read(config_path):
+        raise FileNotFoundError(f"UNABLE TO LOCATE CONFIGURATION FILE {config_path}")
+
+    return dict(configuration_parser[section])
+
+
+class HGNotifierRegistry:
+
+    def __init__(self, connection_pool=None, internal_logger=None):
+        """
+        Shared notifier instances by ALERT_SERVICE name, created on first use and reused by every monitor
+
+        :param connection_pool: Shared HGConnectionPool handed to notifiers sending over HTTP
+        :param internal_logger: Class access to store log files
+        """
+        self.connection_pool = connection_pool
+        self._internal_logger = internal_logger
+        self._notifiers = {}
+        self._unavailable = set()
+
+    def __contains__(self, service):
+        return str(service).upper() in self._notifiers
+
+    def __getitem__(self, service):
+        notifier = self.get(service)
+        if notifier is None:
+            raise KeyError(service)
+        return notifier
+
+    def get(self, service, default=None):
+        """
+        Shared notifier for the ALERT_SERVICE, default when the backend is unknown or fails to load
+
+        :param service: ALERT_SERVICE name, e.g. PUSHOVER
+        :param default: returned when no notifier is available
+        """
+        service = str(service).upper()
+
+        notifier = self._notifiers.get(service)
+        if notifier is not None:
+            return notifier
+
+        if service in self._unavailable or service not in NOTIFIER_BACKENDS:
+            return default
+
+        module_name, class_name, config_name = NOTIFIER_BACKENDS[service]
+        try:
+            backend = getattr(importlib.import_module(module_name), class_name)
+            notifier = backend(configuration=read_notifier_config(config_name),
+                               connection_pool=self.connection_pool)
+        except Exception as e:
+            # remembered so a broken backend is not retried for every alert
+            self._unavailable.add(service)
+            if self._internal_logger:
+                self._internal_logger.error('Unable to load notifier %s: %r', service, e)
+            return default
+
+        self._notifiers[service] = notifier
+        return notifier
+
+    def register(self, service, notifier):
+        """
+        Add or replace the notifier used for an ALERT_SERVICE name
+        """
+        service = str(service).upper()
+        self._notifiers[service] = notifier
+        self._unavailable.discard(service)
+
+    @property
+    def services(self):
+        # notifiers created so far
+        return list(self._notifiers)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_registry():
+    """
+    Process wide registry used by monitors created without an alert dispatcher
+    """
+    return HGNotifierRegistry()
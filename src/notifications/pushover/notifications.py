@@ -1,40 +1,50 @@
 import asyncio
 import aiohttp
-import configparser
-from pathlib import Path, PurePath
+from src.notifications.notifier_registry import read_notifier_config
 
 
 class PushOver:
 
-    def __init__(self):
+    def __init__(self, connection_pool=None, pushover_url: str = None, configuration: dict = None):
+        """
+        :param connection_pool: Shared HGConnectionPool, a session is opened per alert when not provided
+        :param pushover_url: Override of the Pushover messages endpoint, e.g. a local stand-in for testing
+        :param configuration: Parsed NOTIFY section, read from config.ini when not provided
+        """
+        self.connection_pool = connection_pool
         self.token_api_key = None
         self.user_api_key = None
         self.pushover_token_api_key = None
         self.pushover_user_api_key = None
         self.params = None
         self.pushover_url = "https://api.pushover.net/1/messages.json"
-        self.configuration_parser = configparser.ConfigParser(strict=False)
-        self._read_config()
+        self._read_config(configuration)
 
-    def _read_config(self):
+        if pushover_url:
+            self.pushover_url = pushover_url
 
-        root = Path(__file__).parents[3]
-        child = Path("config/notifications/pushover/config.ini")
-        config_path = PurePath(root, child)
+    def _read_config(self, configuration=None):
 
-        try:
-            self.targets_configuration = self.configuration_parser.read(config_path)
-            self.pushover_token_api_key = self.configuration_parser["NOTIFY"]["pushover_token_api_key"]
-            self.pushover_user_api_key = self.configuration_parser["NOTIFY"]["pushover_user_api_key"]
-        except Exception as e:
-            print(f"UNABLE TO LOCATE CONFIGURATION FILE {config_path}")
-            print(f'{config_path} {e}')
-            exit()
+        if configuration is None:
+            try:
+                # cached per process, the file is only parsed by the first notifier
+                configuration = read_notifier_config("pushover")
+            except Exception as e:
+                print(e)
+                exit()
+
+        self.pushover_token_api_key = configuration["pushover_token_api_key"]
+        self.pushover_user_api_key = configuration["pushover_user_api_key"]
+        self.pushover_url = configuration.get("pushover_url") or self.pushover_url
 
     async def send_alert(self, message=None):
 
         self.params = {'token': self.pushover_token_api_key, 'user': self.pushover_user_api_key, 'message': message}
 
+        if self.connection_pool is not None:
+            async with self.connection_pool.session.post(self.pushover_url, params=self.params) as resp:
+                return resp.status
+
         async with aiohttp.ClientSession() as session:
             async with session.post(self.pushover_url, params=self.params) as resp:
                 return resp.status
@@ -0,0 +1,31 @@
+import asyncio
+from src.notifications.notifier_registry import read_notifier_config
+
+
+class WindowsNotifier:
+
+    def __init__(self, configuration: dict = None, connection_pool=None):
+        """
+        Windows toast notifications, needs the optional win10toast package
+
+        :param configuration: Parsed NOTIFY section, read from config/notifications/windows_notifier/config.ini
+        :param connection_pool: Unused, accepted so every notifier is created the same way
+        """
+        # optional dependency, only imported when a target uses ALERT_SERVICE = WINDOWS
+        from win10toast import ToastNotifier
+
+        try:
+            configuration = configuration if configuration is not None else read_notifier_config("windows_notifier")
+        except FileNotFoundError:
+            configuration = {}  # <-- every setting has a default
+
+        self.title = configuration.get("title") or "HGServiceMonitor"
+        self.duration = int(configuration.get("duration") or 5)
+        self._toaster = ToastNotifier()
+
+    async def send_alert(self, message=None):
+        # show_toast blocks for the toast duration, run it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._show, message or "")
+
+    def _show(self, message):
+        self._toaster.show_toast(self.title, message, duration=self.duration, threaded=False)
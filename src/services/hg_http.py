@@ -1,8 +1,15 @@
 import asyncio
 import time
-import aiohttp
 import json
-from src.notifications.pushover.notifications import PushOver as push_notify
+from collections import deque
+from src.notifications.alert_dispatcher import HGAlertDispatcher
+from src.notifications.notifier_registry import shared_registry
+from src.util.connection_pool import HGConnectionPool, HGRequestPhases, measure_loop_lag
+from src.util.result_handler import HGResultHandler, RESULT_SUCCESS, RESULT_FAIL, ERROR_CONNECT, ERROR_WAN_MISMATCH, \
+    ERROR_RESPONSE_TEXT, ERROR_TIMEOUT
+from src.util.log_pipeline import EVENT_SUCCESS, EVENT_FAILURE, EVENT_STATE_CHANGE
+from src.util.adaptive_interval import adaptive_interval
+from src.util.target_model import target_config, HGService
 from datetime import datetime
 
 
@@ -15,6 +22,8 @@ class HGHttpServiceMonitor:
                  service=None,
                  _results_tracker=None,
                  _target_options=None,
+                 _connection_pool=None,
+                 _alert_dispatcher=None,
                  internal_logger=None):
         """
         Class handler for the HTTP service monitor
@@ -24,39 +33,56 @@ class HGHttpServiceMonitor:
         :param count:  Currently not used
         :param port: port used for HTTP/HTTPS status checks
         :param service: used to map HTTP or HTTPS options
+        :param _target_options: compiled HGTarget, an option dict of the section is compiled and validated here
         :param _results_tracker: Class access to store and retrieve results
+        :param _connection_pool: Shared connection pool, a private pool is created when not provided
+        :param _alert_dispatcher: Shared alert pipeline, a private pipeline is created when not provided
         :param internal_logger: Class access to store log files
         """
 
-        # service options
+        # service options, compiled and validated once so nothing is parsed per probe
         self._target = target
-        self._target_options = _target_options
+        self._config = target_config(target, _target_options, service=service or "HTTP", interval=interval,
+                                     port=port)
         self._interval = interval
-        self._service = service or "HTTP"
-        self._port = port or 443
-        self._timeout = 60
+        self._service = self._config.service.value
+        self._url = self._config.url
+        self._timeout = self._config.timeout
 
         # configuration options
-        self._alert_enabled = self._target_options['alert'] or False
-        self._ms_check = self._target_options.get('ms_check') or False
-        self._failure_counter = int(self._target_options['failure_count'])
-        self._ms_calc = str(self._target_options.get('ms_calc')).lower() or "gt"
-        self._ms_value = int(self._target_options.get('ms_value', 0))
-        self._expected_response = self._target_options.get('expected_response_text')
+        self._alert_enabled = self._config.alert
+        self._ms_check = self._config.ms_check
+        self._failure_counter = self._config.failure_count
+        self._ms_calc = self._config.ms_calc.value
+        self._ms_value = self._config.ms_value
+        self._expected_response = self._config.expected_response_text
+        self._result_window = self._config.result_window
+        self._ms_phase = self._config.ms_phase
+        # MS_CALC AVG of a single phase, the result window keeps the total latency
+        self._phase_samples = deque(maxlen=self._result_window) if self._ms_phase != "total" else None
+        self._loop_lag_limit = self._config.loop_lag_limit
+        self.last_phases = None
+        self._body_mode = self._config.body_mode
+        self._body_limit = self._config.body_limit
 
         self._internal_logger = internal_logger
-        self._http_results_run_tracker = {"success": [], "fail": []}
-        self._http_results_fail_tracker = []
-        self._results_tracker = _results_tracker  # <-- Class result to implement later
+        self._results_tracker = _results_tracker or HGResultHandler()
+        self._http_results_run_tracker = self._results_tracker.register(self._target, capacity=self._result_window)
+        # relative to the kept history, a reloaded target needs fresh failures before alerting again
+        self._failure_counter += self._http_results_run_tracker.failures_total
+        self._connection_pool = _connection_pool or HGConnectionPool(limit_per_host=1)
 
         self._internal_logger.debug(self.__class__)
-        self.pushover_notifier = push_notify()
+        self._alert_service = self._config.alert_service
+        self._alert_throttle = self._config.alert_throttle
+        self._alert_dispatcher = _alert_dispatcher or HGAlertDispatcher(shared_registry(),
+                                                                        internal_logger=internal_logger)
+        self._cadence = adaptive_interval(self._config)
 
     @property
-    def format_url(self, wan_monitor: str = "https://api.ipify.org"):
-        if self._service == "WAN":
-            return wan_monitor
-        return f'{self._service}://{self._target}:{self._port}'
+    def format_url(self):
+        # built once when the section was compiled
+        return self._url
 
     @property
     def success_char(self):
@@ -69,121 +95,234 @@ class HGHttpServiceMonitor:
     @property
     def dispatch_alert_conditions_met(self, immediate: bool = False):
         self._internal_logger.debug("Checking if alert conditions are met")
-        if (len(self._http_results_run_tracker["fail"]) >= self._failure_counter) and self._alert_enabled:
-            self._failure_counter = self._failure_counter + int(self._target_options['failure_count'])
+        if (self._http_results_run_tracker.failures_total >= self._failure_counter) and self._alert_enabled:
+            self._failure_counter = self._failure_counter + self._config.failure_count
             return True
         return False
 
+    def send_alert(self, message):
+        # queued for the background sender, the probe never waits on notification I/O
+        self._alert_dispatcher.submit(message, target=self._target, service=self._alert_service,
+                                      throttle=self._alert_throttle)
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def cadence(self):
+        return self._cadence
+
     async def get_target(self):
-        _internal_count = 0
+        self._internal_logger.debug('Starting AIOHTTP monitor for %s using the shared connection pool', self.format_url)
 
-        self._internal_logger.debug(f'Starting AIOHTTP session for {self.format_url} ')
+        while True:
+            await self.check_target()
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-            while True:
-                try:
-                    latency_check = time.time()
+            self._internal_logger.debug('Starting interval sleep for %s', self.format_url)
+            await asyncio.sleep(self._cadence.next_interval if self._cadence else self._interval)
 
-                    async with session.get(self.format_url, timeout=2) as response:
+    async def read_until_expected(self, response):
+        """
+        Stream the body until EXPECTED_RESPONSE_TEXT is found or BODY_LIMIT bytes were read
+
+        :param response: aiohttp response with unread content
+        """
+        expected = self._expected_response.encode('utf8')
+        keep = len(expected) - 1
+        tail = b''
+        read = 0
 
-                        api_response = await response.text()
+        async for chunk in response.content.iter_chunked(16384):
+            # the previous tail covers a match split across two chunks
+            if expected in tail + chunk:
+                return True
 
-                        # convert latency to seconds
-                        duration = (time.time() - latency_check) * 1000
+            read += len(chunk)
+            if read >= self._body_limit:
+                return False
 
-                        status_message = f'{self.success_char} {self.format_url} --> Status:{response.status} --> Service:{self._service} --> Duration:{duration:.2f}ms'
+            tail = (tail + chunk)[-keep:] if keep else b''
+
+        return False
 
-                        self._http_results_run_tracker["success"].append({"url": self.format_url,
-                                                                          "status_code": response.status,
-                                                                          "duration": duration,
-                                                                          "duration_normalized": int(duration),
-                                                                          })
-                        self._internal_logger.info(status_message)
+    async def fetch(self, phases):
+        """
+        Send the request and read as much of the body as BODY_MODE asks for
 
-                # Limit exception captures
-                except Exception as e:
+        :param phases: HGRequestPhases filled by the pool trace hooks
+        :return: status code, body text in full mode, whether EXPECTED_RESPONSE_TEXT was found or None
+        """
+        api_response = None
+        text_found = None
+        method = "HEAD" if self._body_mode == "head" else "GET"
 
-                    error_message = f'{self.fail_char} {self.format_url} --> {e} --> Failed To Connect'
-                    self._internal_logger.info(error_message)
+        async with self._connection_pool.session.request(method, self.format_url,
+                                                         trace_request_ctx=phases) as response:
+            headers_received = time.perf_counter_ns()
 
-                    await asyncio.sleep(0)
+            # headers mode leaves the body unread, the connection is closed on release
+            if self._body_mode == "full":
+                api_response = await response.text()
+                if self._expected_response and self._service != HGService.WAN:
+                    text_found = self._expected_response in api_response
+            elif self._body_mode == "stream":
+                text_found = await self.read_until_expected(response)
 
-                    self._http_results_run_tracker["fail"].append({"url": self.format_url,
-                                                                   "status": error_message,
-                                                                   "specific_error": e
-                                                                   })
+            finished = time.perf_counter_ns()
+            phases.body = finished - headers_received
+            phases.total = finished - phases.start
 
-                    if self.dispatch_alert_conditions_met:
-                        await self.pushover_notifier.send_alert(message=error_message)
+            return response.status, api_response, text_found
 
-                # latency check v1 currently as conditions are met they will be dispatched
-                if self._ms_check:
-                    self._internal_logger.debug(f'Starting ms_check function for {self.format_url}')
+    async def check_target(self):
+        """
+        Run a single status check against the target, called by get_target or the central scheduler
+        """
+        duration = None
+        api_response = None
+        text_found = None
+        phases = HGRequestPhases()
+
+        try:
+            # time the loop needs to get back to us, counted apart so it never shows up as network latency
+            phases.loop_lag = await measure_loop_lag()
+            phases.start = time.perf_counter_ns()
+
+            # one deadline covers DNS, connect and the body read, an overrun cancels the request
+            status, api_response, text_found = await asyncio.wait_for(self.fetch(phases), self._timeout)
+
+            # the result window, metrics and store always get the total latency, MS_PHASE is compared on its own
+            duration = phases.phase('total')
+            self.last_phases = phases
+
+            if text_found is False:
+                raise ValueError(f'expected response text {self._expected_response!r} not found '
+                                 f'in the first {self._body_limit} bytes')
+
+            # only the first success after a failure is a state change, sampling may drop the others
+            event = EVENT_SUCCESS if self._http_results_run_tracker.last_status == RESULT_SUCCESS \
+                else EVENT_STATE_CHANGE
+
+            self._http_results_run_tracker.post(RESULT_SUCCESS, latency=duration)
+            self._internal_logger.info('%s %s --> Status:%s --> Service:%s --> Duration:%.2fms',
+                                       self.success_char, self.format_url, status, self._service,
+                                       phases.phase('total'), extra={"hg_event": event})
+            self._internal_logger.debug('%s phases DNS:%.2fms Connect:%.2fms TTFB:%.2fms Body:%.2fms '
+                                        'Loop Lag:%.2fms', self.format_url, phases.phase('dns'),
+                                        phases.phase('connect'), phases.phase('ttfb'), phases.phase('body'),
+                                        phases.phase('loop_lag'),
+                                        extra={"hg_event": EVENT_SUCCESS, "hg_phases": phases})
+
+        # Limit exception captures
+        except Exception as e:
+
+            if isinstance(e, asyncio.TimeoutError):
+                error_message = f'{self.fail_char} {self.format_url} --> No response within {self._timeout}s ' \
+                                f'--> Timed Out'
+                error_code = ERROR_TIMEOUT
+            elif text_found is False:
+                error_message = f'{self.fail_char} {self.format_url} --> {e} --> Unexpected Response'
+                error_code = ERROR_RESPONSE_TEXT
+            else:
+                error_message = f'{self.fail_char} {self.format_url} --> {e} --> Failed To Connect'
+                error_code = ERROR_CONNECT
+            self._internal_logger.info(error_message, extra={"hg_event": EVENT_FAILURE})
+
+            await asyncio.sleep(0)
+
+            # keep the measured latency out of the window, the check failed
+            duration = None
+            self._http_results_run_tracker.post(RESULT_FAIL, error_code=error_code)
 
-                    await self.check_latency(duration)
+            if self.dispatch_alert_conditions_met:
+                self.send_alert(error_message)
 
-                # latency check v1 currently as conditions are met they will be dispatched
-                if self._service == "WAN":
-                    self._internal_logger.debug(f'Starting WAN monitor function for {self.format_url}')
+        # latency check v1 currently as conditions are met they will be dispatched
+        if self._ms_check and duration is not None:
+            self._internal_logger.debug('Starting ms_check function for %s', self.format_url)
 
-                    await self.check_wan(api_response)
+            # an overloaded monitor inflates every phase, report the lag instead of a false latency alert
+            if phases.phase('loop_lag') > self._loop_lag_limit:
+                self._internal_logger.warning('Skipping latency check for %s, event loop lag %.2fms is above %sms',
+                                              self.format_url, phases.phase('loop_lag'), self._loop_lag_limit)
+            elif not phases.measured(self._ms_phase):
+                self._internal_logger.debug('Skipping latency check for %s, no %s phase, the connection or address was reused',
+                                            self.format_url, self._ms_phase)
+            else:
+                await self.check_latency(phases.phase(self._ms_phase))
 
-                _internal_count += 1  # <-- decide if we want to keep this currently not used
+        # latency check v1 currently as conditions are met they will be dispatched
+        if self._service == HGService.WAN and api_response is not None:
+            self._internal_logger.debug('Starting WAN monitor function for %s', self.format_url)
 
-                self._internal_logger.debug(f'Starting interval sleep for {self.format_url}')
+            await self.check_wan(api_response)
 
-                for i in range(1, int(self._interval)):
-                    await asyncio.sleep(1)
+        # a WAN mismatch posts its failure after the success of the request, the last result decides
+        if self._cadence is not None:
+            self._cadence.on_result(self._http_results_run_tracker.last_status == RESULT_SUCCESS)
 
     async def check_wan(self, response):
         if self._expected_response == response:
             return True
         else:
             error_message = f'The expected WAN address {self._expected_response} does not match what was returned {response}'
-            self._http_results_run_tracker["fail"].append({"url": self.format_url,
-                                                           "status": error_message,
-                                                           })
+            self._http_results_run_tracker.post(RESULT_FAIL, error_code=ERROR_WAN_MISMATCH)
 
-            self._internal_logger.info(error_message)  # <-- this can probably get removed
+            self._internal_logger.info(error_message, extra={"hg_event": EVENT_FAILURE})
 
             if self.dispatch_alert_conditions_met:
-                await self.pushover_notifier.send_alert(message=error_message)
+                self.send_alert(error_message)
 
-        self._internal_logger.debug(f'finish check_wan function')
+        self._internal_logger.debug('finish check_wan function')
 
     async def check_latency(self, duration):
         if self._ms_check:
             error_message = ""
 
-            # average over the last 10 items processed
-            if self._ms_calc == 'avg' and len(self._http_results_run_tracker["success"]) >= 3:
-                self._internal_logger.debug(f'checking if provided latency is {self._ms_calc} --> {self._ms_value}')
+            if self._phase_samples is not None:
+                self._phase_samples.append(duration)
 
-                # get the most recent three items this will be dynamic later
-                recent_items = self._http_results_run_tracker["success"][-3:]
-                calculated_latency = [latency["duration_normalized"] for latency in recent_items]
+            # rolling average over the result window kept by the result handler, or the measured phase samples
+            samples = self._http_results_run_tracker.latency_count if self._phase_samples is None \
+                else len(self._phase_samples)
+            if self._ms_calc == 'avg' and samples >= 3:
+                self._internal_logger.debug('checking if provided latency is %s --> %s', self._ms_calc, self._ms_value)
 
-                latency_average = sum(calculated_latency) // len(calculated_latency)
+                latency_average = self._http_results_run_tracker.average if self._phase_samples is None \
+                    else sum(self._phase_samples) / len(self._phase_samples)
 
                 if latency_average > self._ms_value:
-                    error_message = f'{self.fail_char} {self.format_url} --> {duration:.2f} --> observed latency average higher than expected {self._ms_value}'
+                    error_message = f'{self.fail_char} {self.format_url} --> {duration:.2f} --> observed {self._ms_phase} latency average higher than expected {self._ms_value}'
 
             # specified value is less than returned
             if self._ms_calc == 'lt' and self._ms_value > int(duration):
-                self._internal_logger.debug(f'checking if provided latency is {self._ms_calc} --> {self._ms_value}')
-                error_message = f'{self.fail_char} {self.format_url} --> {duration:.2f} --> observed latency lower than expected {self._ms_value}'
+                self._internal_logger.debug('checking if provided latency is %s --> %s', self._ms_calc, self._ms_value)
+                error_message = f'{self.fail_char} {self.format_url} --> {duration:.2f} --> observed {self._ms_phase} latency lower than expected {self._ms_value}'
 
             # specified value is greater than returned
             if self._ms_calc == 'gt' and (self._ms_value < int(duration)):
-                self._internal_logger.debug(f'checking if provided latency is {self._ms_calc} --> {self._ms_value}')
-                error_message = f'{self.fail_char} {self.format_url} --> Duration: {duration:.2f} observed latency higher than expected value --> {self._ms_value}'
+                self._internal_logger.debug('checking if provided latency is %s --> %s', self._ms_calc, self._ms_value)
+                error_message = f'{self.fail_char} {self.format_url} --> Duration: {duration:.2f} observed {self._ms_phase} latency higher than expected value --> {self._ms_value}'
 
             if error_message:
-                self._internal_logger.info(error_message)
+                self._internal_logger.info(error_message, extra={"hg_event": EVENT_FAILURE})
                 await asyncio.sleep(0)
-                await self.pushover_notifier.send_alert(message=error_message)
+                self.send_alert(error_message)
 
-            self._internal_logger.debug(f'finished ms_latency check for {self.format_url}')
+            self._internal_logger.debug('finished ms_latency check for %s', self.format_url)
 
 
 if __name__ == '__main__':
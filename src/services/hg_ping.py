@@ -1,7 +1,14 @@
-from icmplib import ping, async_ping
-from src.notifications.pushover.notifications import PushOver as push_notify
+from icmplib import async_ping, Host
+from src.notifications.alert_dispatcher import HGAlertDispatcher
+from src.notifications.notifier_registry import shared_registry
+from src.util.result_handler import HGResultHandler, RESULT_SUCCESS, RESULT_FAIL, ERROR_PACKET_LOSS
+from src.util.log_pipeline import EVENT_SUCCESS, EVENT_FAILURE, EVENT_STATE_CHANGE
+from src.util.adaptive_interval import adaptive_interval
+from src.util.target_model import target_config
 import asyncio
 
+PING_MESSAGE = '%s Ping Target:%s --> Packets Sent:%s --> Packets Recieved:%s --> Packets RTT:%s  --> Packets Loss:%s'
+
 
 # move to **kwargs
 # Exceptions are not being handled correctly
@@ -13,24 +20,67 @@ class HGPingServiceMonitor:
                  _ping_count=None,
                  _target_options=None,
                  _results_tracker=None,
+                 _connection_pool=None,
+                 _alert_dispatcher=None,
+                 privileged=False,
                  internal_logger=None):
 
         self._ping_results = None
         self._target = target
-        self._target_options = _target_options
+        # compiled and validated once, nothing is parsed per probe
+        self._config = target_config(target, _target_options, service="ICMP", interval=interval)
         self._interval = interval
         self._ping_count = _ping_count
-        self._ping_results_tracker = []  # List made of dicts with keys to track pass or fail?
-        self._results_tracker = _results_tracker  # <-- Class result to implement later
         self._internal_logger = internal_logger
-        self._failure_counter = int(self._target_options['failure_count'])
+        self._result_window = self._config.result_window
+        self._results_tracker = _results_tracker or HGResultHandler()
+        self._ping_results_tracker = self._results_tracker.register(self._target, capacity=self._result_window)
+        # relative to the kept history, a reloaded target needs fresh failures before alerting again
+        self._failure_counter = self._ping_results_tracker.failures_total + self._config.failure_count
+
+        self._timeout = self._config.timeout
+        self._privileged = privileged
+        self._alert_enabled = self._config.alert
+        self._alert_throttle = self._config.alert_throttle
+        self._alert_service = self._config.alert_service
+
+        self._alert_dispatcher = _alert_dispatcher or HGAlertDispatcher(shared_registry(),
+                                                                        internal_logger=internal_logger)
+        self._cadence = adaptive_interval(self._config)
+        self.canary_interval = None  # <-- set while a target it depends on is down
+
+    def send_alert(self, message):
+        # queued for the background sender, the probe never waits on notification I/O
+        self._alert_dispatcher.submit(message, target=self._target, service=self._alert_service,
+                                      throttle=self._alert_throttle)
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def timeout(self):
+        return self._timeout
 
-        self._timeout = 2
-        self._privileged = False
-        self._alert_enabled = self._target_options['alert'] or False
-        self._alert_throttle = 1 or None
+    @property
+    def cadence(self):
+        return self._cadence
 
-        self.pushover_notifier = push_notify()
+    @property
+    def sweep_interval(self):
+        # canaries of a down parent's dependents get their own bucket, adaptive targets are swept at the
+        # confirmation spacing and skipped until they are due
+        if self.canary_interval:
+            return self.canary_interval
+        return self._cadence.confirm_interval if self._cadence else self._interval
 
     @property
     def success_char(self):
@@ -42,11 +92,45 @@ class HGPingServiceMonitor:
 
     @property
     def dispatch_alert_conditions_met(self):
-        if len(self._ping_results_tracker) >= self._failure_counter and self._alert_enabled:
-            self._ping_results_tracker = []
+        if self._ping_results_tracker.failures_total >= self._failure_counter and self._alert_enabled:
+            self._failure_counter = self._failure_counter + self._config.failure_count
             return True
         return False
 
+    async def process_ping_result(self, host):
+        """
+        Log, track and alert on a single ping result, used by ping_target and the shared ICMP sweep
+
+        :param host: icmplib Host returned for this target
+        """
+        self._ping_results = host
+
+        status_char = self.success_char if not self._ping_results.packet_loss == 1 else self.fail_char
+
+        if status_char == self.fail_char:
+            event = EVENT_FAILURE
+        elif self._ping_results_tracker.last_status == RESULT_SUCCESS:
+            event = EVENT_SUCCESS
+        else:
+            event = EVENT_STATE_CHANGE
+
+        message_args = (status_char, self._target, self._ping_results._packets_sent,
+                        self._ping_results.packets_received, self._ping_results.rtts, self._ping_results.packet_loss)
+
+        # Log the result, formatted by the logging listener only if the record is kept
+        self._internal_logger.info(PING_MESSAGE, *message_args, extra={"hg_event": event})
+
+        if status_char == self.success_char:
+            self._ping_results_tracker.post(RESULT_SUCCESS, latency=self._ping_results.avg_rtt)
+        else:
+            self._ping_results_tracker.post(RESULT_FAIL, error_code=ERROR_PACKET_LOSS)
+
+        if self._cadence is not None:
+            self._cadence.on_result(status_char == self.success_char)
+
+        if status_char == u'\u274C' and self.dispatch_alert_conditions_met:
+            self.send_alert(PING_MESSAGE % message_args)
+
     async def ping_target(self):
         _internal_count = 0
 
@@ -54,30 +138,18 @@ class HGPingServiceMonitor:
             if _internal_count == self._ping_count:
                 break
 
-            self._ping_results = await async_ping(self._target, count=1, timeout=self._timeout,
-                                                  privileged=self._privileged)
-
-            status_char = self.success_char if not self._ping_results.packet_loss == 1 else self.fail_char
-
-            message = f'{status_char} Ping Target:{self._target} --> ' \
-                      f'Packets Sent:{self._ping_results._packets_sent} --> ' \
-                      f'Packets Recieved:{self._ping_results.packets_received} --> ' \
-                      f'Packets RTT:{self._ping_results.rtts}  ' \
-                      f'--> Packets Loss:{self._ping_results.packet_loss}'
-
-            # Log the result
-            self._internal_logger.info(message)
-
-            if status_char == u'\u274C' and self.dispatch_alert_conditions_met:
-                await self.pushover_notifier.send_alert(message=message)
+            # the deadline also covers resolving a hostname, which icmplib does before its own timeout starts
+            try:
+                host = await asyncio.wait_for(async_ping(self._target, count=1, timeout=self._timeout,
+                                                         privileged=self._privileged), self._timeout)
+            except asyncio.TimeoutError:
+                host = Host(self._target, 1, [])
 
-            self._ping_results_tracker.append(self._ping_results)
+            await self.process_ping_result(host)
 
-            _internal_count += 1  # <-- decide if we want to keep this currently not used
-            _internal_wait = 0
+            _internal_count += 1
 
-            for i in range(1, int(self._interval)):
-                await asyncio.sleep(1)
+            await asyncio.sleep(self._cadence.next_interval if self._cadence else self._interval)
 
 
 if __name__ == '__main__':
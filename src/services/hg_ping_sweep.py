@@ -0,0 +1,266 @@
+import asyncio
+import time
+from icmplib import ICMPv4Socket, ICMPv6Socket, ICMPRequest, Host, async_resolve, async_multiping, is_hostname, \
+    is_ipv6_address
+from icmplib.exceptions import ICMPSocketError
+from icmplib.utils import unique_identifier
+
+
+class HGPingSweep:
+    # ICMP sequence numbers are 16 bits, keep a margin so a bucket never wraps onto itself
+    _MAX_IN_FLIGHT = 60000
+
+    def __init__(self,
+                 timeout=2,
+                 privileged=False,
+                 send_batch=256,
+                 resolve_ttl=300,
+                 prober=None,
+                 internal_logger=None):
+        """
+        Shared ICMP sweep engine, every ICMP monitor with the same interval is probed as one batch
+
+        :param timeout: seconds an echo reply is waited for when the monitor has no timeout of its own
+        :param privileged: use raw sockets (root) instead of datagram sockets, which need the group of the process
+                           in net.ipv4.ping_group_range on Linux
+        :param send_batch: number of echo requests sent before yielding back to the event loop
+        :param resolve_ttl: seconds the address of a hostname target is reused before it is resolved again
+        :param prober: async callable(addresses) returning an icmplib Host per address in order, replaces the ICMP
+                       sockets, e.g. the fake backend of the benchmarks
+        :param internal_logger: Class access to store log files
+        """
+
+        self._timeout = timeout
+        self._privileged = privileged
+        self._send_batch = send_batch
+        self._resolve_ttl = resolve_ttl
+        self._prober = prober
+        self._internal_logger = internal_logger
+
+        self._buckets = {}  # <-- interval: {target: HGPingServiceMonitor}
+        self._sockets = {}  # <-- ip version: ICMPSocket shared by every bucket
+        self._socket_errors = {}  # <-- ip version: last socket error, logged once until the socket opens again
+        self._pending = {}  # <-- (ip version, sequence): [address, send time, future]
+        self._resolved = {}  # <-- hostname: (address, expiry)
+        self._sequence = 0
+        self._id = unique_identifier()
+        self._shared_socket = True  # <-- event loops without add_reader (Windows proactor) fall back to async_multiping
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def add_monitor(self, monitor):
+        self._buckets.setdefault(float(monitor.sweep_interval), {})[monitor.target] = monitor
+
+    def remove_monitor(self, monitor):
+        """
+        Drop a monitor from its bucket, returns True when the bucket is now empty
+        """
+        bucket = self._buckets.get(float(monitor.sweep_interval), {})
+
+        if bucket.get(monitor.target) is monitor:
+            del bucket[monitor.target]
+
+        if not bucket:
+            self._buckets.pop(float(monitor.sweep_interval), None)
+            return True
+        return False
+
+    def _socket_error(self, version, error):
+        # every target of the version would be reported down, the sweep posts no results instead of a false outage
+        if self._socket_errors.get(version) != str(error):
+            self._internal_logger.error('ICMPv%s socket unavailable (privileged=%s), ICMP targets are not probed '
+                                        'until it can be opened: %s', version, self._privileged, error)
+        self._socket_errors[version] = str(error)
+
+    def _socket(self, version):
+        """
+        Shared socket of an ip version, None when it cannot be opened, e.g. without ICMP permissions
+        """
+        if version not in self._sockets:
+            try:
+                icmp_socket = ICMPv6Socket(privileged=self._privileged) if version == 6 \
+                    else ICMPv4Socket(privileged=self._privileged)
+            except ICMPSocketError as e:
+                self._socket_error(version, e)
+                return None
+
+            icmp_socket.blocking = False
+
+            try:
+                asyncio.get_running_loop().add_reader(icmp_socket.sock.fileno(), self._read_replies, version)
+            except NotImplementedError:
+                icmp_socket.close()
+                self._shared_socket = False
+                raise
+
+            self._sockets[version] = icmp_socket
+            if self._socket_errors.pop(version, None):
+                self._internal_logger.info('ICMPv%s socket opened, ICMP targets are probed again', version)
+
+        return self._sockets[version]
+
+    def _next_sequence(self, version):
+        while True:
+            self._sequence = (self._sequence + 1) & 0xffff
+            if (version, self._sequence) not in self._pending:
+                return self._sequence
+
+    def _read_replies(self, version):
+        icmp_socket = self._sockets[version]
+
+        while True:
+            try:
+                packet, source = icmp_socket.sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            received = time.perf_counter()
+            reply = icmp_socket._parse_reply(packet, source[0], received)
+
+            # raw sockets see every ICMP packet on the host including our own echo requests, only keep our replies
+            if not reply or reply.type in (8, 128) or (self._privileged and reply.id != self._id):
+                continue
+
+            pending = self._pending.get((version, reply.sequence))
+
+            # error replies come from the router, echo replies must come from the target
+            if not pending or (reply.type in (0, 129) and reply.source != pending[0]):
+                continue
+
+            address, sent, future = pending
+            if not future.done():
+                future.set_result((received - sent) * 1000 if reply.type in (0, 129) else None)
+
+    def _deadline(self, monitor):
+        return getattr(monitor, 'timeout', None) or self._timeout
+
+    async def _resolve_all(self, monitors):
+        """
+        Address of every target, hostnames not cached or expired are resolved concurrently before any request is sent,
+        a failed lookup maps the hostname to its exception
+        """
+        now = time.monotonic()
+        deadlines = {}
+        for monitor in monitors:
+            target = monitor.target
+            if is_hostname(target) and self._resolved.get(target, (None, 0))[1] <= now:
+                deadlines[target] = max(deadlines.get(target, 0), self._deadline(monitor))
+
+        # a hanging resolver only costs its own hostnames their deadline, the lookups run side by side
+        lookups = await asyncio.gather(*[asyncio.wait_for(async_resolve(hostname), deadline)
+                                         for hostname, deadline in deadlines.items()], return_exceptions=True)
+
+        expiry = time.monotonic() + self._resolve_ttl
+        failed = {}
+        for hostname, lookup in zip(deadlines, lookups):
+            if isinstance(lookup, Exception):
+                failed[hostname] = lookup
+            else:
+                self._resolved[hostname] = (lookup[0], expiry)
+
+        return {monitor.target: (failed.get(monitor.target) or self._resolved[monitor.target][0])
+                if is_hostname(monitor.target) else monitor.target for monitor in monitors}
+
+    async def _probe_batch_multiping(self, monitors):
+        try:
+            hosts = await async_multiping([monitor.target for monitor in monitors], count=1,
+                                          timeout=max(self._deadline(monitor) for monitor in monitors),
+                                          concurrent_tasks=self._send_batch, privileged=self._privileged)
+        except ICMPSocketError as e:
+            self._socket_error(4, e)
+            return []
+
+        self._socket_errors.pop(4, None)
+        return list(zip(monitors, hosts))
+
+    async def _probe_batch(self, monitors):
+        if self._prober is not None:
+            hosts = await self._prober([monitor.target for monitor in monitors])
+            return list(zip(monitors, hosts))
+
+        if not self._shared_socket:
+            return await self._probe_batch_multiping(monitors)
+
+        loop = asyncio.get_running_loop()
+        in_flight = []
+        unavailable = set()  # <-- ip versions whose socket failed to open, tried once per sweep
+        addresses = await self._resolve_all(monitors)
+
+        for position, monitor in enumerate(monitors):
+            future = loop.create_future()
+
+            try:
+                address = addresses[monitor.target]
+                if isinstance(address, Exception):
+                    raise address
+
+                version = 6 if is_ipv6_address(address) else 4
+
+                icmp_socket = None if version in unavailable else self._socket(version)
+                if icmp_socket is None:
+                    unavailable.add(version)
+                    continue  # <-- no result is posted for this target
+
+                sequence = self._next_sequence(version)
+                icmp_socket.send(ICMPRequest(destination=address, id=self._id, sequence=sequence))
+                self._pending[(version, sequence)] = [address, time.perf_counter(), future]
+                in_flight.append((monitor, address, future, (version, sequence)))
+
+            except NotImplementedError:
+                return await self._probe_batch_multiping(monitors)
+
+            except Exception as e:
+                self._internal_logger.debug('Unable to send echo request to %s --> %s', monitor.target, e)
+                in_flight.append((monitor, monitor.target, None, None))
+
+            if position % self._send_batch == 0:
+                await asyncio.sleep(0)
+
+        futures = [future for _, _, future, _ in in_flight if future]
+        if futures:
+            await asyncio.wait(futures, timeout=max(self._deadline(monitor) for monitor, _, future, _ in in_flight
+                                                    if future))
+
+        results = []
+        for monitor, address, future, key in in_flight:
+            self._pending.pop(key, None)
+            rtt = future.result() if future and future.done() else None
+            if future and not future.done():
+                future.cancel()
+
+            # the batch waits for its longest deadline, a later reply is lost for a target with a shorter one
+            if rtt is not None and rtt > self._deadline(monitor) * 1000:
+                rtt = None
+
+            results.append((monitor, Host(address, 1, [rtt] if rtt is not None else [])))
+
+        return results
+
+    async def sweep(self, interval):
+        """
+        Probe every due monitor of an interval bucket and hand each result back to its own alert logic
+        """
+        started = asyncio.get_running_loop().time()
+
+        # adaptive monitors are skipped until their own interval has elapsed, half a tick absorbs the sweep duration
+        due = started + interval / 2
+        monitors = [monitor for monitor in list(self._buckets.get(interval, {}).values())
+                    if monitor.cadence is None or monitor.canary_interval or monitor.cadence.next_due <= due]
+        self._internal_logger.debug('Starting ICMP sweep of %s target(s) for interval %s', len(monitors), interval)
+
+        for start in range(0, len(monitors), self._MAX_IN_FLIGHT):
+            for monitor, host in await self._probe_batch(monitors[start:start + self._MAX_IN_FLIGHT]):
+                await monitor.process_ping_result(host)
+
+                if monitor.cadence is not None:
+                    monitor.cadence.next_due = started + monitor.cadence.next_interval
+
+    def close(self):
+        for version, icmp_socket in self._sockets.items():
+            asyncio.get_running_loop().remove_reader(icmp_socket.sock.fileno())
+            icmp_socket.close()
+        self._sockets = {}
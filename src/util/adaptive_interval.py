@@ -0,0 +1,77 @@
+class HGAdaptiveInterval:
+    __slots__ = ("interval", "max_interval", "confirm_interval", "stable_count", "backoff", "failure_count",
+                 "current", "successes", "failures", "next_due")
+
+    def __init__(self,
+                 interval: float,
+                 max_interval: float = None,
+                 confirm_interval: float = None,
+                 stable_count: int = 10,
+                 backoff: float = 2.0,
+                 failure_count: int = 3):
+        """
+        Probe cadence of one target, stable targets back off and a failure is confirmed by quick probes
+
+        :param interval: INTERVAL of the target, used again after any failure
+        :param max_interval: longest interval a stable target backs off to, 4 times the interval by default
+        :param confirm_interval: spacing of the probes confirming a failure, 2 seconds by default
+        :param stable_count: consecutive successes before the interval grows
+        :param backoff: factor the interval grows by
+        :param failure_count: FAILURE_COUNT of the target, consecutive failures confirmed at confirm_interval
+        """
+        self.interval = float(interval)
+        self.max_interval = max(float(max_interval or self.interval * 4), self.interval)
+        self.confirm_interval = min(float(confirm_interval or 2), self.interval)
+        self.stable_count = max(1, int(stable_count))
+        self.backoff = max(1.0, float(backoff))
+        self.failure_count = max(1, int(failure_count))
+
+        self.current = self.interval
+        self.successes = 0
+        self.failures = 0
+        self.next_due = float('-inf')  # <-- loop time of the next probe when swept, set by HGPingSweep
+
+    @property
+    def confirming(self):
+        return 0 < self.failures < self.failure_count
+
+    @property
+    def next_interval(self):
+        return self.confirm_interval if self.confirming else self.current
+
+    def on_result(self, success: bool):
+        if success:
+            if self.failures:
+                # a target that just recovered is watched at its base interval before backing off again
+                self.failures = 0
+                self.successes = 0
+                self.current = self.interval
+                return
+
+            self.successes += 1
+            if self.successes >= self.stable_count:
+                self.successes = 0
+                self.current = min(self.current * self.backoff, self.max_interval)
+            return
+
+        # a confirmed outage is probed at the base interval, never faster
+        self.failures += 1
+        self.successes = 0
+        self.current = self.interval
+
+
+def adaptive_interval(target):
+    """
+    Cadence of a target with ADAPTIVE = TRUE, None keeps the fixed INTERVAL
+
+    :param target: compiled HGTarget
+    """
+    if not target.adaptive:
+        return None
+
+    return HGAdaptiveInterval(target.interval,
+                              max_interval=target.max_interval,
+                              confirm_interval=target.confirm_interval,
+                              stable_count=target.stable_count,
+                              backoff=target.backoff,
+                              failure_count=target.failure_count)
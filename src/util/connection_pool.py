@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+PHASES = ("dns", "connect", "ttfb", "body", "total")
+
+
+class HGRequestPhases:
+    __slots__ = ("start", "dns_start", "dns", "connect_start", "connect", "headers_sent", "ttfb", "body", "total",
+                 "loop_lag")
+
+    def __init__(self):
+        """
+        Monotonic nanosecond timestamps of one request, filled by the pool trace hooks and the monitor.
+        connect covers the TCP connect and for HTTPS the TLS handshake, aiohttp does not expose them apart
+        """
+        self.start = time.perf_counter_ns()
+        self.dns_start = self.connect_start = self.headers_sent = None
+        self.dns = self.connect = self.ttfb = self.body = self.total = self.loop_lag = 0
+
+    def phase(self, name: str):
+        # every phase is kept in nanoseconds and reported in milliseconds
+        return getattr(self, name) / 1e6
+
+    def measured(self, name: str):
+        # dns and connect only happen on a new connection, not on a reused keep-alive connection or cached address
+        if name == "dns":
+            return self.dns_start is not None
+        if name == "connect":
+            return self.connect_start is not None
+        return True
+
+    def as_dict(self):
+        return {name: self.phase(name) for name in PHASES + ("loop_lag",)}
+
+
+async def measure_loop_lag():
+    """
+    Nanoseconds the event loop needs to come back to this coroutine, grows when the monitor is overloaded
+    """
+    started = time.perf_counter_ns()
+    await asyncio.sleep(0)
+    return time.perf_counter_ns() - started
+
+
+class HGConnectionPool:
+
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: int = 10,
+                 dns_cache_ttl: int = 300,
+                 keepalive_timeout: float = 30,
+                 verify_ssl: bool = False):
+        """
+        Shared aiohttp connection pool borrowed by every HTTP/HTTPS/WAN monitor and notifier
+
+        :param limit: maximum number of open connections across every host
+        :param limit_per_host: maximum number of open connections to the same host
+        :param dns_cache_ttl: seconds a resolved address is kept in the DNS cache
+        :param keepalive_timeout: seconds an idle connection is kept open for reuse
+        :param verify_ssl: verify certificates, disabled by default for self-signed home lab targets
+        """
+
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._dns_cache_ttl = dns_cache_ttl
+        self._keepalive_timeout = keepalive_timeout
+        self._verify_ssl = verify_ssl
+
+        self._connector = None
+        self._session = None
+
+        # statistics collected from the aiohttp trace hooks
+        self._created = 0
+        self._reused = 0
+        self._queued = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._trace_config = None
+
+    @property
+    def session(self):
+        # created lazily so the connector binds to the running event loop, ICMP only setups never import aiohttp
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            if self._trace_config is None:
+                self._trace_config = aiohttp.TraceConfig()
+                self._trace_config.on_connection_create_end.append(self._on_connection_create_end)
+                self._trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+                self._trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+                self._trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+
+                # per request phase timing, only active when a HGRequestPhases is passed as trace_request_ctx
+                self._trace_config.on_dns_resolvehost_start.append(self._on_dns_resolvehost_start)
+                self._trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+                self._trace_config.on_connection_create_start.append(self._on_connection_create_start)
+                self._trace_config.on_request_headers_sent.append(self._on_request_headers_sent)
+                self._trace_config.on_request_end.append(self._on_request_end)
+
+            self._connector = aiohttp.TCPConnector(limit=self._limit,
+                                                   limit_per_host=self._limit_per_host,
+                                                   use_dns_cache=True,
+                                                   ttl_dns_cache=self._dns_cache_ttl,
+                                                   keepalive_timeout=self._keepalive_timeout,
+                                                   ssl=None if self._verify_ssl else False)
+
+            self._session = aiohttp.ClientSession(connector=self._connector,
+                                                  trace_configs=[self._trace_config])
+        return self._session
+
+    @property
+    def statistics(self):
+        acquired = len(getattr(self._connector, '_acquired', ()))
+        idle = sum(len(conns) for conns in getattr(self._connector, '_conns', {}).values())
+        requests = self._created + self._reused
+
+        return {"open_connections": acquired + idle,
+                "active_connections": acquired,
+                "idle_connections": idle,
+                "created": self._created,
+                "reused": self._reused,
+                "reuse_ratio": self._reused / requests if requests else 0.0,
+                "queued": self._queued,
+                "wait_time_avg_ms": self._wait_time_total / self._queued * 1000 if self._queued else 0.0,
+                "wait_time_max_ms": self._wait_time_max * 1000,
+                }
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self._created += 1
+
+        phases = trace_config_ctx.trace_request_ctx
+        if isinstance(phases, HGRequestPhases) and phases.connect_start:
+            phases.connect = time.perf_counter_ns() - phases.connect_start
+
+    async def _on_connection_create_start(self, session, trace_config_ctx, params):
+        if isinstance(trace_config_ctx.trace_request_ctx, HGRequestPhases):
+            trace_config_ctx.trace_request_ctx.connect_start = time.perf_counter_ns()
+
+    async def _on_dns_resolvehost_start(self, session, trace_config_ctx, params):
+        if isinstance(trace_config_ctx.trace_request_ctx, HGRequestPhases):
+            trace_config_ctx.trace_request_ctx.dns_start = time.perf_counter_ns()
+
+    async def _on_dns_resolvehost_end(self, session, trace_config_ctx, params):
+        phases = trace_config_ctx.trace_request_ctx
+        if isinstance(phases, HGRequestPhases) and phases.dns_start:
+            phases.dns = time.perf_counter_ns() - phases.dns_start
+
+    async def _on_request_headers_sent(self, session, trace_config_ctx, params):
+        if isinstance(trace_config_ctx.trace_request_ctx, HGRequestPhases):
+            trace_config_ctx.trace_request_ctx.headers_sent = time.perf_counter_ns()
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        phases = trace_config_ctx.trace_request_ctx
+        if isinstance(phases, HGRequestPhases) and phases.headers_sent:
+            phases.ttfb = time.perf_counter_ns() - phases.headers_sent
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        self._reused += 1
+
+    async def _on_connection_queued_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.queued_at = time.perf_counter()
+
+    async def _on_connection_queued_end(self, session, trace_config_ctx, params):
+        waited = time.perf_counter() - trace_config_ctx.queued_at
+
+        self._queued += 1
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
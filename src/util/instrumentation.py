@@ -0,0 +1,365 @@
+import asyncio
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from pathlib import Path
+
+# ms upper bounds of the event loop lag histogram
+LOOP_LAG_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, math.inf)
+PROFILERS = ("sample", "cprofile")
+
+
+def event_loop_name(loop=None):
+    loop = loop or asyncio.get_running_loop()
+    return "uvloop" if type(loop).__module__.startswith("uvloop") else "asyncio"
+
+
+def run_event_loop(main, use_uvloop: bool = False):
+    """
+    asyncio.run on the uvloop event loop when requested and installed, the default loop otherwise
+
+    :param main: coroutine to run until it completes
+    :param use_uvloop: run on uvloop, silently falls back when uvloop is not installed (e.g. Windows)
+    """
+    if use_uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            uvloop = None
+
+        if uvloop is not None:
+            if hasattr(asyncio, "Runner"):
+                with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                    return runner.run(main)
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())  # <-- Python 3.10
+
+    return asyncio.run(main)
+
+
+def _frame_name(code):
+    # module:qualified function, e.g. hg_http:HGHttpServiceMonitor.fetch
+    module = os.path.basename(code.co_filename).rsplit(".", 1)[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class _HGTimedProbe:
+    __slots__ = ("coroutine", "totals", "weight")
+
+    def __init__(self, coroutine, totals, weight):
+        """
+        Awaitable driving a probe coroutine step by step and adding the time of every step to its service
+        """
+        self.coroutine = coroutine
+        self.totals = totals  # <-- [estimated seconds, runs] of the service
+        self.weight = weight  # <-- runs this timed run stands for
+
+    def __await__(self):
+        coroutine = self.coroutine
+        clock = time.perf_counter
+        elapsed = 0.0
+        value = error = None
+
+        try:
+            while True:
+                started = clock()
+                try:
+                    future = coroutine.send(value) if error is None else coroutine.throw(error)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    elapsed += clock() - started
+
+                try:
+                    value, error = (yield future), None
+                except GeneratorExit:
+                    coroutine.close()
+                    raise
+                except BaseException as e:  # <-- cancellation is passed on to the probe
+                    value, error = None, e
+        finally:
+            self.totals[0] += elapsed * self.weight
+
+
+class HGSamplingProfiler:
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Samples the stack of the event loop thread from a background thread, nothing runs while it is stopped
+
+        :param interval: seconds between two samples
+        """
+        self.interval = interval
+        self.stacks = Counter()  # <-- tuple of code objects, innermost first: samples
+        self.samples = 0
+        self._thread_id = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, thread_id=None):
+        if self._thread is not None:
+            return False
+
+        self._thread_id = thread_id or threading.get_ident()
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="HGSamplingProfiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self._thread is None:
+            return False
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return True
+
+    def _sample(self):
+        stacks = self.stacks
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+
+            if stack:
+                stacks[tuple(stack)] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """
+        Samples in the collapsed stack format of flamegraph.pl and speedscope, one "outer;...;inner count" line
+        per distinct stack
+        """
+        names = {}
+        merged = Counter()
+        for stack, count in list(self.stacks.items()):
+            for code in stack:
+                if code not in names:
+                    names[code] = _frame_name(code)
+            merged[";".join(names[code] for code in reversed(stack))] += count
+
+        return "".join(f"{stack} {count}\n" for stack, count in merged.most_common())
+
+
+class HGInstrumentation:
+
+    def __init__(self,
+                 loop_lag_interval: float = 0.1,
+                 loop_lag_window: int = 600,
+                 probe_time_sample: int = 10,
+                 sample_interval: float = 0.005,
+                 profile_dir: str = "profiles",
+                 internal_logger=None):
+        """
+        Event loop health of the running monitor: continuous loop lag samples, time spent in the probes of every
+        service, task counts and a profiler switched on and off at runtime
+
+        :param loop_lag_interval: seconds between two event loop lag samples
+        :param loop_lag_window: recent samples kept for the lag percentiles and maximum
+        :param probe_time_sample: time one probe run out of this many per service, the others run untouched
+        :param sample_interval: seconds between two stack samples of the sampling profiler
+        :param profile_dir: directory the profiles are written to
+        :param internal_logger: Class access to store log files
+        """
+        self.loop_lag_interval = loop_lag_interval
+        self.profile_dir = Path(profile_dir)
+        self._internal_logger = internal_logger
+
+        self.loop_lag = 0.0  # <-- seconds, last sample
+        self.loop_lag_buckets = array('Q', bytes(8 * len(LOOP_LAG_BUCKETS)))
+        self.loop_lag_sum = 0.0
+        self.loop_lag_count = 0
+        self._recent_lag = deque(maxlen=loop_lag_window)
+
+        self.probe_time_sample = max(1, int(probe_time_sample))
+        self._probe_time = {}  # <-- service: [estimated seconds, runs], an ICMP run is a whole sweep
+
+        self.profiler = None  # <-- running profiler, one of PROFILERS
+        self.last_profile = None
+        self._sampler = HGSamplingProfiler(interval=sample_interval)
+        self._cprofile = None
+        self._profile_started = None
+
+    def reset_statistics(self):
+        # e.g. after a warmup, the lag and probe time then only cover what follows
+        self.loop_lag_buckets = array('Q', bytes(8 * len(LOOP_LAG_BUCKETS)))
+        self.loop_lag_sum = 0.0
+        self.loop_lag_count = 0
+        self._recent_lag.clear()
+        self._probe_time.clear()
+
+    async def measure_loop_lag(self):
+        """
+        Sample how late the event loop wakes up a sleeping task, busy loops delay every probe by this much
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.loop_lag_interval
+            await asyncio.sleep(self.loop_lag_interval)
+
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag = lag
+            self.loop_lag_buckets[bisect_left(LOOP_LAG_BUCKETS, lag * 1000)] += 1
+            self.loop_lag_sum += lag
+            self.loop_lag_count += 1
+            self._recent_lag.append(lag)
+
+    def loop_lag_percentile(self, percent):
+        # seconds, over the recent window
+        if not self._recent_lag:
+            return 0.0
+        ordered = sorted(self._recent_lag)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    @property
+    def loop_lag_max(self):
+        return max(self._recent_lag, default=0.0)
+
+    def timed(self, service, coroutine):
+        """
+        Awaitable running a probe coroutine, every probe_time_sample-th run of a service adds the event loop time
+        of its steps to the service, a step blocking the loop is counted in full
+
+        :param service: service the probe belongs to, e.g. HTTP or ICMP
+        :param coroutine: probe coroutine object
+        """
+        totals = self._probe_time.get(service)
+        if totals is None:
+            totals = self._probe_time[service] = [0.0, 0]
+
+        totals[1] += 1
+        if (totals[1] - 1) % self.probe_time_sample:
+            return coroutine  # <-- untimed runs cost one counter increment
+        return _HGTimedProbe(coroutine, totals, self.probe_time_sample)
+
+    @property
+    def probe_time(self):
+        """
+        Estimated seconds the event loop spent running the probes of every service and the runs started,
+        service: (seconds, runs)
+        """
+        return {service: tuple(totals) for service, totals in sorted(self._probe_time.items())}
+
+    @staticmethod
+    def tasks(limit: int = 20):
+        """
+        Pending tasks of the running loop grouped by coroutine, most frequent first
+        """
+        counts = Counter(getattr(task.get_coro(), "__qualname__", repr(task.get_coro()))
+                         for task in asyncio.all_tasks())
+        return dict(counts.most_common(limit))
+
+    @property
+    def statistics(self):
+        return {"event_loop": event_loop_name(),
+                "loop_lag_ms": self.loop_lag * 1000,
+                "loop_lag_p50_ms": self.loop_lag_percentile(50) * 1000,
+                "loop_lag_p99_ms": self.loop_lag_percentile(99) * 1000,
+                "loop_lag_max_ms": self.loop_lag_max * 1000,
+                "probe_time": {service: {"seconds": seconds, "runs": runs,
+                                         "per_run_us": seconds / runs * 1e6 if runs else 0.0}
+                               for service, (seconds, runs) in self.probe_time.items()},
+                "tasks": len(asyncio.all_tasks()),
+                "task_coroutines": self.tasks(),
+                "profiler": self.profiler,
+                "last_profile": self.last_profile and str(self.last_profile),
+                }
+
+    def start_profiler(self, mode: str = "sample"):
+        """
+        Start profiling the event loop thread, must be called from it
+
+        :param mode: sample records collapsed stacks from a background thread, cprofile traces every call
+        """
+        if mode not in PROFILERS:
+            raise ValueError(f"Unknown profiler {mode}, use one of {', '.join(PROFILERS)}")
+        if self.profiler is not None:
+            return False
+
+        if mode == "sample":
+            self._sampler.start()
+        else:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        self.profiler = mode
+        self._profile_started = time.time()
+        self._internal_logger.info("HGServiceMonitor %s profiler started", mode)
+        return True
+
+    def stop_profiler(self):
+        """
+        Stop the running profiler and write its profile, returns the file written or None
+        """
+        if self.profiler is None:
+            return None
+
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = f"hg_profile_{os.getpid()}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(self._profile_started))}"
+
+        if self.profiler == "sample":
+            self._sampler.stop()
+            path = self.profile_dir / f"{name}.collapsed"
+            path.write_text(self._sampler.collapsed(), encoding="utf8")
+        else:
+            self._cprofile.disable()
+            path = self.profile_dir / f"{name}.pstats"
+            self._cprofile.dump_stats(path)
+            self._cprofile = None
+
+        self._internal_logger.info("HGServiceMonitor %s profile of %.1fs written to %s, %s", self.profiler,
+                                   time.time() - self._profile_started, path, self.summary())
+        self.profiler = None
+        self.last_profile = path
+        return path
+
+    def toggle_profiler(self, mode: str = "sample"):
+        if self.profiler is None:
+            self.start_profiler(mode)
+        else:
+            self.stop_profiler()
+
+    def collapsed(self):
+        """
+        Collapsed stacks of the running or last sampling profile, None when nothing was sampled
+        """
+        if self.profiler == "sample" or self._sampler.samples:
+            return self._sampler.collapsed()
+        return None
+
+    def summary(self):
+        probe_time = ", ".join(f"{service} {seconds:.3f}s/{runs} runs"
+                               for service, (seconds, runs) in self.probe_time.items())
+        return (f"loop lag p99 {self.loop_lag_percentile(99) * 1000:.1f}ms max {self.loop_lag_max * 1000:.1f}ms, "
+                f"{len(asyncio.all_tasks())} task(s), probe time {probe_time or 'none'}")
+
+    def enable_signals(self):
+        # SIGUSR1 toggles the sampling profiler and SIGUSR2 cProfile, neither exists on Windows
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.toggle_profiler, "sample")
+            loop.add_signal_handler(signal.SIGUSR2, self.toggle_profiler, "cprofile")
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            self._internal_logger.debug("Profiler signals are not available on this platform")
+            return False
+        return True
+
+    def close(self):
+        # a profile still running when the monitor stops is written out
+        if self.profiler is not None:
+            self.stop_profiler()
@@ -0,0 +1,195 @@
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# value of the hg_event attribute attached to probe log records
+EVENT_SUCCESS = "success"
+EVENT_FAILURE = "failure"
+EVENT_STATE_CHANGE = "state_change"
+
+LOG_SAMPLING_ALL = "all"
+LOG_SAMPLING_FAILURES = "failures"
+
+
+class HGQueueHandler(QueueHandler):
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # a full queue drops the record, probes never wait on the disk
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # formatting is left to the listener thread, the probe only pays for the enqueue
+        return record
+
+
+class HGLogSamplingFilter(logging.Filter):
+
+    def __init__(self, mode: str = LOG_SAMPLING_ALL, success_sample: int = 0):
+        """
+        Drop routine probe records when running with high target counts
+
+        :param mode: all keeps every record, failures keeps failures, state changes and non probe records, success
+                     details below INFO are dropped
+        :param success_sample: in failures mode still keep one success record out of this many, 0 keeps none
+        """
+        super().__init__()
+        self.mode = mode
+        self.success_sample = success_sample
+        self._successes = 0
+
+    def filter(self, record):
+        if self.mode == LOG_SAMPLING_ALL or getattr(record, 'hg_event', None) != EVENT_SUCCESS:
+            return True
+
+        # details of a success such as the request phases are never sampled, only the success record itself
+        if record.levelno < logging.INFO:
+            return False
+
+        if self.success_sample:
+            self._successes += 1
+            return self._successes % self.success_sample == 0
+
+        return False
+
+
+class HGBatchedRotatingFileHandler(RotatingFileHandler):
+
+    def __init__(self,
+                 filename,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5,
+                 rotate_seconds: float = None,
+                 batch_size: int = 256,
+                 flush_interval: float = 1.0,
+                 encoding: str = "utf8"):
+        """
+        Rotating file handler flushing in batches instead of after every record
+
+        :param filename: path of the log file
+        :param max_bytes: rotate once the file reaches this size, 0 disables size rotation
+        :param backup_count: number of rotated files kept
+        :param rotate_seconds: rotate once the file is this old, None disables time rotation
+        :param batch_size: records written before the buffer is flushed to disk
+        :param flush_interval: seconds after which pending records are flushed regardless of the batch size
+        :param encoding: file encoding
+        """
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._size = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+        self._opened = time.time()
+
+    def shouldRollover(self, record):
+        # tracked in memory, seeking the stream like RotatingFileHandler would force a flush per record
+        if self.maxBytes and self._size >= self.maxBytes:
+            return True
+        return bool(self.rotate_seconds and time.time() - self._opened >= self.rotate_seconds)
+
+    def doRollover(self):
+        super().doRollover()
+        self._size = 0
+        self._opened = time.time()
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+
+            message = self.format(record) + self.terminator
+            self.stream.write(message)
+            self._size += len(message.encode(self.encoding or "utf8", errors="replace"))  # <-- max_bytes counts bytes
+            self._pending += 1
+
+            if self._pending >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+class HGQueueListener(QueueListener):
+
+    def __init__(self, log_queue, *handlers, flush_interval: float = 1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        # flush the batched handlers whenever the queue goes idle
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+
+class HGLogPipeline:
+
+    def __init__(self,
+                 output_log: str,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5,
+                 rotate_seconds: float = None,
+                 sampling: str = LOG_SAMPLING_ALL,
+                 success_sample: int = 0,
+                 flush_interval: float = 1.0,
+                 queue_size: int = 100000):
+        """
+        Non blocking logging, records are queued on the event loop thread and written by a background listener
+
+        :param output_log: path of the log file
+        :param max_bytes: size based rotation of the log file
+        :param backup_count: number of rotated log files kept
+        :param rotate_seconds: time based rotation of the log file
+        :param sampling: all or failures, see HGLogSamplingFilter
+        :param success_sample: keep one success record out of this many when sampling failures
+        :param flush_interval: maximum seconds a record waits in the file buffer
+        :param queue_size: maximum queued records, records are dropped instead of blocking probes when full
+        """
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(module)s - %(message)s  ')
+
+        self.console_handler = logging.StreamHandler()
+        self.console_handler.setLevel(logging.INFO)
+        self.console_handler.setFormatter(self.formatter)
+
+        self.file_handler = HGBatchedRotatingFileHandler(output_log,
+                                                         max_bytes=max_bytes,
+                                                         backup_count=backup_count,
+                                                         rotate_seconds=rotate_seconds,
+                                                         flush_interval=flush_interval)
+        self.file_handler.setLevel(logging.DEBUG)
+        self.file_handler.setFormatter(self.formatter)
+
+        self.queue_handler = HGQueueHandler(self.queue)
+        self.queue_handler.addFilter(HGLogSamplingFilter(mode=sampling, success_sample=success_sample))
+
+        self.listener = HGQueueListener(self.queue, self.console_handler, self.file_handler,
+                                        flush_interval=flush_interval)
+
+    def start(self, logger):
+        logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+        self.file_handler.close()
@@ -0,0 +1,196 @@
+import math
+import time
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from src.util.result_handler import LATENCY_BUCKETS, ERROR_NAMES, RESULT_SUCCESS
+from src.util.instrumentation import LOOP_LAG_BUCKETS
+
+# le labels of the latency histograms, the buckets are kept in ms and exported in seconds
+_BUCKET_LABELS = tuple('+Inf' if math.isinf(bound) else repr(bound / 1000) for bound in LATENCY_BUCKETS)
+_LOOP_LAG_LABELS = tuple('+Inf' if math.isinf(bound) else repr(bound / 1000) for bound in LOOP_LAG_BUCKETS)
+
+# (name, type, help) of the per target families in the order HGMetrics renders them
+_TARGET_FAMILIES = (("hg_probe_up", "gauge", "Last probe of the target succeeded"),
+                    ("hg_probe_success_total", "counter", "Successful probes"),
+                    ("hg_probe_last_success_timestamp_seconds", "gauge", "Unix time of the last successful probe"),
+                    ("hg_probe_failures_total", "counter", "Failed probes by error"),
+                    ("hg_probe_latency_seconds", "histogram", "Probe latency"))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _target_templates(label):
+    """
+    %-format templates of every family of one target with the label baked in, one format call renders a family
+    """
+    histogram = '\n'.join(f'hg_probe_latency_seconds_bucket{{target="{label}",le="{le}"}} %d' for le in _BUCKET_LABELS)
+    histogram += (f'\nhg_probe_latency_seconds_sum{{target="{label}"}} %r'
+                  f'\nhg_probe_latency_seconds_count{{target="{label}"}} %d')
+
+    return (f'hg_probe_up{{target="{label}"}} %s',
+            f'hg_probe_success_total{{target="{label}"}} %d',
+            f'hg_probe_last_success_timestamp_seconds{{target="{label}"}} %s',
+            histogram)
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class HGTargetMetrics:
+    __slots__ = ("label", "up", "buckets", "latency_sum", "latency_count", "successes", "failures", "last_success",
+                 "dirty", "rendered", "templates")
+
+    def __init__(self, target):
+        """
+        Preallocated counters of one target, probes only update them in place
+        """
+        self.label = _label(target)
+        self.up = math.nan
+        self.buckets = array('Q', bytes(8 * len(LATENCY_BUCKETS)))
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.successes = 0
+        self.failures = array('Q', bytes(8 * len(ERROR_NAMES)))
+        self.last_success = math.nan
+        self.dirty = True
+        self.rendered = None
+        self.templates = None  # <-- built on the first render
+
+
+class HGMetrics:
+
+    def __init__(self, render_interval: float = 1.0, instrumentation=None):
+        """
+        Prometheus exposition of probe results and monitor internals
+
+        :param render_interval: seconds a rendered exposition is reused, concurrent scrapes share one render
+        :param instrumentation: HGInstrumentation exporting the event loop lag and the probe time per service
+        """
+        self.render_interval = render_interval
+        self.instrumentation = instrumentation
+
+        self._targets = {}
+        self._gauges = []  # <-- (name, type, help, callable, label)
+        self._rendered_at = -math.inf
+        self._rendered = ''
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        metrics = self._targets.get(target)
+        if metrics is None:
+            metrics = self._targets[target] = HGTargetMetrics(target)
+
+        if status == RESULT_SUCCESS:
+            metrics.up = 1
+            metrics.successes += 1
+            metrics.last_success = timestamp
+        else:
+            metrics.up = 0
+            metrics.failures[error_code if error_code < len(ERROR_NAMES) else 0] += 1
+
+        if latency == latency:  # <-- not NaN
+            metrics.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+            metrics.latency_sum += latency
+            metrics.latency_count += 1
+
+        metrics.dirty = True
+
+    def remove_target(self, target):
+        self._targets.pop(target, None)
+
+    def add_gauge(self, name, help_text, callback, metric_type: str = "gauge", label: str = None):
+        """
+        Export a process internal, the callable is only evaluated when the metrics are rendered
+
+        :param name: metric name
+        :param help_text: HELP line of the metric
+        :param callback: callable returning the current value, or a dict of label value: value when label is set
+        :param metric_type: gauge or counter
+        :param label: name of the label the keys of the returned dict are exported as
+        """
+        self._gauges.append((name, metric_type, help_text, callback, label))
+
+    def _render_instrumentation(self):
+        instrumentation = self.instrumentation
+        buckets = accumulate(instrumentation.loop_lag_buckets)
+
+        lines = ['# HELP hg_event_loop_lag_seconds Delay of the event loop waking up a sleeping task',
+                 '# TYPE hg_event_loop_lag_seconds gauge',
+                 f'hg_event_loop_lag_seconds {repr(instrumentation.loop_lag)}',
+                 '# HELP hg_event_loop_lag_max_seconds Largest recent event loop lag sample',
+                 '# TYPE hg_event_loop_lag_max_seconds gauge',
+                 f'hg_event_loop_lag_max_seconds {repr(instrumentation.loop_lag_max)}',
+                 '# HELP hg_event_loop_lag_sampled_seconds Event loop lag samples',
+                 '# TYPE hg_event_loop_lag_sampled_seconds histogram']
+        lines += [f'hg_event_loop_lag_sampled_seconds_bucket{{le="{le}"}} {count}'
+                  for le, count in zip(_LOOP_LAG_LABELS, buckets)]
+        lines += [f'hg_event_loop_lag_sampled_seconds_sum {repr(instrumentation.loop_lag_sum)}',
+                  f'hg_event_loop_lag_sampled_seconds_count {instrumentation.loop_lag_count}']
+
+        probe_time = instrumentation.probe_time.items()
+        lines += ['# HELP hg_probe_cpu_seconds_total Estimated event loop time spent running the probes of a service',
+                  '# TYPE hg_probe_cpu_seconds_total counter']
+        lines += [f'hg_probe_cpu_seconds_total{{service="{_label(service)}"}} {repr(seconds)}'
+                  for service, (seconds, runs) in probe_time]
+        lines += ['# HELP hg_probe_runs_total Probe runs per service, an ICMP run sweeps every target of an interval',
+                  '# TYPE hg_probe_runs_total counter']
+        lines += [f'hg_probe_runs_total{{service="{_label(service)}"}} {runs}'
+                  for service, (seconds, runs) in probe_time]
+        return lines
+
+    def _render_target(self, metrics):
+        # one text block per metric family, families must not interleave in the exposition
+        if metrics.templates is None:
+            metrics.templates = _target_templates(metrics.label)
+        up, success, last_success, histogram = metrics.templates
+
+        failures = '\n'.join(f'hg_probe_failures_total{{target="{metrics.label}",error="{ERROR_NAMES[error_code]}"}} '
+                              f'{count}' for error_code, count in enumerate(metrics.failures) if count)
+
+        return (up % _number(metrics.up),
+                success % metrics.successes,
+                last_success % _number(metrics.last_success),
+                failures,
+                histogram % (*accumulate(metrics.buckets), metrics.latency_sum / 1000, metrics.latency_count))
+
+    def render(self):
+        now = time.monotonic()
+        if now - self._rendered_at < self.render_interval:
+            return self._rendered
+
+        # only targets probed since the last scrape are rendered again
+        rendered = []
+        for metrics in list(self._targets.values()):
+            if metrics.dirty:
+                metrics.rendered = self._render_target(metrics)
+                metrics.dirty = False
+            rendered.append(metrics.rendered)
+
+        lines = []
+        for family, (name, metric_type, help_text) in enumerate(_TARGET_FAMILIES):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            lines += [blocks[family] for blocks in rendered if blocks[family]]
+
+        if self.instrumentation is not None:
+            lines += self._render_instrumentation()
+
+        for name, metric_type, help_text, callback, label in self._gauges:
+            try:
+                value = callback()
+            except Exception:
+                value = {} if label else math.nan
+
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            if label:
+                lines += [f'{name}{{{label}="{_label(key)}"}} {_number(count)}' for key, count in value.items()]
+            else:
+                lines.append(f'{name} {_number(value)}')
+
+        self._rendered = '\n'.join(lines) + '\n'
+        self._rendered_at = now
+        return self._rendered
@@ -1,15 +1,250 @@
+import math
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+RESULT_FAIL = 0
+RESULT_SUCCESS = 1
+
+ERROR_NONE = 0
+ERROR_CONNECT = 1
+ERROR_LATENCY = 2
+ERROR_WAN_MISMATCH = 3
+ERROR_PACKET_LOSS = 4
+ERROR_RESPONSE_TEXT = 5
+ERROR_TIMEOUT = 6
+
+# label of every error code, indexed by the code
+ERROR_NAMES = ("none", "connect", "latency", "wan_mismatch", "packet_loss", "response_text", "timeout")
+
+# upper bound (ms) of every latency histogram bucket, used for the windowed percentiles
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000,
+                   10000, math.inf)
+
+
+def histogram_percentile(histogram, percent: float, minimum: float, maximum: float):
+    """
+    Approximate latency percentile interpolated inside the LATENCY_BUCKETS histogram bucket holding the rank
+
+    :param histogram: sample count of every LATENCY_BUCKETS bucket
+    :param percent: requested percentile between 0 and 100
+    :param minimum: lowest sample, bounds the first non empty bucket
+    :param maximum: highest sample, bounds the last non empty bucket
+    """
+    total = sum(histogram)
+    if not total:
+        return math.nan
+
+    rank = percent / 100 * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[bucket - 1] if bucket else 0
+            upper = min(LATENCY_BUCKETS[bucket], maximum)
+            lower = max(lower, minimum)
+            return lower + (upper - lower) * ((rank - seen) / count)
+        seen += count
+
+    return maximum
+
+
+class HGResultBuffer:
+
+    def __init__(self, capacity: int = 100, target=None, listeners=None):
+        """
+        Fixed capacity ring buffer of probe results with rolling aggregates over the buffered window
+
+        :param capacity: number of results kept for the target, memory stays constant once full
+        :param target: name of the target the results belong to
+        :param listeners: shared list of callables notified with every posted result
+        """
+        self.capacity = capacity
+        self.target = target
+        self._listeners = listeners if listeners is not None else []
+
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._status = array('b', bytes(capacity))
+        self._latency = array('d', bytes(8 * capacity))
+        self._error_code = array('H', bytes(2 * capacity))
+
+        self._head = 0  # <-- next slot to write
+        self._size = 0
+        self._sequence = 0  # <-- total results ever posted, used to expire min/max candidates
+
+        # rolling aggregates updated on every post
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self._failures = 0
+        self._histogram = array('I', bytes(4 * len(LATENCY_BUCKETS)))
+        self._min_candidates = deque()  # <-- (sequence, latency) increasing latency
+        self._max_candidates = deque()  # <-- (sequence, latency) decreasing latency
+
+        self.failures_total = 0
+        self.successes_total = 0
+        self.consecutive_failures = 0
+        self.last_status = None
+        self.last_success = None
+
+    def __len__(self):
+        return self._size
+
+    def _evict(self, slot):
+        if self._status[slot] == RESULT_FAIL:
+            self._failures -= 1
+
+        latency = self._latency[slot]
+        if not math.isnan(latency):
+            self._latency_sum -= latency
+            self._latency_count -= 1
+            self._histogram[bisect_left(LATENCY_BUCKETS, latency)] -= 1
+
+    def post(self, status: int, latency: float = math.nan, error_code: int = ERROR_NONE, timestamp: float = None,
+             notify: bool = True):
+        slot = self._head
+
+        if self._size == self.capacity:
+            self._evict(slot)
+        else:
+            self._size += 1
+
+        timestamp = timestamp or time.time()
+        self._timestamps[slot] = timestamp
+        self._status[slot] = status
+        self._latency[slot] = latency
+        self._error_code[slot] = error_code
+
+        self._head = (slot + 1) % self.capacity
+        self._sequence += 1
+
+        if status == RESULT_FAIL:
+            self._failures += 1
+            self.failures_total += 1
+            self.consecutive_failures += 1
+        else:
+            self.successes_total += 1
+            self.consecutive_failures = 0
+            self.last_success = self._timestamps[slot]
+        self.last_status = status
+
+        if not math.isnan(latency):
+            self._latency_sum += latency
+            self._latency_count += 1
+            self._histogram[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+            while self._min_candidates and self._min_candidates[-1][1] >= latency:
+                self._min_candidates.pop()
+            self._min_candidates.append((self._sequence, latency))
+
+            while self._max_candidates and self._max_candidates[-1][1] <= latency:
+                self._max_candidates.pop()
+            self._max_candidates.append((self._sequence, latency))
+
+        # candidates older than the window have been evicted from the ring
+        expired = self._sequence - self.capacity
+        while self._min_candidates and self._min_candidates[0][0] <= expired:
+            self._min_candidates.popleft()
+        while self._max_candidates and self._max_candidates[0][0] <= expired:
+            self._max_candidates.popleft()
+
+        # results replayed from storage are not handed to the listeners again
+        if notify:
+            for listener in self._listeners:
+                listener(self.target, status, latency, error_code, timestamp)
+
+    @property
+    def latency_count(self):
+        return self._latency_count
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def average(self):
+        return self._latency_sum / self._latency_count if self._latency_count else math.nan
+
+    @property
+    def minimum(self):
+        return self._min_candidates[0][1] if self._min_candidates else math.nan
+
+    @property
+    def maximum(self):
+        return self._max_candidates[0][1] if self._max_candidates else math.nan
+
+    def percentile(self, percent: float):
+        """
+        Approximate windowed latency percentile interpolated inside the fixed histogram bucket
+
+        :param percent: requested percentile between 0 and 100
+        """
+        if not self._latency_count:
+            return math.nan
+
+        return histogram_percentile(self._histogram, percent, self.minimum, self.maximum)
+
+    def recent(self, count: int = None):
+        """
+        Yield the most recent results oldest first as (timestamp, status, latency, error_code)
+        """
+        count = min(count or self._size, self._size)
+        for offset in range(count, 0, -1):
+            slot = (self._head - offset) % self.capacity
+            yield self._timestamps[slot], self._status[slot], self._latency[slot], self._error_code[slot]
+
+    @property
+    def statistics(self):
+        return {"results": self._size,
+                "failures": self._failures,
+                "failures_total": self.failures_total,
+                "successes_total": self.successes_total,
+                "consecutive_failures": self.consecutive_failures,
+                "latency_avg": self.average,
+                "latency_min": self.minimum,
+                "latency_max": self.maximum,
+                "latency_p50": self.percentile(50),
+                "latency_p95": self.percentile(95),
+                "latency_p99": self.percentile(99),
+                }
 
 
 class HGResultHandler:
 
-     def __init__(self):
-         self.results = []
+    def __init__(self, capacity: int = 100):
+        """
+        Shared result store, every target owns a fixed capacity HGResultBuffer
+
+        :param capacity: default number of results kept per target
+        """
+        self.capacity = capacity
+        self.results = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Register a callable(target, status, latency, error_code, timestamp) called on every posted result
+        """
+        self.listeners.append(listener)
+
+    def register(self, target, capacity: int = None):
+        if target not in self.results:
+            self.results[target] = HGResultBuffer(capacity=capacity or self.capacity,
+                                                  target=target,
+                                                  listeners=self.listeners)
+        return self.results[target]
+
+    def post_result(self, target, status: int, latency: float = math.nan, error_code: int = ERROR_NONE,
+                    timestamp: float = None):
+        buffer = self.results.get(target) or self.register(target)
+        buffer.post(status, latency=latency, error_code=error_code, timestamp=timestamp)
+        return buffer
 
-     def post_result(self):
-         pass
+    def get_result(self, target):
+        return self.results.get(target)
 
-     def print_result(self):
-         pass
+    def print_result(self, target=None):
+        for name in [target] if target else list(self.results):
+            print(f'{name} --> {self.results[name].statistics}')
 
-     def remove_result(self):
-         pass
\ No newline at end of file
+    def remove_result(self, target):
+        self.results.pop(target, None)
@@ -0,0 +1,360 @@
+import math
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from src.util.result_handler import LATENCY_BUCKETS, histogram_percentile
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+_STOP = object()
+
+# aggregate columns shared by both rollup tables, h<n> counts the samples of LATENCY_BUCKETS[n]
+ROLLUP_COLUMNS = ("count", "failures", "latency_count", "latency_sum", "latency_min", "latency_max") + \
+                 tuple(f"h{bucket}" for bucket in range(len(LATENCY_BUCKETS)))
+
+
+def _histogram_expressions():
+    expressions = []
+    for bucket, upper in enumerate(LATENCY_BUCKETS):
+        lower = LATENCY_BUCKETS[bucket - 1] if bucket else None
+        condition = " AND ".join(([f"latency > {lower}"] if lower is not None else []) +
+                                 ([f"latency <= {upper}"] if not math.isinf(upper) else []))
+        expressions.append(f"COUNT(CASE WHEN {condition or 'latency IS NOT NULL'} THEN 1 END)")
+    return expressions
+
+
+# aggregates of raw results and of already aggregated rollup rows, both produce ROLLUP_COLUMNS in order
+RAW_AGGREGATES = ", ".join(["COUNT(*)", "COUNT(CASE WHEN status = 0 THEN 1 END)", "COUNT(latency)", "TOTAL(latency)",
+                            "MIN(latency)", "MAX(latency)"] + _histogram_expressions())
+ROLLUP_AGGREGATES = ", ".join(["SUM(count)", "SUM(failures)", "SUM(latency_count)", "TOTAL(latency_sum)",
+                               "MIN(latency_min)", "MAX(latency_max)"] +
+                              [f"SUM(h{bucket})" for bucket in range(len(LATENCY_BUCKETS))])
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS targets (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS results (target_id INTEGER NOT NULL, ts REAL NOT NULL, status INTEGER NOT NULL, "
+    "latency REAL, error_code INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_target_ts ON results (target_id, ts)",
+    "CREATE INDEX IF NOT EXISTS results_ts ON results (ts)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)",
+] + [f"CREATE TABLE IF NOT EXISTS {table} (target_id INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+     f"{', '.join(ROLLUP_COLUMNS)}, PRIMARY KEY (target_id, bucket)) WITHOUT ROWID"
+     for table in ("rollup_1m", "rollup_1h")]
+
+
+class HGResultStore:
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = 1.0,
+                 batch_size: int = 5000,
+                 queue_size: int = 100000,
+                 raw_retention: float = 7 * DAY,
+                 minute_retention: float = 30 * DAY,
+                 hour_retention: float = 365 * DAY,
+                 rollup_grace: float = 10.0,
+                 internal_logger=None):
+        """
+        SQLite (WAL) history of every probe result with 1 minute and 1 hour rollups, written by a background thread
+
+        :param path: database file
+        :param flush_interval: maximum seconds a result waits before it is written
+        :param batch_size: results written per transaction
+        :param queue_size: maximum results waiting for the writer, newer results are dropped when full
+        :param raw_retention: seconds every single result is kept
+        :param minute_retention: seconds the 1 minute rollups are kept
+        :param hour_retention: seconds the 1 hour rollups are kept
+        :param rollup_grace: seconds a minute stays open for late results before it is rolled up
+        :param internal_logger: Class access to store log files
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.raw_retention = raw_retention
+        self.minute_retention = minute_retention
+        self.hour_retention = hour_retention
+        self.rollup_grace = rollup_grace
+        self._internal_logger = internal_logger
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._target_ids = {}
+        self._last_retention = 0.0
+
+        self.written = 0
+        self.dropped = 0
+
+        # the schema exists before the first query, the writer thread only appends
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                db.execute(statement)
+            db.commit()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        # called on the event loop, the result is only queued for the writer thread
+        try:
+            self._queue.put_nowait((target, timestamp, status, None if latency != latency else latency, error_code))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='hg-result-store', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _target_id(self, db, target):
+        target_id = self._target_ids.get(target)
+        if target_id is None:
+            db.execute("INSERT OR IGNORE INTO targets (name) VALUES (?)", (target,))
+            target_id = db.execute("SELECT id FROM targets WHERE name = ?", (target,)).fetchone()[0]
+            self._target_ids[target] = target_id
+        return target_id
+
+    def _write(self, db, pending):
+        with db:
+            db.executemany("INSERT INTO results (target_id, ts, status, latency, error_code) VALUES (?, ?, ?, ?, ?)",
+                           [(self._target_id(db, target), timestamp, status, latency, error_code)
+                            for target, timestamp, status, latency, error_code in pending])
+        self.written += len(pending)
+
+    @staticmethod
+    def _watermark(db, key, default):
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _rollup(self, db, now):
+        """
+        Aggregate every closed minute into rollup_1m and every closed hour into rollup_1h, an hour per transaction
+        """
+        closed_minute = int((now - self.rollup_grace) // MINUTE * MINUTE)
+        first = db.execute("SELECT MIN(ts) FROM results").fetchone()[0]
+        start = int(self._watermark(db, "rollup_1m", (first or closed_minute) // MINUTE * MINUTE))
+
+        while start < closed_minute:
+            end = min(start + HOUR, closed_minute)
+            with db:
+                db.execute(f"INSERT OR REPLACE INTO rollup_1m SELECT target_id, CAST(ts / {MINUTE} AS INTEGER) * "
+                           f"{MINUTE} AS minute, {RAW_AGGREGATES} FROM results WHERE ts >= ? AND ts < ? "
+                           f"GROUP BY target_id, minute", (start, end))
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_1m', ?)", (end,))
+            start = end
+
+        closed_hour = closed_minute // HOUR * HOUR
+        start = int(self._watermark(db, "rollup_1h", (first or closed_hour) // HOUR * HOUR))
+
+        while start < closed_hour:
+            end = min(start + DAY, closed_hour)
+            with db:
+                db.execute(f"INSERT OR REPLACE INTO rollup_1h SELECT target_id, bucket / {HOUR} * {HOUR} AS hour, "
+                           f"{ROLLUP_AGGREGATES} FROM rollup_1m WHERE bucket >= ? AND bucket < ? "
+                           f"GROUP BY target_id, hour", (start, end))
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_1h', ?)", (end,))
+            start = end
+
+    def _expire(self, db, now):
+        with db:
+            db.execute("DELETE FROM results WHERE ts < ?", (now - self.raw_retention,))
+            db.execute("DELETE FROM rollup_1m WHERE bucket < ?", (now - self.minute_retention,))
+            db.execute("DELETE FROM rollup_1h WHERE bucket < ?", (now - self.hour_retention,))
+        self._last_retention = now
+
+    def _maintain(self, db):
+        now = time.time()
+        self._rollup(db, now)
+        if now - self._last_retention >= HOUR:
+            self._expire(db, now)
+
+    def _run(self):
+        db = self._connect()
+        pending = []
+        next_flush = time.monotonic() + self.flush_interval
+        next_rollup = 0.0
+
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP:
+                pending.append(item)
+                if len(pending) < self.batch_size and time.monotonic() < next_flush:
+                    continue
+
+            try:
+                if pending:
+                    self._write(db, pending)
+                    pending = []
+                next_flush = time.monotonic() + self.flush_interval
+
+                # rollups and retention run at most once per minute once the writer caught up, a backlog
+                # would otherwise leave queued results behind an already rolled up minute
+                if item is _STOP or (time.monotonic() >= next_rollup and self._queue.empty()):
+                    self._maintain(db)
+                    next_rollup = time.monotonic() + MINUTE
+            except sqlite3.Error as e:
+                pending = []
+                if self._internal_logger:
+                    self._internal_logger.error('Result store write failed: %r', e)
+
+            if item is _STOP:
+                db.close()
+                return
+
+    def _lookup(self, db, target):
+        row = db.execute("SELECT id FROM targets WHERE name = ?", (target,)).fetchone()
+        return row[0] if row else None
+
+    def results(self, target, start: float, end: float = None):
+        """
+        Every stored result of a target between two unix times as (timestamp, status, latency, error_code)
+        """
+        with closing(self._connect()) as db:
+            target_id = self._lookup(db, target)
+            rows = db.execute("SELECT ts, status, latency, error_code FROM results WHERE target_id = ? AND ts >= ? "
+                              "AND ts < ? ORDER BY ts", (target_id, start, end or time.time())).fetchall()
+
+        return [(timestamp, status, math.nan if latency is None else latency, error_code)
+                for timestamp, status, latency, error_code in rows]
+
+    def recent(self, target, count: int):
+        """
+        Last stored results of a target oldest first
+        """
+        return self.recent_many({target: count}).get(target, [])
+
+    def recent_many(self, counts: dict):
+        """
+        Last stored results of several targets oldest first as target: [(timestamp, status, latency, error_code)],
+        a single query warms every in memory window on startup or reload, blocking, run it off the event loop
+
+        :param counts: target: number of results wanted
+        """
+        if not counts:
+            return {}
+
+        with closing(self._connect()) as db:
+            db.execute("CREATE TEMP TABLE warm (name TEXT PRIMARY KEY)")
+            db.executemany("INSERT INTO warm (name) VALUES (?)", [(target,) for target in counts])
+
+            # LIMIT cannot depend on the row, every target reads the largest window through its index
+            rows = db.execute("SELECT w.name, r.ts, r.status, r.latency, r.error_code FROM warm w "
+                              "JOIN targets t ON t.name = w.name JOIN results r ON r.rowid IN "
+                              "(SELECT rowid FROM results WHERE target_id = t.id ORDER BY ts DESC LIMIT ?)",
+                              (max(counts.values()),)).fetchall()
+
+        recent = {}
+        for target, timestamp, status, latency, error_code in rows:
+            recent.setdefault(target, []).append((timestamp, status, math.nan if latency is None else latency,
+                                                  error_code))
+
+        return {target: sorted(results)[-counts[target]:] for target, results in recent.items()}
+
+    def rollups(self, target, start: float, end: float = None, resolution: str = "1m"):
+        """
+        Rolled up buckets of a target as dicts with bucket start, count, failures and latency avg/min/max/p95
+
+        :param resolution: 1m or 1h
+        """
+        table = {"1m": "rollup_1m", "1h": "rollup_1h"}[resolution]
+        with closing(self._connect()) as db:
+            target_id = self._lookup(db, target)
+            rows = db.execute(f"SELECT bucket, {', '.join(ROLLUP_COLUMNS)} FROM {table} WHERE target_id = ? AND "
+                              f"bucket >= ? AND bucket < ? ORDER BY bucket",
+                              (target_id, start, end or time.time())).fetchall()
+
+        return [dict(bucket=row[0], **self._describe(row[1:])) for row in rows]
+
+    def summary(self, target, start: float, end: float = None):
+        """
+        Availability and latency statistics of a target over any range, read from the coarsest data covering it
+
+        :param target: section name of the target
+        :param start: unix time of the range start
+        :param end: unix time of the range end, defaults to now
+        """
+        end = end or time.time()
+
+        with closing(self._connect()) as db:
+            target_id = self._lookup(db, target)
+            minute_mark = self._watermark(db, "rollup_1m", 0)  # <-- results before it are in rollup_1m
+            hour_mark = self._watermark(db, "rollup_1h", 0)  # <-- minutes before it are in rollup_1h
+
+            # the partial first and last minutes and anything not rolled up yet are read raw
+            rolled_start = min(math.ceil(start / MINUTE) * MINUTE, end)
+            rolled_end = max(min(end // MINUTE * MINUTE, minute_mark), rolled_start)
+            hour_start = math.ceil(rolled_start / HOUR) * HOUR
+            hour_end = min(rolled_end // HOUR * HOUR, hour_mark)
+
+            segments = [("results", start, rolled_start), ("results", rolled_end, end)]
+            if hour_end > hour_start:
+                segments += [("rollup_1h", hour_start, hour_end),
+                             ("rollup_1m", rolled_start, hour_start), ("rollup_1m", hour_end, rolled_end)]
+            else:
+                segments.append(("rollup_1m", rolled_start, rolled_end))
+
+            totals = None
+            for table, low, high in segments:
+                if high <= low:
+                    continue
+                if table == "results":
+                    query = f"SELECT {RAW_AGGREGATES} FROM results WHERE target_id = ? AND ts >= ? AND ts < ?"
+                else:
+                    query = f"SELECT {ROLLUP_AGGREGATES} FROM {table} WHERE target_id = ? AND bucket >= ? " \
+                            f"AND bucket < ?"
+                row = db.execute(query, (target_id, low, high)).fetchone()
+                totals = row if totals is None else self._merge(totals, row)
+
+        return self._describe(totals or (0,) * len(ROLLUP_COLUMNS))
+
+    @staticmethod
+    def _merge(left, right):
+        merged = []
+        for column, (a, b) in zip(ROLLUP_COLUMNS, zip(left, right)):
+            if a is None or b is None:
+                merged.append(b if a is None else a)
+            elif column == "latency_min":
+                merged.append(min(a, b))
+            elif column == "latency_max":
+                merged.append(max(a, b))
+            else:
+                merged.append(a + b)
+        return merged
+
+    @staticmethod
+    def _describe(row):
+        count, failures, latency_count, latency_sum, minimum, maximum = [value or 0 for value in row[:6]]
+        histogram = [value or 0 for value in row[6:]]
+        minimum = minimum if latency_count else math.nan
+        maximum = maximum if latency_count else math.nan
+
+        return {"count": count,
+                "failures": failures,
+                "availability": (count - failures) / count if count else math.nan,
+                "latency_avg": latency_sum / latency_count if latency_count else math.nan,
+                "latency_min": minimum,
+                "latency_max": maximum,
+                "latency_p50": histogram_percentile(histogram, 50, minimum, maximum),
+                "latency_p95": histogram_percentile(histogram, 95, minimum, maximum),
+                "latency_p99": histogram_percentile(histogram, 99, minimum, maximum),
+                }
+
+    @property
+    def statistics(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
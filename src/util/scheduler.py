@@ -0,0 +1,302 @@
+import asyncio
+import heapq
+import itertools
+import math
+import zlib
+
+
+class HGScheduledJob:
+
+    def __init__(self, name, interval: float, callback, cadence=None, timeout: float = None, service: str = None):
+        """
+        A recurring probe registered with the HGScheduler
+
+        :param name: unique job name, usually the target section
+        :param interval: seconds between two deadlines, fractions are supported
+        :param callback: coroutine function awaited on every deadline
+        :param cadence: HGAdaptiveInterval choosing the next deadline once the probe finished, None keeps interval
+        :param timeout: seconds one run may take before it is cancelled, None lets it run
+        :param service: service the event loop time of every run is accounted to, e.g. HTTP or ICMP
+        """
+        self.name = name
+        self.service = service
+        self.interval = interval
+        self.callback = callback
+        self.cadence = cadence
+        self.timeout = timeout
+        self.canary = None  # <-- slower interval while a target it depends on is down, 0 pauses the job
+        self.deadline = None
+        self.task = None
+        self.cancelled = False
+        self.runs = 0
+        self.skipped = 0  # <-- deadlines missed because the previous probe was still running
+        self.timeouts = 0  # <-- runs cancelled at their deadline
+        self.errors = 0  # <-- runs that raised
+        self.crashes = 0  # <-- consecutive runs that raised, the next run is delayed by an exponential backoff
+
+
+class HGScheduler:
+
+    def __init__(self,
+                 max_concurrency: int = 500,
+                 jitter: float = 1.0,
+                 deadline_grace: float = 1.0,
+                 restart_backoff: float = 1.0,
+                 max_restart_backoff: float = 300,
+                 instrumentation=None,
+                 internal_logger=None):
+        """
+        Central min-heap scheduler firing every probe on fixed-rate deadlines
+
+        :param max_concurrency: maximum number of probes in flight at once
+        :param jitter: fraction of the interval used to spread the first deadline of every job
+        :param deadline_grace: seconds a run may exceed its job timeout, so a probe timing out on its own still
+                               records its failure, before it is cancelled
+        :param restart_backoff: seconds the next run of a crashed job is delayed, doubled on every further crash
+        :param max_restart_backoff: longest delay of a job that keeps crashing
+        :param instrumentation: HGInstrumentation timing the runs of every job with a service
+        :param internal_logger: Class access to store log files
+        """
+        self._max_concurrency = max_concurrency
+        self._jitter = jitter
+        self._deadline_grace = deadline_grace
+        self._restart_backoff = restart_backoff
+        self._max_restart_backoff = max_restart_backoff
+        self._instrumentation = instrumentation
+        self._internal_logger = internal_logger
+
+        self._heap = []
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._semaphore = None
+        self._wakeup = None
+        self._in_flight = 0
+
+        # how late probes start after their deadline, waiting for a free concurrency slot included
+        self.dispatched = 0
+        self.drift_total = 0.0
+        self.drift_max = 0.0
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def statistics(self):
+        return {"jobs": len(self._jobs),
+                "in_flight": self._in_flight,
+                "dispatched": self.dispatched,
+                "skipped": sum(job.skipped for job in self._jobs.values()),
+                "timeouts": sum(job.timeouts for job in self._jobs.values()),
+                "errors": sum(job.errors for job in self._jobs.values()),
+                "crashing": sum(1 for job in self._jobs.values() if job.crashes),
+                "drift_avg_ms": self.drift_total / self.dispatched * 1000 if self.dispatched else 0.0,
+                "drift_max_ms": self.drift_max * 1000,
+                }
+
+    def reset_statistics(self):
+        # e.g. after a warmup, the drift then only covers what follows
+        self.dispatched = 0
+        self.drift_total = 0.0
+        self.drift_max = 0.0
+
+    def _wake(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.deadline, next(self._sequence), job))
+
+    def add_job(self, name, interval: float, callback, cadence=None, timeout: float = None, service: str = None):
+        """
+        Register a recurring job, the first deadline is offset by a per job jitter so jobs sharing
+        an interval do not fire at the same moment
+        """
+        if name in self._jobs:
+            self.remove_job(name)
+
+        job = HGScheduledJob(name=name, interval=float(interval), callback=callback, cadence=cadence,
+                             timeout=timeout, service=service)
+        # stable per name and much cheaper than seeding a Random for every one of thousands of jobs
+        offset = zlib.crc32(str(name).encode()) / 0x100000000 * job.interval * self._jitter
+
+        # until run starts the deadline only holds the offset, it is rebased on the loop clock there
+        job.deadline = asyncio.get_running_loop().time() + offset if self._semaphore else offset
+        self._jobs[name] = job
+        self._push(job)
+        self._wake()
+
+        return job
+
+    def remove_job(self, name):
+        job = self._jobs.pop(name, None)
+
+        if job is not None:
+            job.cancelled = True  # <-- lazily dropped from the heap
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+        return job
+
+    def set_canary(self, name, interval=None):
+        """
+        Slow a job down to a canary interval, e.g. while a target it depends on is down
+
+        :param name: job name
+        :param interval: seconds between two canary runs, 0 pauses the job, None restores its own interval and
+                         runs it right away
+        """
+        job = self._jobs.get(name)
+        if job is None:
+            return None
+
+        job.canary = interval
+        if self._semaphore is None:
+            return job  # <-- not running yet, run starts every job on its own deadline
+
+        # the previous heap entry no longer matches the deadline and is dropped lazily
+        job.deadline = None if interval == 0 else asyncio.get_running_loop().time() + (interval or 0)
+        if job.deadline is not None:
+            self._push(job)
+            self._wake()
+
+        return job
+
+    async def _dispatch(self, job, deadline):
+        async with self._semaphore:
+            drift = asyncio.get_running_loop().time() - deadline
+            self.dispatched += 1
+            self.drift_total += drift
+            self.drift_max = max(self.drift_max, drift)
+
+            self._in_flight += 1
+            try:
+                probe = job.callback()
+                if self._instrumentation is not None and job.service is not None:
+                    probe = self._instrumentation.timed(job.service, probe)
+
+                if job.timeout is None:
+                    await probe
+                else:
+                    await asyncio.wait_for(probe, job.timeout + self._deadline_grace)
+                job.crashes = 0
+            except asyncio.TimeoutError:
+                # the probe ignored its own deadline, cancelling it frees the slot for the healthy targets
+                job.timeouts += 1
+                self._internal_logger.warning('Scheduled job %s overran its %ss deadline and was cancelled',
+                                              job.name, job.timeout)
+            except Exception as e:
+                job.errors += 1
+                job.crashes += 1
+                delay = min(self._restart_backoff * 2 ** (job.crashes - 1), self._max_restart_backoff)
+                self._internal_logger.error('Scheduled job %s crashed %s time(s) in a row, next run in %.1fs: %r',
+                                            job.name, job.crashes, delay, e, exc_info=True)
+                self._delay(job, delay)
+            finally:
+                self._in_flight -= 1
+                job.runs += 1
+
+                # adaptive jobs are only pushed back once the probe result picked their next interval,
+                # unless the job was paused or rescheduled meanwhile
+                if job.cadence is not None and not job.cancelled and job.deadline == deadline:
+                    job.deadline = max(deadline + (job.canary or job.cadence.next_interval),
+                                       asyncio.get_running_loop().time())
+                    self._push(job)
+                    self._wake()
+
+    def _delay(self, job, delay):
+        # a paused or removed job stays so, a later deadline already far enough away is kept
+        if job.cancelled or job.deadline is None:
+            return
+
+        restart = asyncio.get_running_loop().time() + delay
+        if restart > job.deadline:
+            job.deadline = restart
+            self._push(job)
+            self._wake()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        # a restarted run keeps the deadlines and the heap of the crashed one
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+            start = loop.time()
+            for job in self._jobs.values():
+                job.deadline += start
+                if job.canary:
+                    job.deadline += job.canary
+                elif job.canary == 0:
+                    job.deadline = None
+            self._heap = [(job.deadline, next(self._sequence), job) for job in self._jobs.values()
+                          if job.deadline is not None]
+            heapq.heapify(self._heap)
+
+        while True:
+            if not self._heap:
+                self._wakeup = loop.create_future()
+                await self._wakeup
+                continue
+
+            deadline, _, job = self._heap[0]
+
+            if job.cancelled or deadline != job.deadline:
+                heapq.heappop(self._heap)  # <-- removed, paused or rescheduled since it was pushed
+                continue
+
+            if deadline > loop.time():
+                self._wakeup = loop.create_future()
+                timer = loop.call_at(deadline, self._wake)
+                await self._wakeup
+                timer.cancel()
+                continue
+
+            heapq.heappop(self._heap)
+            now = loop.time()
+
+            if job.task is None or job.task.done():
+                job.task = loop.create_task(self._dispatch(job, deadline))
+
+                # adaptive jobs are pushed back by _dispatch once the probe result picked their next interval
+                if job.cadence is not None and not job.canary:
+                    continue
+            else:
+                job.skipped += 1
+
+            # fixed rate, deadlines never drift with probe duration and missed ticks are skipped
+            interval = job.canary or (job.cadence.next_interval if job.cadence else job.interval)
+            job.deadline = deadline + interval
+            if job.deadline <= now:
+                job.deadline += (math.floor((now - job.deadline) / interval) + 1) * interval
+
+            self._push(job)
+
+
+async def supervise(name, service, internal_logger, backoff: float = 1.0, max_backoff: float = 300):
+    """
+    Await a long running service and restart it with an exponential backoff whenever it crashes
+
+    :param name: service name used in the log
+    :param service: coroutine function of the service, called again on every restart
+    :param internal_logger: Class access to store log files
+    :param backoff: seconds before the first restart, doubled on every further crash
+    :param max_backoff: longest delay between two restarts, a service running that long starts over from backoff
+    """
+    loop = asyncio.get_running_loop()
+    crashes = 0
+
+    while True:
+        started = loop.time()
+        try:
+            return await service()
+        except Exception as e:
+            crashes = 1 if loop.time() - started > max_backoff else crashes + 1
+            delay = min(backoff * 2 ** (crashes - 1), max_backoff)
+            internal_logger.error('%s crashed %s time(s) in a row, restarting in %.1fs: %r', name, crashes, delay, e,
+                                  exc_info=True)
+            await asyncio.sleep(delay)
@@ -0,0 +1,326 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+from src.util.result_handler import HGResultHandler, RESULT_FAIL, ERROR_NONE, ERROR_LATENCY
+from src.util.instrumentation import run_event_loop
+
+# binary records sent from a shard worker to the parent, several records are packed in one pipe message
+RECORD_RESULT = 1
+RECORD_ALERT = 2
+
+# kind, target index, timestamp, status, latency, error code
+RESULT_RECORD = struct.Struct('<BIdbdH')
+# kind, target index, error code, message length followed by the utf8 message
+ALERT_RECORD = struct.Struct('<BIHH')
+
+NO_TARGET = 0xFFFFFFFF
+
+
+def pack_result(index, status, latency, error_code, timestamp):
+    return RESULT_RECORD.pack(RECORD_RESULT, index, timestamp, status, latency, error_code)
+
+
+def pack_alert(index, message, error_code=ERROR_NONE):
+    encoded = message.encode('utf8')[:0xFFFF]
+    return ALERT_RECORD.pack(RECORD_ALERT, index, error_code, len(encoded)) + encoded
+
+
+def shard_log(output_log, shard_id):
+    # every worker writes and rotates its own file, e.g. hg_logmonitor.shard-0.log next to the parent's
+    path = Path(output_log)
+    return str(path.with_name(f'{path.stem}.shard-{shard_id}{path.suffix}'))
+
+
+def unpack_records(payload):
+    """
+    Yield (kind, target index, values) for every record packed in a pipe message
+    """
+    offset = 0
+    while offset < len(payload):
+        kind = payload[offset]
+
+        if kind == RECORD_RESULT:
+            _, index, timestamp, status, latency, error_code = RESULT_RECORD.unpack_from(payload, offset)
+            offset += RESULT_RECORD.size
+            yield kind, index, (status, latency, error_code, timestamp)
+
+        elif kind == RECORD_ALERT:
+            _, index, error_code, length = ALERT_RECORD.unpack_from(payload, offset)
+            offset += ALERT_RECORD.size
+            yield kind, index, (payload[offset:offset + length].decode('utf8', errors='replace'), error_code)
+            offset += length
+
+        else:
+            raise ValueError(f'Unknown shard record type {kind} at offset {offset}')
+
+
+class HGShardWorker:
+
+    def __init__(self, shard_id, sections, connection, flush_interval: float = 0.25, flush_size: int = 65536):
+        """
+        Runs a regular HGServiceMonitor for a slice of the targets and streams results and alerts to the parent
+
+        :param shard_id: index of the shard
+        :param sections: ordered mapping of section name to the compiled HGTarget handled by this shard
+        :param connection: write end of the pipe to the parent
+        :param flush_interval: seconds between two pipe writes
+        :param flush_size: pending bytes that trigger an early pipe write
+        """
+        self.shard_id = shard_id
+        self.sections = sections
+        self.connection = connection
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._index = {name: position for position, name in enumerate(sections)}
+        self._pending = bytearray()
+        self._alert_kind = {}  # <-- target: error code of the next alert, latency after a success
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        self._pending += pack_result(self._index.get(target, NO_TARGET), status, latency, error_code, timestamp)
+        self._alert_kind[target] = error_code if status == RESULT_FAIL else ERROR_LATENCY
+
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def submit(self, message, target=None, service=None, throttle=None):
+        # stands in for the alert dispatcher, coalescing and rate limits are applied once in the parent
+        self._pending += pack_alert(self._index.get(target, NO_TARGET), message or "",
+                                    self._alert_kind.get(target, ERROR_NONE))
+        self.flush()
+        return True
+
+    async def close(self):
+        self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.connection.send_bytes(bytes(self._pending))
+            self._pending.clear()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    async def _run(self, monitor):
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            await monitor.async_monitor_startup()
+        finally:
+            flusher.cancel()
+            self.flush()
+
+    def run(self, monitor_options):
+        # imported here, the service monitor imports this module for the parent side
+        from src.hg_service_monitor import HGServiceMonitor
+
+        # the parent serves the status API for every shard
+        monitor_options = dict(monitor_options)
+        monitor_options['output_log'] = shard_log(monitor_options.get('output_log', '/logs/hg_logmonitor.log'),
+                                                  self.shard_id)
+        monitor = HGServiceMonitor(targets_sections=self.sections, notify_status=False, web_tail_logs=False,
+                                   **monitor_options)
+        monitor.alert_dispatcher = self
+        monitor._ssm_result.add_listener(self.on_result)
+
+        run_event_loop(self._run(monitor), use_uvloop=monitor.use_uvloop)
+
+
+def _run_shard_worker(shard_id, sections, connection, monitor_options):
+    HGShardWorker(shard_id, sections, connection).run(monitor_options)
+
+
+class HGShardSupervisor:
+
+    def __init__(self,
+                 sections,
+                 workers: int = None,
+                 monitor_options: dict = None,
+                 alert_dispatcher=None,
+                 dedup_window: float = 300,
+                 restart_backoff: float = 1,
+                 restart_backoff_max: float = 60,
+                 internal_logger=None):
+        """
+        Parent side of the sharded mode, splits the targets across worker processes and aggregates their results
+
+        :param sections: ordered mapping of section name to its compiled HGTarget
+        :param workers: number of worker processes, defaults to the CPU count
+        :param monitor_options: HGServiceMonitor keyword arguments forwarded to every worker
+        :param alert_dispatcher: HGAlertDispatcher receiving the deduplicated alerts
+        :param dedup_window: seconds further alerts of the same target and error are suppressed after one was sent
+        :param restart_backoff: first delay before restarting a dead worker, doubled on every crash
+        :param restart_backoff_max: upper bound of the restart delay
+        :param internal_logger: Class access to store log files
+        """
+        self.sections = sections
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(sections) or 1))
+        self.monitor_options = monitor_options or {}
+        self.alert_dispatcher = alert_dispatcher
+        self.dedup_window = dedup_window
+        self.restart_backoff = restart_backoff
+        self.restart_backoff_max = restart_backoff_max
+        self._internal_logger = internal_logger
+
+        self.results = HGResultHandler(capacity=self.monitor_options.get('result_window', 100))
+        self.shards = self.split()
+        self.workers = len(self.shards)  # <-- a worker without targets would exit and be restarted forever
+
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = {}
+        self._restarts = {}
+        self._sent_alerts = {}  # <-- (target, error code) or (None, message): last time sent, oldest first
+        self._executor = None  # <-- created by every run, a crashed run shuts its own down
+
+    def split(self):
+        """
+        Non empty shards of the targets, linked targets share a shard unless their group is much larger than a share
+        """
+        # targets linked by DEPENDS_ON share a shard, a worker only pauses the dependents of its own targets
+        roots = {name: name for name in self.sections}
+
+        def root(name):
+            while roots[name] != name:
+                roots[name] = roots[roots[name]]
+                name = roots[name]
+            return name
+
+        for name, target in self.sections.items():
+            for parent in target.depends_on:
+                if parent in roots:
+                    roots[root(name)] = root(parent)
+
+        groups = {}
+        for name, target in self.sections.items():
+            groups.setdefault(root(name), {})[name] = target
+
+        # a group much larger than a shard's share, e.g. every target behind one gateway, is split into shares
+        share = -(-len(self.sections) // self.workers)
+        pieces = []
+        for group in groups.values():
+            if len(group) <= 2 * share:
+                pieces.append(group)
+                continue
+
+            names = list(group)
+            pieces += [{name: group[name] for name in names[start:start + share]}
+                       for start in range(0, len(names), share)]
+
+        # largest pieces first to the least loaded shard
+        shards = [{} for _ in range(self.workers)]
+        for piece in sorted(pieces, key=len, reverse=True):
+            min(shards, key=len).update(piece)
+
+        # DEPENDS_ON across shards is left to the alert folding of the parent, the worker only knows its own targets
+        for shard in shards:
+            for name, target in shard.items():
+                if any(parent not in shard for parent in target.depends_on):
+                    shard[name] = replace(target, depends_on=tuple(parent for parent in target.depends_on
+                                                                   if parent in shard))
+
+        return [shard for shard in shards if shard]
+
+    def _start(self, shard_id):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_shard_worker,
+                                        args=(shard_id, self.shards[shard_id], sender, self.monitor_options),
+                                        name=f'hg-shard-{shard_id}',
+                                        daemon=True)
+        process.start()
+        sender.close()  # <-- only the worker keeps the write end, EOF then means the worker is gone
+
+        self._processes[shard_id] = process
+        self._internal_logger.info(f'Shard {shard_id} started with pid {process.pid} '
+                                   f'monitoring {len(self.shards[shard_id])} target(s)')
+        return receiver
+
+    def _handle_alert(self, target, message, error_code=ERROR_NONE):
+        now = time.monotonic()
+
+        # alerts of the monitor itself have no target, their text is the key
+        key = (target, error_code) if target is not None else (None, message)
+        if now - self._sent_alerts.get(key, -self.dedup_window) < self.dedup_window:
+            self._internal_logger.debug('Suppressed duplicate alert %s', message)
+            return
+
+        # re-inserted so the dict stays ordered by send time, expired keys are evicted from the front
+        self._sent_alerts.pop(key, None)
+        self._sent_alerts[key] = now
+        while self._sent_alerts:
+            oldest = next(iter(self._sent_alerts))
+            if now - self._sent_alerts[oldest] < self.dedup_window:
+                break
+            del self._sent_alerts[oldest]
+
+        if self.alert_dispatcher is not None:
+            options = self.sections.get(target)
+            self.alert_dispatcher.submit(message, target=target,
+                                         service=options.alert_service if options else None,
+                                         throttle=options.alert_throttle if options else None)
+
+    async def _supervise(self, shard_id):
+        loop = asyncio.get_running_loop()
+        names = list(self.shards[shard_id])
+
+        while True:
+            receiver = self._start(shard_id)
+            started = time.monotonic()
+
+            while True:
+                try:
+                    payload = await loop.run_in_executor(self._executor, receiver.recv_bytes)
+                except (EOFError, OSError):
+                    break
+
+                for kind, index, values in unpack_records(payload):
+                    if kind == RECORD_RESULT and index < len(names):
+                        status, latency, error_code, timestamp = values
+                        self.results.post_result(names[index], status, latency=latency,
+                                                 error_code=error_code, timestamp=timestamp)
+                    elif kind == RECORD_ALERT:
+                        message, error_code = values
+                        self._handle_alert(names[index] if index < len(names) else None, message, error_code)
+
+            receiver.close()
+            process = self._processes.pop(shard_id)
+            process.join(timeout=5)
+
+            # a worker that stayed up for a while restarts quickly again
+            if time.monotonic() - started > self.restart_backoff_max:
+                self._restarts[shard_id] = 0
+
+            delay = min(self.restart_backoff * 2 ** self._restarts.get(shard_id, 0), self.restart_backoff_max)
+            self._restarts[shard_id] = self._restarts.get(shard_id, 0) + 1
+
+            self._internal_logger.info(f'Shard {shard_id} exited with code {process.exitcode}, '
+                                       f'restarting in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        # a fresh reader pool per run, the supervise helper restarts a crashed run
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix='hg-shard-reader')
+        tasks = [asyncio.ensure_future(self._supervise(shard_id)) for shard_id in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # the other shards stop with a crashed one, otherwise they would keep restarting workers on a dead pool
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.stop()
+
+    def stop(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,395 @@
+import configparser
+import hashlib
+import json
+import os
+from dataclasses import dataclass, fields
+from enum import Enum
+from src.util.connection_pool import PHASES
+
+MODEL_VERSION = 4  # <-- bump whenever HGTarget or its compilation changes, older cache files are ignored
+BODY_MODES = ("auto", "head", "headers", "stream", "full")
+WAN_URL = "https://api.ipify.org"
+
+_BOOLEANS = configparser.ConfigParser.BOOLEAN_STATES
+
+
+class HGService(str, Enum):
+    HTTP = "HTTP"
+    HTTPS = "HTTPS"
+    ICMP = "ICMP"
+    WAN = "WAN"
+
+
+class HGMsCalc(str, Enum):
+    AVG = "avg"
+    GT = "gt"
+    LT = "lt"
+
+
+class HGConfigError(ValueError):
+
+    def __init__(self, errors, source=None):
+        """
+        Every problem found in the target sections, raised before any monitor is created
+
+        :param errors: list of "[section] KEY: problem" messages
+        :param source: file the sections were read from
+        """
+        self.errors = list(errors)
+        self.source = source
+
+        where = f" in {source}" if source else ""
+        super().__init__(f"{len(self.errors)} invalid target setting(s){where}:\n" + "\n".join(self.errors))
+
+
+@dataclass(frozen=True, slots=True)
+class HGTarget:
+    name: str
+    service: HGService
+    interval: float
+    timeout: float = 2.0  # <-- deadline of one probe, DNS, connect and body read included
+    alert: bool = False
+    alert_service: str = "PUSHOVER"
+    alert_throttle: float = None
+    failure_count: int = 3
+    result_window: int = 100
+    port: int = None
+    ms_check: bool = False
+    ms_value: int = 0
+    ms_calc: HGMsCalc = HGMsCalc.GT
+    ms_phase: str = "total"
+    loop_lag_limit: float = 100.0
+    expected_response_text: str = None
+    body_mode: str = "head"  # <-- AUTO is resolved when the section is compiled
+    body_limit: int = 65536
+    adaptive: bool = False
+    max_interval: float = None
+    confirm_interval: float = None
+    stable_count: int = 10
+    backoff: float = 2.0
+    depends_on: tuple = ()
+    canary_interval: float = None  # <-- None uses the monitor's dependency_canary_interval
+    url: str = None  # <-- probed URL of HTTP, HTTPS and WAN targets
+
+
+FIELDS = tuple(field.name for field in fields(HGTarget))
+SERVICES = {service.value: service for service in HGService}
+MS_CALCS = {calc.value: calc for calc in HGMsCalc}
+KEYS = frozenset(FIELDS) - {"name", "url"} | {"expected_status_code"}  # <-- documented, not implemented yet
+
+
+class _Section:
+    __slots__ = ("name", "options", "errors")
+
+    def __init__(self, name, options, errors):
+        self.name = name
+        self.options = options
+        self.errors = errors
+
+    def value(self, key, convert, default=None, minimum=None, required=False):
+        raw = self.options.get(key)
+        if raw is None or str(raw).strip() == "":
+            if required:
+                self.errors.append(f"[{self.name}] {key.upper()}: missing")
+            return default
+
+        try:
+            value = convert(str(raw).strip())
+        except (TypeError, ValueError):
+            self.errors.append(f"[{self.name}] {key.upper()}: {raw!r} is not {_DESCRIPTIONS[convert]}")
+            return default
+
+        if minimum is not None and value < minimum:
+            self.errors.append(f"[{self.name}] {key.upper()}: {raw!r} must be at least {minimum}")
+            return default
+        return value
+
+    def choice(self, key, choices, default, normalise=str.upper):
+        raw = self.options.get(key)
+        if raw is None or str(raw).strip() == "":
+            return default
+
+        value = normalise(str(raw).strip())
+        if value not in choices:
+            self.errors.append(f"[{self.name}] {key.upper()}: {raw!r} is not one of "
+                               f"{', '.join(str(choice).upper() for choice in choices)}")
+            return default
+        return value
+
+
+def _boolean(value):
+    if value.lower() not in _BOOLEANS:
+        raise ValueError(value)
+    return _BOOLEANS[value.lower()]
+
+
+def _port(value):
+    port = int(value)
+    if not 0 < port < 65536:
+        raise ValueError(value)
+    return port
+
+
+_DESCRIPTIONS = {int: "a whole number", float: "a number", _boolean: "TRUE or FALSE", _port: "a port number"}
+
+
+def compile_target(name, options, errors=None):
+    """
+    Validated HGTarget of one targets.ini section, problems are appended to errors or raised as HGConfigError
+
+    :param name: section name, the probed host
+    :param options: option dict of the section, keys in any case
+    :param errors: list collecting the problems of several sections, None raises right away
+    """
+    collected = [] if errors is None else errors
+    found = len(collected)
+    section = _Section(name, {str(key).lower(): value for key, value in options.items()}, collected)
+
+    if not str(section.options.get("service") or "").strip():
+        collected.append(f"[{name}] SERVICE: missing")
+    service = SERVICES[section.choice("service", SERVICES, "HTTP")]
+
+    interval = section.value("interval", float, 5.0, required=True)
+    if interval <= 0:
+        collected.append(f"[{name}] INTERVAL: must be above 0")
+
+    timeout = section.value("timeout", float, 2.0)
+    if timeout <= 0:
+        collected.append(f"[{name}] TIMEOUT: must be above 0")
+
+    expected = section.options.get("expected_response_text")
+    body_mode = section.choice("body_mode", BODY_MODES, "auto", normalise=str.lower)
+    if body_mode == "auto":
+        # cheapest read that still satisfies the configured checks
+        body_mode = "full" if service is HGService.WAN else "stream" if expected else "head"
+    elif service is HGService.WAN and body_mode != "full":
+        collected.append(f"[{name}] BODY_MODE: WAN compares the whole body, use FULL")
+    elif service is not HGService.ICMP and body_mode in ("head", "headers") and expected:
+        collected.append(f"[{name}] BODY_MODE: {body_mode.upper()} never reads EXPECTED_RESPONSE_TEXT, "
+                         f"use STREAM or FULL")
+    elif service is not HGService.ICMP and body_mode == "stream" and not expected:
+        collected.append(f"[{name}] BODY_MODE: STREAM needs EXPECTED_RESPONSE_TEXT")
+
+    port = section.value("port", _port)
+    if service is HGService.WAN:
+        url = WAN_URL
+    elif service is HGService.ICMP:
+        url = None
+    else:
+        url = f"{service.value}://{name}:{port or 443}"
+
+    target = HGTarget(name=name,
+                      service=service,
+                      interval=interval,
+                      timeout=timeout,
+                      alert=section.value("alert", _boolean, False),
+                      alert_service=str(section.options.get("alert_service") or "PUSHOVER").strip().upper(),
+                      alert_throttle=section.value("alert_throttle", float, 0.0, minimum=0) or None,
+                      failure_count=section.value("failure_count", int, 3, minimum=1),
+                      result_window=section.value("result_window", int, 100, minimum=1),
+                      port=port,
+                      ms_check=section.value("ms_check", _boolean, False),
+                      ms_value=section.value("ms_value", int, 0, minimum=0),
+                      ms_calc=MS_CALCS[section.choice("ms_calc", MS_CALCS, "gt", normalise=str.lower)],
+                      ms_phase=section.choice("ms_phase", PHASES, "total", normalise=str.lower),
+                      loop_lag_limit=section.value("loop_lag_limit", float, 100.0, minimum=0),
+                      expected_response_text=expected,
+                      body_mode=body_mode,
+                      body_limit=section.value("body_limit", int, 65536, minimum=1),
+                      adaptive=section.value("adaptive", _boolean, False),
+                      max_interval=section.value("max_interval", float, minimum=0) or None,
+                      confirm_interval=section.value("confirm_interval", float, minimum=0) or None,
+                      stable_count=section.value("stable_count", int, 10, minimum=1),
+                      backoff=section.value("backoff", float, 2.0, minimum=1),
+                      depends_on=tuple(dict.fromkeys(parent.strip() for parent in
+                                                     str(section.options.get("depends_on") or "").split(",")
+                                                     if parent.strip())),
+                      canary_interval=section.value("canary_interval", float, minimum=0),
+                      url=url)
+
+    if errors is None and len(collected) > found:
+        raise HGConfigError(collected)
+    return target
+
+
+def target_config(name, options=None, **defaults):
+    """
+    HGTarget passed to a service monitor, option dicts of monitors created on their own are compiled here
+
+    :param name: section name, the probed host
+    :param options: compiled HGTarget or option dict of the section
+    :param defaults: options of the monitor constructor used when the section does not set them
+    """
+    if isinstance(options, HGTarget):
+        return options
+
+    defaults = {key: value for key, value in defaults.items() if value is not None}
+    return compile_target(name, {**defaults, **{str(key).lower(): value for key, value in (options or {}).items()}})
+
+
+def dependency_cycle(parents):
+    """
+    First DEPENDS_ON cycle as a list of names starting and ending with the same target, None without a cycle
+
+    :param parents: mapping of target name to the names it depends on
+    """
+    # iterative depth first search, a target met again on the current path closes a cycle
+    visiting, visited = set(), set()
+    for start in parents:
+        if start in visited:
+            continue
+
+        path = [start]
+        stack = [iter(parents.get(start, ()))]
+        visiting.add(start)
+
+        while stack:
+            parent = next(stack[-1], None)
+
+            if parent is None:
+                visiting.discard(path[-1])
+                visited.add(path.pop())
+                stack.pop()
+            elif parent in visiting:
+                return path[path.index(parent):] + [parent]
+            elif parent not in visited:
+                visiting.add(parent)
+                path.append(parent)
+                stack.append(iter(parents.get(parent, ())))
+
+    return None
+
+
+def compile_sections(sections, source=None, internal_logger=None):
+    """
+    HGTargets of every section in order, all problems including DEPENDS_ON cycles are collected and raised together
+    as HGConfigError
+
+    :param sections: mapping of section name to its option dict or an already compiled HGTarget
+    :param source: file the sections were read from, named in the errors
+    :param internal_logger: Class access to store log files, unknown keys are logged as warnings
+    """
+    errors = []
+    targets = []
+    for name, options in sections.items():
+        if isinstance(options, HGTarget):
+            targets.append(options)
+            continue
+
+        if internal_logger is not None and not KEYS.issuperset(str(key).lower() for key in options):
+            unknown = sorted(str(key).upper() for key in options if str(key).lower() not in KEYS)
+            internal_logger.warning('Ignoring unknown key(s) %s of target %s', ', '.join(unknown), name)
+
+        targets.append(compile_target(name, options, errors))
+
+    names = {target.name for target in targets}
+    for target in targets:
+        unknown = [parent for parent in target.depends_on if parent not in names]
+        if unknown:
+            errors.append(f"[{target.name}] DEPENDS_ON: unknown target(s) {', '.join(unknown)}")
+
+    cycle = dependency_cycle({target.name: [parent for parent in target.depends_on if parent in names]
+                              for target in targets if target.depends_on})
+    if cycle:
+        errors.append(f"[{cycle[0]}] DEPENDS_ON: cycle {' -> '.join(cycle)}")
+
+    if errors:
+        raise HGConfigError(errors, source)
+    return targets
+
+
+def read_sections(path):
+    """
+    Option dicts of every section of a targets.ini, %-interpolation is only applied to values using it
+
+    :param path: targets.ini to read
+    """
+    configuration_parser = configparser.ConfigParser(strict=False)
+    with open(path, encoding="utf8") as targets_file:
+        configuration_parser.read_file(targets_file, source=str(path))
+
+    sections = {}
+    for host in configuration_parser.sections():
+        options = dict(configuration_parser.items(host, raw=True))
+        for key, value in options.items():
+            if "%" in value:
+                options[key] = configuration_parser.get(host, key)
+        sections[host] = options
+    return sections
+
+
+def cache_path(path):
+    # next to targets.ini, hidden so it is not mistaken for a second targets file
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.compiled")
+
+
+def load_targets(path, use_cache=True, internal_logger=None):
+    """
+    Compiled HGTargets of a targets.ini, reused from its cache file while the file content is unchanged
+
+    :param path: targets.ini to read
+    :param use_cache: read and write the compiled cache next to the file
+    :param internal_logger: Class access to store log files
+    """
+    with open(path, "rb") as targets_file:
+        digest = hashlib.sha256(targets_file.read()).hexdigest()
+
+    cached = cache_path(path)
+    if use_cache:
+        targets = _read_cache(cached, digest)
+        if targets is not None:
+            if internal_logger is not None:
+                internal_logger.debug('Loaded %s compiled target(s) from %s', len(targets), cached)
+            return targets
+
+    targets = compile_sections(read_sections(path), source=path, internal_logger=internal_logger)
+
+    if use_cache:
+        _write_cache(cached, digest, targets, internal_logger)
+    return targets
+
+
+def _read_cache(cached, digest):
+    try:
+        with open(cached, encoding="utf8") as cache_file:
+            content = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+    if content.get("version") != MODEL_VERSION or content.get("sha256") != digest \
+            or content.get("fields") != list(FIELDS):
+        return None
+
+    # already validated when the cache was written, only the enums and tuples are restored
+    service, ms_calc, depends_on = FIELDS.index("service"), FIELDS.index("ms_calc"), FIELDS.index("depends_on")
+
+    targets = []
+    for values in content["targets"]:
+        values[service] = SERVICES[values[service]]
+        values[ms_calc] = MS_CALCS[values[ms_calc]]
+        values[depends_on] = tuple(values[depends_on])
+        targets.append(HGTarget(*values))  # <-- positional, several times faster than keywords for 20k targets
+    return targets
+
+
+def _write_cache(cached, digest, targets, internal_logger=None):
+    content = {"version": MODEL_VERSION,
+               "sha256": digest,
+               "fields": list(FIELDS),
+               "targets": [[getattr(target, name) for name in FIELDS] for target in targets]}
+
+    # a read only config directory only costs the next startup a compile
+    temporary = f"{cached}.{os.getpid()}.tmp"
+    try:
+        # dumps uses the C encoder, dump would encode the whole list in Python
+        with open(temporary, "w", encoding="utf8") as cache_file:
+            cache_file.write(json.dumps(content, separators=(",", ":")))
+        os.replace(temporary, cached)
+    except OSError as e:
+        if internal_logger is not None:
+            internal_logger.debug('Compiled targets not cached in %s: %s', cached, e)
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
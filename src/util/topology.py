@@ -0,0 +1,185 @@
+from src.util.result_handler import RESULT_SUCCESS
+from src.util.target_model import dependency_cycle
+
+
+def dependency_graph(targets):
+    """
+    Parents of every target with DEPENDS_ON, raises ValueError for unknown parents and dependency cycles
+
+    :param targets: iterable of compiled HGTargets
+    """
+    targets = list(targets)
+    names = {target.name for target in targets}
+
+    parents = {}
+    for target in targets:
+        unknown = [parent for parent in target.depends_on if parent not in names]
+        if unknown:
+            raise ValueError(f"DEPENDS_ON of {target.name} names unknown target(s) {', '.join(unknown)}")
+
+        if target.depends_on:
+            parents[target.name] = target.depends_on
+
+    cycle = dependency_cycle(parents)
+    if cycle:
+        raise ValueError(f"DEPENDS_ON cycle {' -> '.join(cycle)}")
+
+    return parents
+
+
+class HGTopology:
+
+    def __init__(self, canary_interval: float = 60, on_canary=None, max_listed: int = 10, internal_logger=None):
+        """
+        Parent/child graph of the DEPENDS_ON targets, the dependents of a down parent are only probed by a slow
+        canary and their alerts are folded into the parent's
+
+        :param canary_interval: seconds between the canary probes of a dependent target, 0 pauses it
+        :param on_canary: callable(target, interval) slowing a target down, interval None resumes normal probing
+        :param max_listed: dependents named in the alert of a down parent, the rest are counted
+        :param internal_logger: Class access to store log files
+        """
+        self.canary_interval = canary_interval
+        self.max_listed = max_listed
+        self._on_canary = on_canary
+        self._internal_logger = internal_logger
+
+        self._parents = {}  # <-- target: tuple of the targets it depends on
+        self._children = {}  # <-- parent: set of the targets depending on it
+        self._failure_count = {}  # <-- parent: FAILURE_COUNT consecutive failures marking it down
+        self._canary = {}  # <-- dependent: canary interval
+        self._failures = {}  # <-- parent: consecutive failures
+        self._down = set()
+        self._paused = set()
+        self.folded = {}  # <-- failing parent: dependent alerts folded into it
+
+    @property
+    def down(self):
+        return frozenset(self._down)
+
+    @property
+    def paused(self):
+        return frozenset(self._paused)
+
+    @property
+    def statistics(self):
+        return {"dependents": len(self._parents),
+                "parents": len(self._children),
+                "down": sorted(self._down),
+                "paused": len(self._paused),
+                "folded": sum(self.folded.values()),
+                }
+
+    def load(self, targets, restarted=()):
+        """
+        Build and validate the graph of the current targets, the state of the parents still present is kept
+
+        :param targets: iterable of compiled HGTargets
+        :param restarted: targets whose monitor was recreated and has to be slowed down again
+        """
+        targets = list(targets)
+        parents = dependency_graph(targets)
+        options = {target.name: target for target in targets}
+
+        children = {}
+        for child, its_parents in parents.items():
+            for parent in its_parents:
+                children.setdefault(parent, set()).add(child)
+
+        self._parents = parents
+        self._children = children
+        self._failure_count = {parent: options[parent].failure_count for parent in children}
+        self._canary = {child: self.canary_interval if options[child].canary_interval is None
+                        else options[child].canary_interval for child in parents}
+        self._failures = {parent: count for parent, count in self._failures.items() if parent in children}
+        self._down &= children.keys()
+        self._paused = {target for target in self._paused if target in options and target not in restarted}
+
+        self._update()
+        return parents
+
+    def descendants(self, roots):
+        found = set()
+        pending = [child for root in roots for child in self._children.get(root, ())]
+
+        while pending:
+            target = pending.pop()
+            if target not in found:
+                found.add(target)
+                pending.extend(self._children.get(target, ()))
+
+        return found
+
+    def _update(self):
+        paused = self.descendants(self._down)
+
+        if self._on_canary is not None:
+            for target in paused - self._paused:
+                self._on_canary(target, self._canary[target])
+            for target in self._paused - paused:
+                self._on_canary(target, None)
+
+        self._paused = paused
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        if target not in self._children:
+            return
+
+        if status == RESULT_SUCCESS:
+            self._failures[target] = 0
+            folded = self.folded.pop(target, 0)
+
+            if target in self._down:
+                self._down.discard(target)
+                self._update()
+                self._internal_logger.info('%s recovered, normal probing of its dependents resumed, %s dependent '
+                                           'alert(s) were folded into its outage', target, folded)
+            return
+
+        self._failures[target] = self._failures.get(target, 0) + 1
+
+        if target not in self._down and self._failures[target] >= self._failure_count[target]:
+            self._down.add(target)
+            self._update()
+            self._internal_logger.warning('%s is down, %s dependent target(s) are only probed by a canary',
+                                          target, len(self.descendants({target})))
+
+    def _failing_ancestor(self, target):
+        pending = list(self._parents.get(target, ()))
+        seen = set()
+
+        while pending:
+            parent = pending.pop()
+            if self._failures.get(parent):
+                return parent
+
+            if parent not in seen:
+                seen.add(parent)
+                pending.extend(self._parents.get(parent, ()))
+
+        return None
+
+    def fold_alert(self, message, target=None):
+        """
+        Alert filter of the HGAlertDispatcher, drops the alerts of targets whose parent is failing and names the
+        paused dependents in the alert of a down parent
+        """
+        if target is None:
+            return message
+
+        # the parent's last probe already failed, the child is most likely down for the same reason
+        ancestor = self._failing_ancestor(target)
+        if ancestor is not None:
+            self.folded[ancestor] = self.folded.get(ancestor, 0) + 1
+            self._internal_logger.debug('Folded alert of %s into failing parent %s', target, ancestor)
+            return None
+
+        if target in self._down:
+            dependents = sorted(self.descendants({target}))
+            if dependents:
+                listed = ', '.join(dependents[:self.max_listed])
+                if len(dependents) > self.max_listed:
+                    listed += f' (+{len(dependents) - self.max_listed} more)'
+                return f'{message}\n{len(dependents)} dependent target(s) paused: {listed}'
+
+        return message
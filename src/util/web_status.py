@@ -0,0 +1,270 @@
+import asyncio
+import contextlib
+import json
+import math
+import os
+import time
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from src.util.result_handler import RESULT_SUCCESS
+
+
+def _finite(value):
+    # NaN is not valid JSON, targets without latency samples report null
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+
+def tail_lines(path, lines: int = 100, block_size: int = 8192):
+    """
+    Last lines of a file read backwards from its end, the cost depends on the lines requested and not the file size
+
+    :param path: file to read
+    :param lines: number of lines returned
+    :param block_size: bytes read per seek
+    """
+    with open(path, 'rb') as log_file:
+        position = log_file.seek(0, os.SEEK_END)
+        blocks = []
+        newlines = 0
+
+        while position > 0 and newlines <= lines:
+            read = min(block_size, position)
+            position -= read
+            log_file.seek(position)
+            block = log_file.read(read)
+            newlines += block.count(b'\n')
+            blocks.append(block)
+
+    data = b''.join(reversed(blocks))
+    return data.decode('utf8', errors='replace').splitlines()[-lines:]
+
+
+class HGResultFeed:
+
+    def __init__(self, client_queue_size: int = 1000):
+        """
+        Fans every posted result out to the connected live clients, each result is serialized once for all of them
+
+        :param client_queue_size: results buffered per client, a slow client loses results instead of growing memory
+        """
+        self.client_queue_size = client_queue_size
+        self._clients = set()
+        self.dropped = 0
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def on_result(self, target, status, latency, error_code, timestamp):
+        if not self._clients:
+            return
+
+        event = ('event: result\ndata: ' + json.dumps({"target": target,
+                                                      "status": status,
+                                                      "latency": _finite(latency),
+                                                      "error_code": error_code,
+                                                      "timestamp": timestamp}) + '\n\n').encode('utf8')
+
+        for client in self._clients:
+            try:
+                client.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def subscribe(self):
+        client = asyncio.Queue(maxsize=self.client_queue_size)
+        self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        self._clients.discard(client)
+
+
+class _HGEmbeddedServer(uvicorn.Server):
+    # the monitor owns the process signals (Ctrl+C, SIGHUP reload), uvicorn must not replace them
+
+    def install_signal_handlers(self):
+        pass
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+
+class HGWebStatus:
+
+    def __init__(self,
+                 results,
+                 log_file: str = None,
+                 metrics=None,
+                 instrumentation=None,
+                 host: str = "127.0.0.1",
+                 port: int = 8080,
+                 status_ttl: float = 1.0,
+                 max_tail_lines: int = 5000,
+                 keepalive: float = 15.0,
+                 internal_logger=None):
+        """
+        Status API served by uvicorn on the monitor's own event loop, it only reads what the monitors already collected
+
+        :param results: HGResultHandler of the running monitor
+        :param log_file: log file served by the tail endpoint
+        :param metrics: HGMetrics served in the Prometheus format on /metrics
+        :param instrumentation: HGInstrumentation whose statistics and profiler are served on /profiler
+        :param host: address the API listens on
+        :param port: port the API listens on
+        :param status_ttl: seconds a rendered status is reused by every client
+        :param max_tail_lines: upper bound of the lines returned by the tail endpoint
+        :param keepalive: seconds between keepalive comments on idle event streams
+        :param internal_logger: Class access to store log files
+        """
+        self.results = results
+        self.log_file = log_file
+        self.metrics = metrics
+        self.instrumentation = instrumentation
+        self.host = host
+        self.port = port
+        self.status_ttl = status_ttl
+        self.max_tail_lines = max_tail_lines
+        self.keepalive = keepalive
+        self._internal_logger = internal_logger
+
+        self.feed = HGResultFeed()
+        self.results.add_listener(self.feed.on_result)
+
+        self._status_cache = (0.0, None)  # <-- (monotonic render time, json bytes)
+        self._tail_cache = (None, [])  # <-- (log file mtime/size, lines)
+        self._server = None
+
+        self.app = self._build_app()
+
+    def target_status(self, target, buffer):
+        status = {name: _finite(value) for name, value in buffer.statistics.items()}
+        status.update({"target": target,
+                       "up": None if buffer.last_status is None else buffer.last_status == RESULT_SUCCESS,
+                       "last_success": buffer.last_success})
+        return status
+
+    def render_status(self):
+        rendered_at, rendered = self._status_cache
+
+        # every client polling inside the ttl gets the same rendered document
+        if rendered is None or time.monotonic() - rendered_at >= self.status_ttl:
+            rendered = json.dumps([self.target_status(target, buffer)
+                                   for target, buffer in list(self.results.results.items())]).encode('utf8')
+            self._status_cache = (time.monotonic(), rendered)
+
+        return rendered
+
+    def read_tail(self, lines):
+        stat = os.stat(self.log_file)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        cached_signature, cached_lines = self._tail_cache
+        if cached_signature != signature or len(cached_lines) < lines:
+            cached_lines = tail_lines(self.log_file, max(lines, len(cached_lines)))
+            self._tail_cache = (signature, cached_lines)
+
+        return cached_lines[-lines:]
+
+    async def _events(self, request: Request):
+        client = self.feed.subscribe()
+        try:
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(client.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+        finally:
+            self.feed.unsubscribe(client)
+
+    def _build_app(self):
+        app = FastAPI(title="HGServiceMonitor")
+
+        @app.get("/status")
+        async def status():
+            return Response(content=self.render_status(), media_type="application/json")
+
+        @app.get("/status/{target}")
+        async def status_target(target: str):
+            buffer = self.results.get_result(target)
+            if buffer is None:
+                raise HTTPException(status_code=404, detail=f"Unknown target {target}")
+            return self.target_status(target, buffer)
+
+        @app.get("/logs/tail")
+        async def logs_tail(lines: int = 100):
+            if not self.log_file:
+                raise HTTPException(status_code=404, detail="No log file configured")
+
+            lines = max(1, min(lines, self.max_tail_lines))
+            try:
+                # file reads stay off the event loop
+                tail = await asyncio.get_running_loop().run_in_executor(None, self.read_tail, lines)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail=f"{self.log_file} does not exist yet")
+
+            return PlainTextResponse("\n".join(tail))
+
+        @app.get("/metrics")
+        async def metrics():
+            if self.metrics is None:
+                raise HTTPException(status_code=404, detail="Metrics are disabled")
+            return PlainTextResponse(self.metrics.render(), media_type="text/plain; version=0.0.4")
+
+        @app.get("/profiler")
+        async def profiler():
+            if self.instrumentation is None:
+                raise HTTPException(status_code=404, detail="Instrumentation is disabled")
+            return self.instrumentation.statistics
+
+        @app.post("/profiler/start")
+        async def profiler_start(mode: str = "sample"):
+            if self.instrumentation is None:
+                raise HTTPException(status_code=404, detail="Instrumentation is disabled")
+            try:
+                started = self.instrumentation.start_profiler(mode)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if not started:
+                raise HTTPException(status_code=409, detail=f"The {self.instrumentation.profiler} profiler is "
+                                                            f"already running")
+            return {"profiler": mode}
+
+        @app.post("/profiler/stop")
+        async def profiler_stop():
+            if self.instrumentation is None or self.instrumentation.profiler is None:
+                raise HTTPException(status_code=409, detail="No profiler is running")
+            # cProfile can only be disabled from the event loop thread that enabled it
+            return {"profile": str(self.instrumentation.stop_profiler())}
+
+        @app.get("/profiler/collapsed")
+        async def profiler_collapsed():
+            collapsed = self.instrumentation and self.instrumentation.collapsed()
+            if collapsed is None:
+                raise HTTPException(status_code=404, detail="No sampling profile recorded yet")
+            return PlainTextResponse(collapsed)
+
+        @app.get("/events")
+        async def events(request: Request):
+            return StreamingResponse(self._events(request), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache"})
+
+        return app
+
+    async def serve(self):
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning",
+                                access_log=False, lifespan="off")
+        self._server = _HGEmbeddedServer(config)
+
+        self._internal_logger.info(f"HGServiceMonitor status API listening on http://{self.host}:{self.port}")
+        try:
+            await self._server.serve()
+        except SystemExit:
+            # uvicorn exits when the port cannot be bound, monitoring carries on without the API
+            self._internal_logger.error(f"HGServiceMonitor status API could not start on {self.host}:{self.port}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True